@@ -3,6 +3,11 @@ ASGI config for app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve with an ASGI server (e.g. ``uvicorn app.asgi:application``) so that
+the Server-Sent Events stream at /api/store/events/ runs on the event loop
+and idle subscribers do not each hold a worker thread. Set
+EVENTS_BACKEND=redis when running more than one worker process.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -14,3 +19,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_asgi_application()
+
+# Build the autocomplete index off the request path as soon as the worker starts.
+from store.autocomplete import product_index  # noqa: E402
+
+product_index.warm_in_background()
@@ -48,13 +48,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.tracing.TraceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.sharding.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.tracing.TraceViewMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -93,6 +96,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -132,6 +155,88 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# How core.views.serve_media hands files to the client: 'django' streams a
+# FileResponse, 'x-accel-redirect' delegates to nginx and 'x-sendfile' to
+# Apache/lighttpd.
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'django')
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+MEDIA_LEGACY_CACHE_MAX_AGE = 60 * 60
+
+# Chunked uploads (store.uploads). Chunks are kept outside MEDIA_ROOT so
+# they are never served before the upload is verified. Unfinished uploads
+# expire after CHUNKED_UPLOAD_EXPIRY and are removed by `gc_media`.
+CHUNKED_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'tmp', 'uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+CHUNKED_UPLOAD_MIN_CHUNK_SIZE = 256 * 1024
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+CHUNKED_UPLOAD_EXPIRY = timedelta(days=1)
+
+BULK_PRODUCT_MAX_ROWS = 50000
+
+PRODUCT_FACET_PRICE_BUCKETS = [0, 10, 25, 50, 100, 250, 500, 1000]
+PRODUCT_FACETS_CACHE_TIMEOUT = 300
+
+RECOMMENDATIONS_TOP_K = 10
+
+# Minimum seconds between background rebuilds of the autocomplete index
+# when another worker or a bulk write changed the catalog.
+AUTOCOMPLETE_REFRESH_INTERVAL = 60
+
+# Product view/add-to-cart counters (store.counters). 'local' buffers in
+# each worker process, 'redis' in a hash at REDIS_URL shared by all workers.
+PRODUCT_COUNTERS_BACKEND = os.environ.get('PRODUCT_COUNTERS_BACKEND', 'local')
+PRODUCT_COUNTERS_FLUSH_INTERVAL = 10
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_ADD_TO_CART_WEIGHT = 5
+TRENDING_RANKING_SIZE = 100
+
+# Delivered and cancelled orders older than this many months are moved to
+# the ArchivedOrder cold table by `manage.py archive_orders`.
+ORDER_ARCHIVE_AFTER_MONTHS = 12
+
+# Server-Sent Events for stock and order status. 'local' fans out within
+# one worker process, 'redis' relays through pub/sub at REDIS_URL so that
+# every worker sees every change.
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'local')
+EVENTS_HEARTBEAT_INTERVAL = 15
+EVENTS_MAX_PRODUCTS = 100
+
+# Prebuilt OpenAPI schema (core.openapi). Artifacts are regenerated when the
+# URL conf, the source of the apps behind it or APP_VERSION changes; set
+# APP_VERSION per release (e.g. to the git commit) to also cover changes
+# elsewhere, such as in installed libraries.
+APP_VERSION = os.environ.get('APP_VERSION', '')
+OPENAPI_SCHEMA_DIR = os.environ.get('OPENAPI_SCHEMA_DIR', os.path.join(BASE_DIR, 'build', 'openapi'))
+OPENAPI_SCHEMA_CACHE_MAX_AGE = 300
+
+# Payment processing (core.payments, `manage.py run_payment_worker`).
+PAYMENT_GATEWAYS = {
+    'simulated': {
+        'BACKEND': 'core.payments.SimulatedGateway',
+        'CONCURRENCY': 50,
+        'TIMEOUT': 10,
+        'OPTIONS': {'latency': 0.2, 'jitter': 0.1, 'failure_rate': 0.0, 'decline_rate': 0.0},
+    },
+}
+PAYMENT_DEFAULT_GATEWAY = os.environ.get('PAYMENT_DEFAULT_GATEWAY', 'simulated')
+PAYMENT_MAX_ATTEMPTS = 5
+PAYMENT_RETRY_BACKOFF = 2
+PAYMENT_CLAIM_TIMEOUT = 300
+PAYMENT_WORKER_BATCH_SIZE = 200
+PAYMENT_WORKER_FLUSH_INTERVAL = 0.5
+PAYMENT_WORKER_POLL_INTERVAL = 1
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -157,6 +262,9 @@ SIMPLE_JWT = {
 }
 
 SWAGGER_SETTINGS = {
+    # The UIs load the prebuilt schema (core.openapi) instead of asking
+    # drf-yasg to generate it on every page view.
+    'SPEC_URL': 'schema-json',
     'SECURITY_DEFINITIONS': {
         'Bearer': {
             'type': 'apiKey',
@@ -165,3 +273,44 @@ SWAGGER_SETTINGS = {
         }
     }
 }
+
+REDOC_SETTINGS = {
+    'SPEC_URL': 'schema-json',
+}
+
+# Sharding of user-owned data (core.sharding). Each alias in USER_SHARDS
+# other than 'default' gets a DATABASES entry like 'default', with the name
+# and host from <ALIAS>_DB_NAME and <ALIAS>_DB_HOST. Only ever append
+# aliases: a shard's position decides the id range it allocates from.
+USER_SHARDS = os.environ.get('USER_SHARDS', 'default').split(',')
+for _alias in USER_SHARDS:
+    DATABASES.setdefault(_alias, {
+        **DATABASES['default'],
+        'NAME': os.environ.get(f'{_alias.upper()}_DB_NAME', f"{DATABASES['default']['NAME']}-{_alias}"),
+        'HOST': os.environ.get(f'{_alias.upper()}_DB_HOST', DATABASES['default']['HOST']),
+    })
+DATABASE_ROUTERS = ['core.sharding.ShardRouter']
+USER_SHARD_CACHE_TIMEOUT = 300
+
+# Background maintenance (core.maintenance). Each job handles rows older
+# than max_age, and runs every `interval` seconds under
+# `run_maintenance --forever`; either falls back to the job's default.
+MAINTENANCE_JOBS = {
+    'abandoned_cart_items': {'max_age': timedelta(days=30), 'interval': 3600},
+    'empty_carts': {'max_age': timedelta(days=7), 'interval': 3600},
+    'expire_pending_orders': {'max_age': timedelta(days=2), 'interval': 600},
+    'unused_addresses': {'max_age': timedelta(days=365), 'interval': 86400},
+}
+MAINTENANCE_BATCH_SIZE = 500
+MAINTENANCE_MAX_ROWS_PER_SECOND = 2000
+MAINTENANCE_LOCK_TIMEOUT_MS = 2000
+
+# Request tracing (core.tracing) and the on-demand profiler (core.profiler).
+# Tracing instruments Django and DRF at startup, so it is opt-in.
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', '0') == '1'
+TRACING_SAMPLE_RATE = float(os.environ.get('TRACING_SAMPLE_RATE', '0.01'))
+TRACING_MAX_PER_SECOND = 5
+TRACING_SLOW_REQUEST_MS = 500
+PROFILER_MAX_SECONDS = 60
+PROFILER_INTERVAL_MS = 10
+PROFILER_RESULT_TIMEOUT = 3600
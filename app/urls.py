@@ -17,19 +17,15 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
-from drf_yasg import openapi
+from django.urls import path, include, re_path
 from drf_yasg.views import get_schema_view
 from rest_framework.permissions import AllowAny
 
+from core.openapi import SCHEMA_INFO
+from core.views import prebuilt_schema, schema_document, serve_media
+
 schema_view = get_schema_view(
-    openapi.Info(
-        title='Event Manager API',
-        default_version='v1',
-        description='This is the API for event manager application',
-        terms_of_service='https://www.google.com/policies/terms/',
-        contact=openapi.Contact(email='user@example.com')
-    ),
+    SCHEMA_INFO,
     public=True,
     permission_classes=(AllowAny,)
 )
@@ -38,9 +34,11 @@ urlpatterns = [
                   path('admin/', admin.site.urls),
                   path('api/user/', include('user.urls')),
                   path('api/store/', include('store.urls')),
-                  path('docs/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger'),
-                  path('docs-redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+                  path('docs/openapi.json', schema_document, {'fmt': 'json'}, name='schema-json'),
+                  path('docs/openapi.yaml', schema_document, {'fmt': 'yaml'}, name='schema-yaml'),
+                  path('docs/', prebuilt_schema(schema_view.with_ui('swagger', cache_timeout=0)),
+                       name='schema-swagger'),
+                  path('docs-redoc/', prebuilt_schema(schema_view.with_ui('redoc', cache_timeout=0)),
+                       name='schema-redoc'),
+                  re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), serve_media, name='media'),
               ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
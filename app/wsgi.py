@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+# Build the autocomplete index off the request path as soon as the worker starts.
+from store.autocomplete import product_index  # noqa: E402
+
+product_index.warm_in_background()
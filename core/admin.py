@@ -1,17 +1,141 @@
 """
 Django admin customization.
+
+Sharded models (core.sharding) are browsed one shard at a time, picked with
+the shard filter. Their rows refer to users and products on 'default' by
+id only, so those are prefetched rather than joined.
 """
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import QueryDict
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 
-from core import models
+from core import models, sharding
+
+SHARD_PARAM = 'shard'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts the Postgres planner's row estimate for large,
+    unfiltered changelists instead of running an exact COUNT(*).
+    """
+    exact_count_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.exact_count_threshold:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables that grow without bound."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+def admin_shard(request):
+    """The shard a sharded admin page works on: the shard filter's, else the first shard."""
+    alias = getattr(request, '_admin_shard', None)
+    if alias is None:
+        alias = (request.GET.get(SHARD_PARAM)
+                 or QueryDict(request.GET.get('_changelist_filters', '')).get(SHARD_PARAM))
+    shards = sharding.all_shards()
+    return alias if alias in shards else shards[0]
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Picks the shard; the choice itself is applied by ShardedAdmin.get_queryset."""
+    title = _('shard')
+    parameter_name = SHARD_PARAM
+
+    def __init__(self, request, *args, **kwargs):
+        super().__init__(request, *args, **kwargs)
+        self.selected = admin_shard(request)
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.all_shards()]
+
+    def has_output(self):
+        return len(self.lookup_choices) > 1
+
+    def queryset(self, request, queryset):
+        return queryset
+
+    def choices(self, changelist):
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == self.selected,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class ShardedAdmin(LargeTableAdmin):
+    """
+    Admin of a sharded model. `list_prefetch_related` fetches relations on
+    'default' without joining; `user_lookup` is the path to the owning
+    user's id, searched by exact email.
+    """
+    user_lookup = 'user_id'
+    # Not False: the changelist would then join every relation in list_display.
+    list_select_related = ()
+    list_prefetch_related = []
+
+    def get_list_filter(self, request):
+        return [ShardFilter, *super().get_list_filter(request)]
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).using(admin_shard(request))
+        return queryset.prefetch_related(*self.list_prefetch_related)
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is None:
+            # A link without the right shard, e.g. from another admin page.
+            for alias in sharding.all_shards():
+                request._admin_shard = alias
+                obj = super().get_object(request, object_id, from_field)
+                if obj is not None:
+                    break
+            else:
+                request._admin_shard = None
+        if obj is not None:
+            # Inlines and related lookups on this page follow the object.
+            request._admin_shard = obj._state.db
+        return obj
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term.strip():
+            # Users live on 'default': look the email up there, then match by id.
+            user_ids = models.User.objects.filter(email__iexact=search_term.strip()).values_list('pk', flat=True)
+            results |= queryset.filter(**{f'{self.user_lookup}__in': list(user_ids)})
+        return results, may_have_duplicates
 
 
 class UserAdmin(BaseUserAdmin):
     """Define the admin pages for users."""
     ordering = ['id']
     list_display = ['email', 'name']
+    list_filter = ['is_staff', 'is_superuser', 'is_active']
+    search_fields = ['=email', 'name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     fieldsets = (
         (None, {'fields': ('email', 'password')}),
         (_('Personal Info'), {'fields': ('name',)}),
@@ -44,12 +168,131 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
-admin.site.register(models.User)
-admin.site.register(models.Category)
-admin.site.register(models.Product)
-admin.site.register(models.Cart)
-admin.site.register(models.CartItem)
-admin.site.register(models.ShippingAddress)
-admin.site.register(models.Order)
-admin.site.register(models.OrderItem)
-admin.site.register(models.Payment)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
+    ordering = ['name']
+
+
+class ProductAdmin(LargeTableAdmin):
+    list_display = ['name', 'sku', 'category', 'price', 'quantity', 'create_date']
+    list_select_related = ['category']
+    list_filter = ['category']
+    search_fields = ['=sku', '^name']
+    date_hierarchy = 'create_date'
+    autocomplete_fields = ['category']
+
+
+class CartAdmin(ShardedAdmin):
+    list_display = ['id', 'user', 'created_at']
+    list_prefetch_related = ['user']
+    search_fields = ['=id']
+    raw_id_fields = ['user']
+
+
+class CartItemAdmin(ShardedAdmin):
+    list_display = ['id', 'cart', 'product', 'quantity']
+    list_select_related = ['cart']
+    list_prefetch_related = ['cart__user', 'product']
+    user_lookup = 'cart__user_id'
+    search_fields = ['=cart__id']
+    raw_id_fields = ['cart', 'product']
+
+
+class ShippingAddressAdmin(ShardedAdmin):
+    list_display = ['id', 'user', 'city', 'country']
+    list_prefetch_related = ['user']
+    search_fields = ['=postal_code']
+    raw_id_fields = ['user']
+
+
+class OrderItemInline(admin.TabularInline):
+    model = models.OrderItem
+    raw_id_fields = ['product']
+    extra = 0
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(admin_shard(request)).prefetch_related('product')
+
+
+class OrderAdmin(ShardedAdmin):
+    list_display = ['id', 'user', 'status', 'total_price', 'created_at']
+    list_prefetch_related = ['user']
+    list_filter = ['status']
+    search_fields = ['=id']
+    date_hierarchy = 'created_at'
+    raw_id_fields = ['user', 'cart', 'shipping_address']
+    inlines = [OrderItemInline]
+
+
+class OrderItemAdmin(ShardedAdmin):
+    list_display = ['id', 'order', 'product', 'quantity', 'price']
+    list_select_related = ['order']
+    list_prefetch_related = ['order__user', 'product']
+    user_lookup = 'order__user_id'
+    search_fields = ['=order__id']
+    raw_id_fields = ['order', 'product']
+
+
+class PaymentAdmin(ShardedAdmin):
+    list_display = ['id', 'order', 'payment_method', 'amount', 'payment_status', 'provider', 'attempts',
+                    'payment_date']
+    list_select_related = ['order']
+    list_prefetch_related = ['order__user']
+    user_lookup = 'order__user_id'
+    list_filter = ['payment_status']
+    search_fields = ['=order__id']
+    date_hierarchy = 'payment_date'
+    raw_id_fields = ['order']
+
+
+class ArchivedOrderAdmin(ShardedAdmin):
+    list_display = ['id', 'user', 'status', 'total_price', 'created_at', 'archived_at']
+    list_prefetch_related = ['user']
+    list_filter = ['status']
+    search_fields = ['=id']
+    raw_id_fields = ['user']
+
+    def has_add_permission(self, request):
+        return False
+
+
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'kind', 'product', 'category', 'value', 'starts_at', 'ends_at', 'is_active']
+    list_select_related = ['product', 'category']
+    list_filter = ['kind', 'is_active']
+    search_fields = ['name']
+    raw_id_fields = ['product']
+    autocomplete_fields = ['category']
+
+
+class UserShardAdmin(admin.ModelAdmin):
+    list_display = ['user', 'alias', 'moved_at']
+    list_select_related = ['user']
+    list_filter = ['alias']
+    search_fields = ['=user__email']
+    raw_id_fields = ['user']
+    # Moving a user means moving their rows; see rebalance_user_shards.
+    readonly_fields = ['alias', 'moved_at']
+
+
+class ChunkedUploadAdmin(admin.ModelAdmin):
+    list_display = ['id', 'filename', 'user', 'size', 'status', 'created_at']
+    list_select_related = ['user']
+    list_filter = ['status']
+    raw_id_fields = ['user']
+
+
+admin.site.register(models.User, UserAdmin)
+admin.site.register(models.Category, CategoryAdmin)
+admin.site.register(models.Product, ProductAdmin)
+admin.site.register(models.Cart, CartAdmin)
+admin.site.register(models.CartItem, CartItemAdmin)
+admin.site.register(models.ShippingAddress, ShippingAddressAdmin)
+admin.site.register(models.Order, OrderAdmin)
+admin.site.register(models.OrderItem, OrderItemAdmin)
+admin.site.register(models.Payment, PaymentAdmin)
+admin.site.register(models.ChunkedUpload, ChunkedUploadAdmin)
+admin.site.register(models.ArchivedOrder, ArchivedOrderAdmin)
+admin.site.register(models.Promotion, PromotionAdmin)
+admin.site.register(models.UserShard, UserShardAdmin)
@@ -0,0 +1,127 @@
+"""
+Cold storage for old orders.
+
+`archive_orders` moves delivered and cancelled orders older than a cutoff
+out of core_order, core_orderitem and core_payment into ArchivedOrder, one
+keyset batch per transaction, so the live tables (and their indexes,
+vacuum and backups) only hold recent and still open orders. Each archived
+row keeps the order's item snapshot, with each line's total added, and
+its payment, so history and the sales rollups can be served from it
+without the original rows.
+
+On Postgres ArchivedOrder is declaratively range partitioned by month of
+`created_at`; `ensure_partitions` creates the monthly partitions a batch
+needs before it is inserted, and old months can later be detached or
+dropped as a whole.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.models import ArchivedOrder, Order, OrderItem, Payment
+
+ARCHIVABLE_STATUSES = ('Delivered', 'Cancelled')
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=getattr(value, 'tzinfo', None))
+
+
+def add_months(value, months):
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def partition_name(month):
+    return f'{ArchivedOrder._meta.db_table}_y{month.year}m{month.month:02d}'
+
+
+def ensure_partitions(dates, using=DEFAULT_DB_ALIAS):
+    """Create the monthly partitions covering `dates` (Postgres only)."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    table = connection.ops.quote_name(ArchivedOrder._meta.db_table)
+    with connection.cursor() as cursor:
+        for month in sorted({month_start(value) for value in dates}):
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {connection.ops.quote_name(partition_name(month))} '
+                f'PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)',
+                [month, add_months(month, 1)],
+            )
+
+
+def archivable_orders(cutoff, using=DEFAULT_DB_ALIAS):
+    return Order.objects.using(using).filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff)
+
+
+def archive_batch(cutoff, after_id, batch_size, using=DEFAULT_DB_ALIAS):
+    """
+    Archive the next `batch_size` eligible orders with id > `after_id` on
+    the `using` shard.
+
+    Returns (archived count, last id seen); the last id is None when no
+    eligible orders are left.
+    """
+    with transaction.atomic(using=using):
+        orders = list(
+            archivable_orders(cutoff, using).filter(id__gt=after_id).order_by('id')
+            .select_for_update()[:batch_size]
+        )
+        if not orders:
+            return 0, None
+        ids = [order.id for order in orders]
+        payments = {
+            payment['order_id']: payment
+            for payment in Payment.objects.using(using).filter(order_id__in=ids)
+            .values('order_id', 'payment_method', 'amount', 'payment_status', 'payment_date')
+        }
+
+        line_totals = {
+            (order_id, product_id): str(price)
+            for order_id, product_id, price in OrderItem.objects.using(using).filter(order_id__in=ids)
+            .values_list('order_id', 'product_id', 'price')
+        }
+
+        ensure_partitions((order.created_at for order in orders), using)
+        ArchivedOrder.objects.using(using).bulk_create([
+            ArchivedOrder(
+                id=order.id,
+                user_id=order.user_id,
+                status=order.status,
+                total_price=order.total_price,
+                discount_total=order.discount_total,
+                shipping_address_id=order.shipping_address_id,
+                created_at=order.created_at,
+                items_snapshot=[
+                    {**item, 'total': line_totals.get((order.id, item['id']))} for item in order.items_snapshot
+                ],
+                item_count=order.item_count,
+                payment_status=order.payment_status,
+                payment=_payment_json(payments.get(order.id)),
+            )
+            for order in orders
+        ])
+        OrderItem.objects.using(using).filter(order_id__in=ids).delete()
+        Payment.objects.using(using).filter(order_id__in=ids).delete()
+        Order.objects.using(using).filter(id__in=ids).delete()
+    return len(orders), ids[-1]
+
+
+def archived_item_revenue(item):
+    """Revenue of one archived snapshot line, as OrderItem.price recorded it."""
+    if item.get('total') is not None:
+        return Decimal(item['total'])
+    return Decimal(item['price']) * item['quantity']
+
+
+def _payment_json(payment):
+    if payment is None:
+        return None
+    return {
+        'method': payment['payment_method'],
+        'amount': str(payment['amount']),
+        'status': payment['payment_status'],
+        'date': payment['payment_date'].isoformat(),
+    }
@@ -0,0 +1,52 @@
+"""
+Catalog cache versioning.
+
+Cached data derived from products or categories is keyed on the current
+catalog version, so invalidating all of it is a single counter bump.
+Compiled promotion rules are keyed on a separate promotion version, so
+stock changes do not invalidate them.
+"""
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+PROMOTION_VERSION_KEY = 'promotions:version'
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def _bump(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+def catalog_version():
+    return _version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    return _bump(CATALOG_VERSION_KEY)
+
+
+def promotion_version():
+    return _version(PROMOTION_VERSION_KEY)
+
+
+def bump_promotion_version():
+    return _bump(PROMOTION_VERSION_KEY)
+
+
+def invalidation_events(product_ids=(), category_ids=()):
+    """Cache tags affected by a catalog write, for clients and CDNs to purge."""
+    return (
+        [f'product:{product_id}' for product_id in product_ids]
+        + [f'category:{category_id}' for category_id in sorted(set(category_ids))]
+    )
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register(Tags.caches)
+def check_shard_directory_cache(app_configs, **kwargs):
+    """The user shard directory cache must be shared once there is more than one shard."""
+    if len(settings.USER_SHARDS) < 2 or settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Error(
+        'USER_SHARDS lists several shards but the default cache is local to each process.',
+        hint='Set REDIS_URL so every worker sees a moved user\'s new shard at once.',
+        obj='USER_SHARDS',
+        id='core.E001',
+    )]
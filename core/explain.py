@@ -0,0 +1,131 @@
+"""
+EXPLAIN capture and index suggestions for captured queries.
+
+`explain` runs a query's plan (EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on
+Postgres, EXPLAIN QUERY PLAN elsewhere) and returns the sequential scans
+and explicit sorts in it. For a Postgres sequential scan the filter and
+any sort above it are turned into a suggested index: equality columns
+first, then sort keys, then range columns, as a partial index when the
+filter pins a column to a literal (e.g. status = 'Pending').
+"""
+import json
+import re
+from dataclasses import dataclass, field
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+_COMPARISON = re.compile(
+    r"\(?(?:\w+\.)?\"?(\w+)\"?\)?(?:::\w+(?: \w+)*)?\s*(=|<>|>=|<=|<|>|~~\*?)\s*(\(?'(?:[^']|'')*'(?:::[\w ]+)?\)?|[^\s)]+)")
+_SORT_KEY = re.compile(r"^(?:\w+\.)?\"?(\w+)\"?(?: (DESC))?")
+
+
+class _Rollback(Exception):
+    pass
+
+
+@dataclass
+class Finding:
+    kind: str
+    table: str
+    detail: str
+    rows: int = 0
+    suggestion: str = ''
+    columns: list = field(default_factory=list)
+
+
+def explain(sql, analyze=True, using=DEFAULT_DB_ALIAS):
+    """Return the Findings for one SELECT statement run on `using`."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+        plan = _run(f'EXPLAIN ({options}) {sql}', using)[0][0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        findings = []
+        _walk_postgres(plan[0]['Plan'], findings, sort_keys=[])
+        return findings
+    if connection.vendor == 'sqlite':
+        return [
+            _sqlite_finding(detail)
+            for _, _, _, detail in _run(f'EXPLAIN QUERY PLAN {sql}', using)
+            if (detail.startswith('SCAN ') and ' USING ' not in detail) or 'TEMP B-TREE' in detail
+        ]
+    return []
+
+
+def _run(sql, using):
+    # ANALYZE executes the statement; never let that leave a trace.
+    rows = None
+    try:
+        with transaction.atomic(using=using):
+            with connections[using].cursor() as cursor:
+                cursor.execute(sql)
+                rows = cursor.fetchall()
+            raise _Rollback
+    except _Rollback:
+        pass
+    return rows
+
+
+def _sqlite_finding(detail):
+    if 'TEMP B-TREE' in detail:
+        return Finding('sort', '', detail)
+    table = detail.split()[1]
+    return Finding('seq_scan', table, detail)
+
+
+def _walk_postgres(node, findings, sort_keys):
+    node_type = node.get('Node Type')
+    if node_type in ('Sort', 'Incremental Sort'):
+        sort_keys = node.get('Sort Key', [])
+        findings.append(Finding('sort', '', ', '.join(sort_keys), rows=node.get('Actual Rows', node['Plan Rows'])))
+    elif node_type == 'Seq Scan':
+        findings.append(_seq_scan_finding(node, sort_keys))
+    for child in node.get('Plans', []):
+        _walk_postgres(child, findings, sort_keys if node_type != 'Seq Scan' else [])
+
+
+def _seq_scan_finding(node, sort_keys):
+    table = node['Relation Name']
+    condition = node.get('Filter', '')
+    rows = node.get('Actual Rows', node['Plan Rows']) + node.get('Rows Removed by Filter', 0)
+    finding = Finding('seq_scan', table, condition or 'full table', rows=rows)
+
+    equal, ranges, predicate = [], [], []
+    for column, operator, value in _COMPARISON.findall(condition):
+        if operator == '=' and value.lstrip('(').startswith("'"):
+            predicate.append(f'{column} = {value.strip("()").split("::")[0]}')
+        elif operator == '=':
+            equal.append(column)
+        elif operator in ('>=', '<=', '<', '>'):
+            ranges.append(column)
+    ordering = []
+    for key in sort_keys:
+        match = _SORT_KEY.match(key)
+        if match:
+            ordering.append(f'{match.group(1)} DESC' if match.group(2) else match.group(1))
+
+    columns = list(dict.fromkeys(equal + ordering + ranges))
+    if not columns and predicate:
+        columns = [predicate[0].split(' = ')[0]]
+        predicate = []
+    if columns:
+        finding.columns = columns
+        name = '_'.join(column.split()[0] for column in columns)[:40]
+        finding.suggestion = (
+            f'CREATE INDEX CONCURRENTLY {table}_{name}_idx ON {table} ({", ".join(columns)})'
+            + (f' WHERE {" AND ".join(predicate)}' if predicate else '')
+        )
+    return finding
+
+
+def table_rows(table, using=DEFAULT_DB_ALIAS):
+    """Planner row estimate for `table` (Postgres), or an exact count elsewhere."""
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            return max(row[0], 0) if row else 0
+        cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+        return cursor.fetchone()[0]
@@ -0,0 +1,261 @@
+"""
+Background maintenance of user-owned tables.
+
+Each job finds rows that are no longer useful (items in carts nobody has
+touched for weeks, empty carts, orders that were never paid, addresses
+never shipped to) and deletes or expires them a small batch at a time:
+
+- candidates are read in primary key order after the last key seen
+  (keyset pagination), so no batch rescans what earlier ones covered;
+- each batch is one short transaction that takes the row locks with
+  SKIP LOCKED, so rows live traffic is working on are left for the next
+  run, and on Postgres with a lock_timeout, so a job waiting on a lock
+  gives up the batch instead of queueing live traffic behind it;
+- a rate limit caps the rows processed per second.
+
+Jobs run on every shard (core.sharding). `run_maintenance` runs them once
+or, with --forever, every `interval` seconds. Each job has a default
+max_age and interval; MAINTENANCE_JOBS[name] can override either.
+"""
+import abc
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connections, transaction
+from django.db.models import Exists, F, OuterRef, Sum
+from django.utils import timezone
+
+from core import sharding
+from core.cache import bump_catalog_version
+from core.models import ArchivedOrder, Cart, CartItem, Order, OrderItem, Payment, Product, ShippingAddress
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT_BACKOFF = 1.0
+
+
+@dataclass
+class JobStats:
+    job: str
+    shard: str
+    batches: int = 0
+    scanned: int = 0
+    affected: int = 0
+    skipped: int = 0
+    lock_timeouts: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.scanned / self.elapsed if self.elapsed else 0.0
+
+
+class RateLimiter:
+    """Sleep as needed to stay under `per_second` rows."""
+
+    def __init__(self, per_second):
+        self.per_second = per_second
+        self.started = time.monotonic()
+        self.rows = 0
+
+    def wait(self, rows):
+        if not self.per_second:
+            return
+        self.rows += rows
+        delay = self.started + self.rows / self.per_second - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Job(abc.ABC):
+    """A keyset-batched clean-up of one model; subclasses define what and how."""
+    name = None
+    model = None
+    verb = 'deleted'
+    help = ''
+    max_age = None
+    interval = 3600
+
+    def __init__(self, max_age=None, interval=None):
+        if max_age is not None:
+            self.max_age = max_age
+        if interval is not None:
+            self.interval = interval
+
+    @abc.abstractmethod
+    def candidates(self, cutoff):
+        """Rows eligible at `cutoff`; also re-checked under lock."""
+
+    def apply(self, ids, using):
+        """Process the locked rows `ids` and return how many were affected."""
+        return self.model.objects.using(using).filter(pk__in=ids).delete()[0]
+
+
+class AbandonedCartItems(Job):
+    name = 'abandoned_cart_items'
+    model = CartItem
+    max_age = timedelta(days=30)
+    help = 'Empty carts that have not changed for max_age.'
+
+    def candidates(self, cutoff):
+        return CartItem.objects.filter(cart__updated_at__lt=cutoff)
+
+
+class EmptyCarts(Job):
+    name = 'empty_carts'
+    model = Cart
+    max_age = timedelta(days=7)
+    help = 'Delete empty carts unchanged for max_age that no order refers to.'
+
+    def candidates(self, cutoff):
+        return Cart.objects.filter(updated_at__lt=cutoff).filter(
+            ~Exists(CartItem.objects.filter(cart=OuterRef('pk'))),
+            ~Exists(Order.objects.filter(cart=OuterRef('pk'))),
+        )
+
+
+class ExpirePendingOrders(Job):
+    name = 'expire_pending_orders'
+    model = Order
+    verb = 'cancelled'
+    max_age = timedelta(days=2)
+    interval = 600
+    help = 'Cancel orders left unpaid for max_age and put their items back in stock.'
+
+    def candidates(self, cutoff):
+        return Order.objects.filter(status='Pending', created_at__lt=cutoff).filter(
+            ~Exists(Payment.objects.filter(
+                order=OuterRef('pk'), payment_status__in=['Pending', 'Processing', 'Completed'])),
+        )
+
+    def apply(self, ids, using):
+        orders = list(Order.objects.using(using).filter(pk__in=ids))
+        for order in orders:
+            # Saved one by one so the rollups and order events see the change.
+            order.status = 'Cancelled'
+            order.save(update_fields=['status'])
+        restock = Counter(dict(
+            OrderItem.objects.using(using).filter(order_id__in=ids)
+            .values_list('product_id').annotate(total=Sum('quantity')).order_by()
+        ))
+        # Stock lives on the global database; restore it only once the
+        # cancellations are committed.
+        transaction.on_commit(lambda: self.restock(restock), using=using)
+        return len(orders)
+
+    @staticmethod
+    def restock(quantities):
+        if not quantities:
+            return
+        with transaction.atomic():
+            for product_id, quantity in sorted(quantities.items()):
+                Product.objects.filter(pk=product_id).update(quantity=F('quantity') + quantity)
+        bump_catalog_version()
+
+
+class UnusedAddresses(Job):
+    name = 'unused_addresses'
+    model = ShippingAddress
+    max_age = timedelta(days=365)
+    interval = 86400
+    help = 'Delete addresses older than max_age that no order, live or archived, was shipped to.'
+
+    def candidates(self, cutoff):
+        return ShippingAddress.objects.filter(created_at__lt=cutoff).filter(
+            ~Exists(Order.objects.filter(shipping_address=OuterRef('pk'))),
+            ~Exists(ArchivedOrder.objects.filter(shipping_address_id=OuterRef('pk'))),
+        )
+
+
+JOBS = {job.name: job for job in (AbandonedCartItems, EmptyCarts, ExpirePendingOrders, UnusedAddresses)}
+
+
+def get_jobs(names=None):
+    """The named jobs, or those in MAINTENANCE_JOBS, with the overrides configured there."""
+    config = settings.MAINTENANCE_JOBS
+    return [JOBS[name](**config.get(name, {})) for name in (names or config)]
+
+
+def _set_lock_timeout(using):
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", [f'{settings.MAINTENANCE_LOCK_TIMEOUT_MS}ms'])
+
+
+def run_job(job, using, batch_size=None, rows_per_second=None, dry_run=False, progress=None, stop=None):
+    """Run `job` on the `using` shard to completion; returns its JobStats."""
+    batch_size = batch_size or settings.MAINTENANCE_BATCH_SIZE
+    limiter = RateLimiter(settings.MAINTENANCE_MAX_ROWS_PER_SECOND if rows_per_second is None else rows_per_second)
+    stats = JobStats(job.name, using)
+    cutoff = timezone.now() - job.max_age
+    candidates = job.candidates(cutoff).using(using)
+    last_pk = None
+    while not (stop and stop()):
+        batch = candidates.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        stats.batches += 1
+        stats.scanned += len(ids)
+        if dry_run:
+            stats.affected += len(ids)
+        else:
+            try:
+                with transaction.atomic(using=using):
+                    _set_lock_timeout(using)
+                    locked = list(
+                        candidates.filter(pk__in=ids).select_for_update(skip_locked=True, of=('self',))
+                        .values_list('pk', flat=True)
+                    )
+                    stats.skipped += len(ids) - len(locked)
+                    if locked:
+                        stats.affected += job.apply(locked, using)
+            except OperationalError:
+                # Most likely the lock timeout; the rows are retried on the next run.
+                logger.warning('Maintenance job %s gave up a batch on %s.', job.name, using, exc_info=True)
+                stats.lock_timeouts += 1
+                stats.skipped += len(ids)
+                time.sleep(LOCK_TIMEOUT_BACKOFF)
+        if progress:
+            progress(stats)
+        limiter.wait(len(ids))
+    return stats
+
+
+class Scheduler:
+    """Runs each job on every shard once it is due, until `stopping` is set."""
+
+    def __init__(self, jobs, progress=None, **options):
+        self.jobs = jobs
+        self.progress = progress
+        self.options = options
+        self.next_run = {job.name: 0.0 for job in jobs}
+        self.stopping = False
+
+    def run_due(self):
+        results = []
+        for job in self.jobs:
+            if self.stopping or time.monotonic() < self.next_run[job.name]:
+                continue
+            for alias in sharding.all_shards():
+                results.append(run_job(
+                    job, alias, progress=self.progress, stop=lambda: self.stopping, **self.options))
+            self.next_run[job.name] = time.monotonic() + job.interval
+        return results
+
+    def run_forever(self, poll_interval=5):
+        while not self.stopping:
+            yield from self.run_due()
+            time.sleep(max(0.0, min(min(self.next_run.values()) - time.monotonic(), poll_interval)))
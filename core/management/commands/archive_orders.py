@@ -0,0 +1,44 @@
+"""
+Move old delivered and cancelled orders into the ArchivedOrder cold table.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import archive, sharding
+
+
+class Command(BaseCommand):
+    help = 'Archive delivered and cancelled orders older than a number of months.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-months', type=int, default=settings.ORDER_ARCHIVE_AFTER_MONTHS,
+                            help='Archive orders created before the start of the month this many months ago.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Orders moved per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the orders that would be archived.')
+
+    def handle(self, *args, **options):
+        if options['older_than_months'] < 1:
+            raise CommandError('--older-than-months must be at least 1.')
+        cutoff = archive.add_months(archive.month_start(timezone.now()), -options['older_than_months'])
+
+        if options['dry_run']:
+            count = sum(archive.archivable_orders(cutoff, alias).count() for alias in sharding.all_shards())
+            self.stdout.write(f'{count} orders created before {cutoff:%Y-%m-%d} would be archived.')
+            return
+
+        started = time.monotonic()
+        total = 0
+        for alias in sharding.all_shards():
+            last_id = 0
+            while True:
+                moved, last_id = archive.archive_batch(cutoff, last_id, max(1, options['batch_size']), alias)
+                if last_id is None:
+                    break
+                total += moved
+                self.stdout.write(f'Archived {total} orders (up to #{last_id} on {alias}).')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} orders created before {cutoff:%Y-%m-%d} in {elapsed:.1f}s.'))
@@ -0,0 +1,21 @@
+"""
+Flush the shared product counter buffer and refresh the cached rankings.
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store import counters
+
+
+class Command(BaseCommand):
+    help = ('Drain the Redis counter buffer into ProductCounter and refresh the trending rankings. '
+            'Workers flush on their own; this is for cron jobs and recovery.')
+
+    def handle(self, *args, **options):
+        flushed = 0
+        if settings.PRODUCT_COUNTERS_BACKEND == 'redis':
+            flushed = counters.flush_counts(counters.RedisBuffer(settings.REDIS_URL).drain())
+        else:
+            self.stdout.write('Local counter buffers live in each worker; only refreshing rankings.')
+        counters.refresh_rankings()
+        self.stdout.write(self.style.SUCCESS(f'Flushed counters for {flushed} products.'))
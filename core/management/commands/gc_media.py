@@ -0,0 +1,93 @@
+"""
+Remove content-addressed media blobs that no model references any more,
+and chunked uploads that expired before they were completed.
+"""
+import os
+import posixpath
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import models
+
+from core.storage import ContentAddressedStorage, digest_from_name
+from store import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete orphaned content-addressed media files and expired chunked uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=float, default=24,
+            help='Keep unreferenced files younger than this, so uploads whose '
+                 'row is not committed yet survive.',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        cutoff = time.time() - options['grace_hours'] * 3600
+        dry_run = options['dry_run']
+        verb = 'Would delete' if dry_run else 'Deleted'
+
+        for storage, prefixes, referenced in self.collect_references():
+            deleted = kept = freed = 0
+            emptied = set()
+            for name in self.walk(storage, prefixes):
+                if digest_from_name(name) is None or name in referenced:
+                    continue
+                path = storage.path(name)
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    kept += 1
+                    continue
+                if not dry_run:
+                    storage.delete(name)
+                    emptied.add(posixpath.dirname(name))
+                deleted += 1
+                freed += stat.st_size
+            for directory in emptied:
+                if not any(storage.listdir(directory)):
+                    storage.delete(directory)
+            self.stdout.write(
+                f'{verb} {deleted} orphaned file(s) ({freed} bytes) under {storage.location}; '
+                f'{kept} recent orphan(s) kept.'
+            )
+
+        expired, directories = uploads.delete_stale_uploads(dry_run)
+        self.stdout.write(f'{verb} {expired} expired upload(s) and {directories} chunk directory(ies).')
+
+    @staticmethod
+    def collect_references():
+        """Group content-addressed file fields by storage location."""
+        groups = {}
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, models.FileField):
+                    continue
+                if not isinstance(field.storage, ContentAddressedStorage):
+                    continue
+                storage, prefixes, referenced = groups.setdefault(
+                    field.storage.location, (field.storage, set(), set()))
+                if isinstance(field.upload_to, str):
+                    prefixes.add(field.upload_to.rstrip('/'))
+                names = (
+                    model._default_manager.exclude(**{field.name: ''})
+                    .exclude(**{f'{field.name}__isnull': True})
+                    .values_list(field.name, flat=True)
+                )
+                referenced.update(names.iterator(chunk_size=5000))
+        return groups.values()
+
+    @staticmethod
+    def walk(storage, prefixes):
+        for prefix in sorted(prefixes):
+            if prefix and not storage.exists(prefix):
+                continue
+            stack = [prefix]
+            while stack:
+                current = stack.pop()
+                directories, files = storage.listdir(current)
+                stack.extend(posixpath.join(current, d) for d in directories)
+                for file_name in files:
+                    yield posixpath.join(current, file_name)
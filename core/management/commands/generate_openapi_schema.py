@@ -0,0 +1,24 @@
+"""
+Write the prebuilt OpenAPI schema artifacts served at /docs/openapi.json and .yaml.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import openapi
+
+
+class Command(BaseCommand):
+    help = 'Generate the OpenAPI schema artifacts for the current URL conf and APP_VERSION.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Keep artifacts of other fingerprints, e.g. while two releases run side by side.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        fingerprint, paths = openapi.write_artifacts(prune=not options['keep_old'])
+        for path in paths:
+            self.stdout.write(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Schema {fingerprint[:16]} generated in {time.monotonic() - started:.2f}s.'))
@@ -0,0 +1,288 @@
+"""
+Stream a product catalog from CSV or JSON Lines into the database.
+"""
+import csv
+import io
+import json
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.cache import bump_catalog_version
+from core.models import Category, Product
+
+UPDATE_FIELDS = ['category_id', 'name', 'description', 'price', 'quantity']
+DEFAULT_DESCRIPTION = Product._meta.get_field('description').default
+MAX_PRICE = Decimal('99999999.99')
+MAX_QUANTITY = 2147483647
+
+
+def read_rows(path, fmt, delimiter):
+    """Yield (line number, row dict) pairs without loading the file."""
+    with open(path, newline='', encoding='utf-8') as handle:
+        if fmt == 'csv':
+            reader = csv.DictReader(handle, delimiter=delimiter)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(handle, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    yield line_no, {'__error__': f'Invalid JSON: {exc}'}
+                    continue
+                yield line_no, row if isinstance(row, dict) else {'__error__': 'Row is not an object.'}
+
+
+def parse_quantity(value):
+    """An int from a CSV string or a JSON number, None unless it is a whole number."""
+    if value is None or value == '':
+        return 1
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+def validate_row(row, require_sku):
+    """Return (clean values, errors) for one raw row."""
+    if '__error__' in row:
+        return None, [row['__error__']]
+
+    errors = []
+    sku = str(row.get('sku') or '').strip() or None
+    name = str(row.get('name') or '').strip()
+    category = str(row.get('category') or '').strip()
+    description = str(row.get('description') or '').strip() or DEFAULT_DESCRIPTION
+
+    if require_sku and not sku:
+        errors.append('sku is required.')
+    if sku and len(sku) > 64:
+        errors.append('sku is longer than 64 characters.')
+    if not name:
+        errors.append('name is required.')
+    elif len(name) > 255:
+        errors.append('name is longer than 255 characters.')
+    if not category:
+        errors.append('category is required.')
+    elif len(category) > 100:
+        errors.append('category is longer than 100 characters.')
+
+    try:
+        price = Decimal(str(row.get('price'))).quantize(Decimal('0.01'))
+        if not Decimal(0) <= price <= MAX_PRICE:
+            errors.append('price is out of range.')
+    except (InvalidOperation, ValueError):
+        price = None
+        errors.append('price is not a number.')
+
+    quantity = parse_quantity(row.get('quantity'))
+    if quantity is None:
+        errors.append('quantity is not an integer.')
+    elif not 0 <= quantity <= MAX_QUANTITY:
+        errors.append('quantity is out of range.')
+
+    if errors:
+        return None, errors
+    return {
+        'sku': sku,
+        'name': name,
+        'category': category,
+        'description': description,
+        'price': price,
+        'quantity': quantity,
+    }, []
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or JSON Lines file in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file with sku, name, category, description, '
+                                         'price and quantity columns.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension.')
+        parser.add_argument('--delimiter', default=',', help='CSV delimiter.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--insert-only', action='store_true',
+                            help='Insert every row instead of upserting by sku.')
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Use bulk_create even when COPY is available.')
+        parser.add_argument('--rejects', help='Write rejected rows to this JSONL file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive.')
+        self.upsert = not options['insert_only']
+        self.use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        self.category_ids = dict(Category.objects.values_list('name', 'id'))
+
+        self.rejects_file = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else None
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        totals = Counter()
+        batch = []
+        try:
+            for line_no, row in read_rows(path, fmt, options['delimiter']):
+                totals['read'] += 1
+                clean, errors = validate_row(row, require_sku=self.upsert)
+                if errors:
+                    totals['rejected'] += 1
+                    self.reject(line_no, row, errors)
+                    continue
+                batch.append((line_no, row, clean))
+                if len(batch) >= batch_size:
+                    totals.update(self.load(batch))
+                    batch = []
+                    self.report(totals, started)
+            if batch:
+                totals.update(self.load(batch))
+        except FileNotFoundError:
+            raise CommandError(f'File not found: {path}')
+        finally:
+            if self.rejects_file:
+                self.rejects_file.close()
+
+        if totals['loaded']:
+            bump_catalog_version()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Read {totals["read"]} rows, loaded {totals["loaded"]}, superseded {totals["superseded"]}, '
+            f'rejected {totals["rejected"]} in {elapsed:.1f}s '
+            f'({totals["read"] / elapsed if elapsed else totals["read"]:.0f} rows/s, '
+            f'{"COPY" if self.use_copy else "bulk_create"}).'
+        ))
+
+    def reject(self, line_no, row, errors):
+        if self.rejects_file:
+            self.rejects_file.write(json.dumps({'line': line_no, 'errors': errors, 'row': row}, default=str) + '\n')
+        else:
+            self.stderr.write(f'Line {line_no}: {" ".join(errors)}')
+
+    def report(self, totals, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'{totals["read"]} read, {totals["loaded"]} loaded, {totals["superseded"]} superseded, '
+            f'{totals["rejected"]} rejected ({totals["read"] / elapsed:.0f} rows/s)')
+
+    def resolve_categories(self, names):
+        """Create unknown categories with one INSERT and fetch their ids."""
+        missing = {name for name in names if name not in self.category_ids}
+        if missing:
+            Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+            self.category_ids.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def load(self, batch):
+        """Write a batch of (line number, raw row, clean row); return the loaded, superseded and rejected counts."""
+        superseded = rejected = 0
+        if self.upsert:
+            # ON CONFLICT can't touch the same row twice in one statement,
+            # so the last occurrence of a sku in the batch wins and the
+            # earlier ones are counted as superseded.
+            latest = {}
+            for line_no, _, clean in batch:
+                if clean['sku'] in latest:
+                    superseded += 1
+                    if self.verbosity > 1:
+                        self.stdout.write(f'Line {latest[clean["sku"]][0]}: superseded by line {line_no}.')
+                latest[clean['sku']] = line_no, clean
+            rows = [clean for _, clean in latest.values()]
+        else:
+            rows, duplicates = self.split_duplicates(batch)
+            for line_no, row in duplicates:
+                self.reject(line_no, row, ['sku already exists.'])
+            rejected = len(duplicates)
+        with transaction.atomic():
+            self.resolve_categories({row['category'] for row in rows})
+            if self.use_copy:
+                self.copy_batch(rows)
+            else:
+                self.bulk_create_batch(rows)
+        return {'loaded': len(rows), 'superseded': superseded, 'rejected': rejected}
+
+    @staticmethod
+    def split_duplicates(batch):
+        """Separate rows whose sku is already taken, in the table or earlier in the batch."""
+        taken = set(Product.objects.filter(
+            sku__in={clean['sku'] for _, _, clean in batch if clean['sku']}).values_list('sku', flat=True))
+        rows, duplicates = [], []
+        for line_no, row, clean in batch:
+            if clean['sku'] and clean['sku'] in taken:
+                duplicates.append((line_no, row))
+                continue
+            if clean['sku']:
+                taken.add(clean['sku'])
+            rows.append(clean)
+        return rows, duplicates
+
+    def bulk_create_batch(self, batch):
+        products = [
+            Product(
+                sku=row['sku'],
+                name=row['name'],
+                category_id=self.category_ids[row['category']],
+                description=row['description'],
+                price=row['price'],
+                quantity=row['quantity'],
+            )
+            for row in batch
+        ]
+        if self.upsert:
+            Product.objects.bulk_create(
+                products, update_conflicts=True, unique_fields=['sku'], update_fields=UPDATE_FIELDS)
+        else:
+            # Rows checked by split_duplicates can still collide with a
+            # concurrent writer; skip them rather than abort the import.
+            Product.objects.bulk_create(products, ignore_conflicts=True)
+
+    def copy_batch(self, batch):
+        """COPY the batch into a temp table and merge it into core_product."""
+        table = Product._meta.db_table
+        columns = ['sku', 'category_id', 'name', 'description', 'price', 'quantity']
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            writer.writerow([
+                row['sku'] if row['sku'] is not None else '',
+                self.category_ids[row['category']],
+                row['name'],
+                row['description'],
+                row['price'],
+                row['quantity'],
+            ])
+        buffer.seek(0)
+
+        column_list = ', '.join(columns)
+        if self.upsert:
+            conflict = 'ON CONFLICT (sku) DO UPDATE SET ' + ', '.join(
+                f'{column} = EXCLUDED.{column}' for column in UPDATE_FIELDS)
+        else:
+            conflict = 'ON CONFLICT (sku) DO NOTHING'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS import_products_stage ('
+                'sku varchar(64), category_id bigint, name varchar(255), description text, '
+                'price numeric(10, 2), quantity integer) ON COMMIT DELETE ROWS'
+            )
+            cursor.copy_expert(
+                f"COPY import_products_stage ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '')",
+                buffer,
+            )
+            cursor.execute(
+                f'INSERT INTO {table} ({column_list}, create_date) '
+                f'SELECT {column_list}, %s FROM import_products_stage {conflict}',
+                [timezone.now()],
+            )
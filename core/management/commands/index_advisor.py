@@ -0,0 +1,119 @@
+"""
+Replay the hot API endpoints, EXPLAIN the queries they issue and suggest indexes.
+"""
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import explain, sharding
+from core.models import Order, User
+
+# (method, url name, query string, body) of the views whose queries matter most.
+DEFAULT_ENDPOINTS = [
+    ('get', 'store:order-list', '', None),
+    ('get', 'store:order-item-list', '', None),
+    ('get', 'store:cart-item-list', '', None),
+    ('get', 'store:user-cart', '', None),
+    ('get', 'store:product-list', 'price_min=10&price_max=100', None),
+    ('post', 'store:payment', '', {'payment_method': 'card'}),
+]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the queries issued by the hot endpoints and propose missing indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Email of the user to replay requests as. Defaults to the user '
+                                           'with the most orders.')
+        parser.add_argument('--endpoint', action='append', default=[],
+                            help='Extra METHOD:PATH to replay, e.g. GET:/api/store/products/?category=1.')
+        parser.add_argument('--min-rows', type=int, default=1000,
+                            help='Ignore sequential scans of tables with fewer rows than this.')
+        parser.add_argument('--no-analyze', action='store_true',
+                            help='Plan only; do not execute the queries with EXPLAIN ANALYZE.')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        # Catalog queries run on the global database, the user's on their shard.
+        aliases = list(dict.fromkeys([DEFAULT_DB_ALIAS, sharding.shard_for_user(user.pk)]))
+        client = APIClient()
+        client.force_authenticate(user)
+
+        endpoints = [
+            (method, reverse(name) + (f'?{query}' if query else ''), body)
+            for method, name, query, body in DEFAULT_ENDPOINTS
+        ]
+        for value in options['endpoint']:
+            method, _, path = value.partition(':')
+            if not path.startswith('/'):
+                raise CommandError(f'Invalid endpoint: {value}')
+            endpoints.append((method.lower(), path, None))
+
+        suggestions = {}
+        for method, path, body in endpoints:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'{method.upper()} {path}'))
+            for alias, sql, findings in self.replay(client, aliases, method, path, body,
+                                                    analyze=not options['no_analyze']):
+                for finding in findings:
+                    if finding.kind == 'seq_scan' and explain.table_rows(finding.table, alias) < options['min_rows']:
+                        continue
+                    self.stdout.write(f'  {finding.kind}: {finding.table} {finding.detail}'.rstrip())
+                    self.stdout.write(f'    in: {sql[:200]}')
+                    if finding.suggestion:
+                        suggestions[finding.suggestion] = suggestions.get(finding.suggestion, 0) + 1
+
+        if not suggestions:
+            self.stdout.write(self.style.SUCCESS('No missing indexes found.'))
+            return
+        self.stdout.write(self.style.MIGRATE_HEADING('Suggested indexes'))
+        for suggestion, count in sorted(suggestions.items(), key=lambda item: -item[1]):
+            self.stdout.write(f'  {suggestion};  -- {count} queries')
+
+    @staticmethod
+    def get_user(email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'No user with email {email}.')
+        user_id = (
+            Order.objects.values('user_id').order_by().annotate(count=Count('id'))
+            .order_by('-count').values_list('user_id', flat=True).first()
+        )
+        user = User.objects.filter(pk=user_id).first() if user_id else User.objects.order_by('id').first()
+        if user is None:
+            raise CommandError('There are no users to replay requests as.')
+        return user
+
+    def replay(self, client, aliases, method, path, body, analyze):
+        """Issue one request in rolled back transactions and EXPLAIN its SELECTs."""
+        results = []
+        try:
+            with ExitStack() as stack:
+                for alias in aliases:
+                    stack.enter_context(transaction.atomic(using=alias))
+                stack.enter_context(override_settings(ALLOWED_HOSTS=['*']))
+                captured = {
+                    alias: stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in aliases
+                }
+                response = getattr(client, method)(path, body, format='json')
+                if response.status_code >= 400:
+                    self.stdout.write(self.style.WARNING(f'  responded {response.status_code}'))
+                for alias, context in captured.items():
+                    for query in context.captured_queries:
+                        sql = query['sql']
+                        if sql.lstrip().upper().startswith('SELECT'):
+                            results.append((alias, sql, explain.explain(sql, analyze=analyze, using=alias)))
+                raise _Rollback
+        except _Rollback:
+            pass
+        return results
@@ -0,0 +1,92 @@
+"""
+Move users to the shard the hash ring places them on, one user at a time.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from core import sharding
+from core.models import User, UserShard
+
+
+class Command(BaseCommand):
+    help = ('Move users whose data is not on the shard the hash ring now places them on (after USER_SHARDS '
+            'changed), or move the given users to --to. Safe to run while the site is serving traffic.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help='Email of a user to move; repeatable.')
+        parser.add_argument('--to', help='Shard to move the --user users to. Defaults to their ring placement.')
+        parser.add_argument('--limit', type=int, help='Move at most this many users.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Directory entries scanned per query.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to wait between users.')
+        parser.add_argument('--settle', type=float, default=30.0,
+                            help='Seconds to wait after the last move before sweeping every moved user '
+                                 'once more, for requests that were in flight during their move.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the users that would move.')
+
+    def handle(self, *args, **options):
+        target = options['to']
+        if target and target not in settings.USER_SHARDS:
+            raise CommandError(f'{target} is not one of USER_SHARDS: {", ".join(settings.USER_SHARDS)}.')
+        if target and not options['user']:
+            raise CommandError('--to needs at least one --user.')
+
+        started = time.monotonic()
+        moved = rows = 0
+        sweeps = []
+        for user_id, source, destination in self.plan(options):
+            if options['limit'] is not None and moved >= options['limit']:
+                break
+            if source not in connections.databases:
+                self.stderr.write(f'User #{user_id} is on unknown database {source}; skipped.')
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'User #{user_id}: {source} -> {destination}')
+            else:
+                rows += sharding.move_user(user_id, destination)
+                sweeps.append((user_id, source, destination))
+                self.stdout.write(f'Moved user #{user_id}: {source} -> {destination}')
+                time.sleep(options['pause'])
+            moved += 1
+
+        if sweeps:
+            time.sleep(options['settle'])
+            for user_id, source, destination in sweeps:
+                swept = sharding.sweep_user(user_id, source, destination)
+                if swept:
+                    self.stdout.write(f'Swept {swept} late rows of user #{user_id} to {destination}.')
+                rows += swept
+
+        verb = 'would move' if options['dry_run'] else 'moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} users {verb} ({rows} rows) in {time.monotonic() - started:.1f}s.'))
+
+    def plan(self, options):
+        """Yield (user id, current shard, target shard) for every user to move."""
+        if options['user']:
+            users = dict(User.objects.filter(email__in=options['user']).values_list('email', 'pk'))
+            missing = set(options['user']) - users.keys()
+            if missing:
+                raise CommandError(f'No users with email {", ".join(sorted(missing))}.')
+            for user_id in users.values():
+                source = sharding.shard_for_user(user_id)
+                destination = options['to'] or sharding.placement(user_id)
+                if source != destination:
+                    yield user_id, source, destination
+            return
+
+        last_id = 0
+        while True:
+            entries = list(
+                UserShard.objects.filter(user_id__gt=last_id).order_by('user_id')
+                .values_list('user_id', 'alias')[:options['batch_size']]
+            )
+            if not entries:
+                return
+            for user_id, alias in entries:
+                destination = sharding.placement(user_id)
+                if alias != destination:
+                    yield user_id, alias, destination
+            last_id = entries[-1][0]
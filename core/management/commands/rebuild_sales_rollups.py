@@ -0,0 +1,141 @@
+"""
+Recompute the daily sales rollups from orders, a few days at a time.
+
+Days whose orders have been moved to the archive (core.archive) are
+recomputed from the archived item snapshots.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils.dateparse import parse_date
+
+from core import sharding
+from core.models import ArchivedOrder, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, Product
+from core.archive import archived_item_revenue
+from core.rollups import EXCLUDED_STATUSES
+
+
+class Command(BaseCommand):
+    help = 'Backfill or rebuild DailySales, DailyProductSales and DailyCategorySales.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date-from', help='First day to rebuild (YYYY-MM-DD). Defaults to the first order.')
+        parser.add_argument('--date-to', help='Last day to rebuild (YYYY-MM-DD). Defaults to the last order.')
+        parser.add_argument('--chunk-days', type=int, default=7,
+                            help='Days recomputed per transaction.')
+
+    def handle(self, *args, **options):
+        bounds = [
+            model.objects.using(alias).aggregate(first=Min('created_at'), last=Max('created_at'))
+            for alias in sharding.all_shards()
+            for model in (Order, ArchivedOrder)
+        ]
+        bounds = {
+            'first': min((bound['first'] for bound in bounds if bound['first']), default=None),
+            'last': max((bound['last'] for bound in bounds if bound['last']), default=None),
+        }
+        if bounds['first'] is None:
+            self.stdout.write('No orders to roll up.')
+            return
+        date_from = self.parse(options['date_from']) or bounds['first'].date()
+        date_to = self.parse(options['date_to']) or bounds['last'].date()
+        chunk = timedelta(days=max(1, options['chunk_days']))
+
+        start = date_from
+        while start <= date_to:
+            end = min(start + chunk - timedelta(days=1), date_to)
+            with transaction.atomic():
+                days, products, categories = self.rebuild(start, end)
+            self.stdout.write(
+                f'{start} .. {end}: {days} day rows, {products} product rows, {categories} category rows')
+            start = end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS('Sales rollups rebuilt.'))
+
+    @staticmethod
+    def parse(value):
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f'Invalid date: {value}')
+        return parsed
+
+    @staticmethod
+    def rebuild(start, end):
+        DailySales.objects.filter(date__range=(start, end)).delete()
+        DailyProductSales.objects.filter(date__range=(start, end)).delete()
+        DailyCategorySales.objects.filter(date__range=(start, end)).delete()
+
+        # An order lives on a single shard, so per-shard product totals add
+        # up exactly. Categories come from the global catalog, so distinct
+        # orders per category, and per day, are counted here rather than
+        # joined in SQL.
+        products = defaultdict(lambda: [0, 0, Decimal(0)])
+        item_orders = defaultdict(set)
+        totals = dict(orders=Count('order_id', distinct=True), units=Sum('quantity'), revenue=Sum('price'))
+        for alias in sharding.all_shards():
+            items = (
+                OrderItem.objects.using(alias)
+                .filter(order__created_at__gte=start, order__created_at__lt=end + timedelta(days=1))
+                .exclude(order__status__in=EXCLUDED_STATUSES)
+                .annotate(day=TruncDate('order__created_at'))
+            )
+            for row in items.values('day', 'product_id').annotate(**totals).order_by():
+                product = products[row['day'], row['product_id']]
+                product[0] += row['orders']
+                product[1] += row['units']
+                product[2] += row['revenue']
+            for day, order_id, product_id in items.values_list('day', 'order_id', 'product_id').distinct():
+                item_orders[day, product_id].add(order_id)
+
+            archived = (
+                ArchivedOrder.objects.using(alias)
+                .filter(created_at__gte=start, created_at__lt=end + timedelta(days=1))
+                .exclude(status__in=EXCLUDED_STATUSES)
+                .values_list('id', 'created_at', 'items_snapshot')
+            )
+            for order_id, created_at, snapshot in archived.iterator():
+                for item in snapshot:
+                    product = products[created_at.date(), item['id']]
+                    product[0] += 1
+                    product[1] += item['quantity']
+                    product[2] += archived_item_revenue(item)
+                    item_orders[created_at.date(), item['id']].add(order_id)
+
+        category_of = dict(Product.objects.filter(
+            id__in={product_id for _, product_id in products}).values_list('id', 'category_id'))
+        days = defaultdict(lambda: [set(), 0, Decimal(0)])
+        categories = defaultdict(lambda: [set(), 0, Decimal(0)])
+        for (day, product_id), (_, units, revenue) in products.items():
+            for totals in (days[day], categories[day, category_of.get(product_id)]):
+                totals[0] |= item_orders[day, product_id]
+                totals[1] += units
+                totals[2] += revenue
+
+        days = DailySales.objects.bulk_create([
+            DailySales(date=day, orders=len(orders), units=units, revenue=revenue)
+            for day, (orders, units, revenue) in days.items()
+        ], batch_size=1000)
+
+        products = DailyProductSales.objects.bulk_create(
+            [
+                DailyProductSales(date=day, product_id=product_id, orders=orders, units=units, revenue=revenue)
+                for (day, product_id), (orders, units, revenue) in products.items()
+            ],
+            batch_size=1000,
+        )
+        categories = DailyCategorySales.objects.bulk_create(
+            [
+                DailyCategorySales(date=day, category_id=category_id, orders=len(orders), units=units,
+                                   revenue=revenue)
+                for (day, category_id), (orders, units, revenue) in categories.items()
+                if category_id is not None
+            ],
+            batch_size=1000,
+        )
+        return len(days), len(products), len(categories)
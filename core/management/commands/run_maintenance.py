@@ -0,0 +1,65 @@
+"""
+Delete or expire stale user-owned rows in small, rate limited batches.
+"""
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import maintenance
+
+
+class Command(BaseCommand):
+    help = 'Run the maintenance jobs (see MAINTENANCE_JOBS) once, or on their schedule with --forever.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--job', action='append', default=[], choices=sorted(maintenance.JOBS),
+                            help='Run only this job; repeatable. Defaults to every job in MAINTENANCE_JOBS.')
+        parser.add_argument('--batch-size', type=int, help='Rows per batch and transaction.')
+        parser.add_argument('--max-rows-per-second', type=float, help='Rate limit; 0 disables it.')
+        parser.add_argument('--forever', action='store_true', help='Keep running each job on its interval.')
+        parser.add_argument('--list', action='store_true', help='List the jobs and exit.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be processed.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['list']:
+            for name, job in maintenance.JOBS.items():
+                self.stdout.write(f'{name}: {job.help}')
+            return
+        if options['forever'] and options['dry_run']:
+            raise CommandError('--dry-run cannot be combined with --forever.')
+        for name, overrides in settings.MAINTENANCE_JOBS.items():
+            if name not in maintenance.JOBS:
+                raise CommandError(f'MAINTENANCE_JOBS names an unknown job: {name}.')
+            unknown = set(overrides) - {'max_age', 'interval'}
+            if unknown:
+                raise CommandError(f'MAINTENANCE_JOBS[{name!r}] has unknown keys: {", ".join(sorted(unknown))}.')
+
+        scheduler = maintenance.Scheduler(
+            maintenance.get_jobs(options['job']),
+            progress=self.report_progress,
+            batch_size=options['batch_size'],
+            rows_per_second=options['max_rows_per_second'],
+            dry_run=options['dry_run'],
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            # Finish the current batch, then stop.
+            signal.signal(signum, lambda *args: setattr(scheduler, 'stopping', True))
+
+        results = scheduler.run_forever() if options['forever'] else scheduler.run_due()
+        for stats in results:
+            self.report(stats, options['dry_run'])
+
+    def report_progress(self, stats):
+        if self.verbosity > 1:
+            self.stdout.write(
+                f'  {stats.job} on {stats.shard}: batch {stats.batches}, {stats.scanned} scanned, '
+                f'{stats.affected} processed, {stats.skipped} skipped, {stats.rate:.0f} rows/s')
+
+    def report(self, stats, dry_run):
+        verb = maintenance.JOBS[stats.job].verb
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats.job} on {stats.shard}: {stats.affected} rows {'would be ' if dry_run else ''}{verb} "
+            f"in {stats.batches} batches, {stats.skipped} skipped (locked), "
+            f"{stats.lock_timeouts} lock timeouts, {stats.elapsed:.1f}s ({stats.rate:.0f} rows/s)."))
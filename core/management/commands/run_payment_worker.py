@@ -0,0 +1,32 @@
+"""
+Charge submitted payments through their gateways on an asyncio loop.
+"""
+import asyncio
+import signal
+
+from django.core.management.base import BaseCommand
+
+from core.payments import PaymentWorker
+
+
+class Command(BaseCommand):
+    help = 'Process pending payments concurrently, retrying transient gateway failures.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit once no payments are due.')
+        parser.add_argument('--batch-size', type=int, help='Maximum payments in flight at once.')
+
+    def handle(self, *args, **options):
+        totals = asyncio.run(self.run(options))
+        self.stdout.write(self.style.SUCCESS(
+            f"Completed {totals['Completed']}, failed {totals['Failed']}, "
+            f"scheduled {totals['retried']} for retry."))
+
+    @staticmethod
+    async def run(options):
+        worker = PaymentWorker(batch_size=options['batch_size'])
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            # Stop claiming, but let in-flight charges finish and be saved.
+            loop.add_signal_handler(signum, setattr, worker, 'stopping', True)
+        return await worker.run(once=options['once'])
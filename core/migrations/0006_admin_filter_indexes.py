@@ -0,0 +1,47 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:05
+
+from django.db import migrations, models
+
+from core.operations import AddFieldIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('core', '0005_product_sku'),
+    ]
+
+    operations = [
+        AddFieldIndexConcurrently(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+            index_name='core_order_created_at_idx',
+        ),
+        AddFieldIndexConcurrently(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Shipped', 'Shipped'), ('Delivered', 'Delivered'), ('Cancelled', 'Cancelled')], db_index=True, default='Pending', max_length=20),
+            index_name='core_order_status_idx',
+        ),
+        AddFieldIndexConcurrently(
+            model_name='payment',
+            name='payment_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+            index_name='core_payment_date_idx',
+        ),
+        AddFieldIndexConcurrently(
+            model_name='payment',
+            name='payment_status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Failed', 'Failed')], db_index=True, default='Pending', max_length=20),
+            index_name='core_payment_status_idx',
+        ),
+        AddFieldIndexConcurrently(
+            model_name='product',
+            name='create_date',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+            index_name='core_product_create_date_idx',
+        ),
+    ]
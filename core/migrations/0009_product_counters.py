@@ -0,0 +1,24 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCounter',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='counter', serialize=False, to='core.product')),
+                ('views', models.PositiveBigIntegerField(db_index=True, default=0)),
+                ('add_to_cart', models.PositiveBigIntegerField(default=0)),
+                ('trend_score', models.FloatField(db_index=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
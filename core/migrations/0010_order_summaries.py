@@ -0,0 +1,69 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:10
+
+from decimal import Decimal
+
+from django.db import DEFAULT_DB_ALIAS, migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_order_summaries(apps, schema_editor):
+    Order = apps.get_model('core', 'Order')
+    OrderItem = apps.get_model('core', 'OrderItem')
+    Payment = apps.get_model('core', 'Payment')
+    Product = apps.get_model('core', 'Product')
+    # Orders live on the database being migrated (a user shard, perhaps);
+    # product names only on 'default'.
+    db = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        orders = list(Order.objects.using(db).filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not orders:
+            break
+        last_id = orders[-1].id
+        ids = [order.id for order in orders]
+        items = {}
+        rows = list(
+            OrderItem.objects.using(db).filter(order_id__in=ids).order_by('id')
+            .values_list('order_id', 'product_id', 'quantity', 'price')
+        )
+        names = dict(Product.objects.using(DEFAULT_DB_ALIAS).filter(
+            id__in={row[1] for row in rows}).values_list('id', 'name'))
+        for order_id, product_id, quantity, price in rows:
+            name = names.get(product_id, '')
+            unit_price = (price / quantity if quantity else price).quantize(Decimal('0.01'))
+            items.setdefault(order_id, []).append(
+                {'id': product_id, 'name': name, 'price': str(unit_price), 'quantity': quantity})
+        payments = dict(Payment.objects.using(db).filter(order_id__in=ids).values_list('order_id', 'payment_status'))
+        for order in orders:
+            order.items_snapshot = items.get(order.id, [])
+            order.item_count = sum(item['quantity'] for item in order.items_snapshot)
+            order.payment_status = payments.get(order.id, 'Pending')
+        Order.objects.using(db).bulk_update(orders, ['items_snapshot', 'item_count', 'payment_status'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_product_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_snapshot',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='payment_status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=20),
+        ),
+        migrations.RunPython(backfill_order_summaries, migrations.RunPython.noop),
+    ]
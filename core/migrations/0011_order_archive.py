@@ -0,0 +1,74 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_archive_table(apps, schema_editor):
+    """
+    Create ArchivedOrder as a monthly range-partitioned table on Postgres
+    (partitions are added by core.archive.ensure_partitions) and as a
+    plain table elsewhere.
+    """
+    model = apps.get_model('core', 'ArchivedOrder')
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.create_model(model)
+        return
+    timestamp = 'timestamp with time zone' if settings.USE_TZ else 'timestamp'
+    schema_editor.execute(f'''
+        CREATE TABLE core_archivedorder (
+            id bigint NOT NULL,
+            user_id bigint NOT NULL,
+            status varchar(20) NOT NULL,
+            total_price numeric(10, 2) NOT NULL,
+            shipping_address_id bigint NULL,
+            created_at {timestamp} NOT NULL,
+            items_snapshot jsonb NOT NULL,
+            item_count integer NOT NULL CHECK (item_count >= 0),
+            payment_status varchar(20) NOT NULL,
+            payment jsonb NULL,
+            archived_at {timestamp} NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    ''')
+    schema_editor.execute(
+        'CREATE INDEX archivedorder_user_created ON core_archivedorder (user_id, created_at DESC)')
+
+
+def drop_archive_table(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('core', 'ArchivedOrder'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_order_summaries'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ArchivedOrder',
+                    fields=[
+                        ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                        ('status', models.CharField(choices=[('Pending', 'Pending'), ('Shipped', 'Shipped'), ('Delivered', 'Delivered'), ('Cancelled', 'Cancelled')], max_length=20)),
+                        ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                        ('shipping_address_id', models.BigIntegerField(null=True)),
+                        ('created_at', models.DateTimeField()),
+                        ('items_snapshot', models.JSONField(default=list)),
+                        ('item_count', models.PositiveIntegerField(default=0)),
+                        ('payment_status', models.CharField(choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=20)),
+                        ('payment', models.JSONField(null=True)),
+                        ('archived_at', models.DateTimeField(auto_now_add=True)),
+                        ('user', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'indexes': [models.Index(fields=['user', '-created_at'], name='archivedorder_user_created')],
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_archive_table, drop_archive_table),
+    ]
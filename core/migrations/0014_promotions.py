@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_payment_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='discount_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('kind', models.CharField(choices=[('percent', 'Percent off'), ('fixed', 'Fixed amount off'), ('buy_x_get_y', 'Buy X get Y free'), ('cart_threshold', 'Amount off above a cart subtotal')], max_length=20)),
+                ('value', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('buy_quantity', models.PositiveIntegerField(default=0)),
+                ('get_quantity', models.PositiveIntegerField(default=0)),
+                ('min_subtotal', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('starts_at', models.DateTimeField(blank=True, null=True)),
+                ('ends_at', models.DateTimeField(blank=True, null=True)),
+                ('is_active', models.BooleanField(db_index=True, default=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='core.category')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='core.product')),
+            ],
+        ),
+    ]
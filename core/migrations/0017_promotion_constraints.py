@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-19 10:42
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def deactivate_invalid_promotions(apps, schema_editor):
+    """Invalid active rules would violate the new constraints; switch them off instead."""
+    Promotion = apps.get_model('core', 'Promotion')
+    Promotion.objects.using(schema_editor.connection.alias).filter(is_active=True).filter(
+        Q(product__isnull=False, category__isnull=False)
+        | Q(kind='percent') & (Q(value__lte=0) | Q(value__gt=100))
+        | Q(kind='buy_x_get_y') & (Q(buy_quantity=0) | Q(get_quantity=0))
+        | Q(kind='cart_threshold') & (Q(min_subtotal__isnull=True) | Q(product__isnull=False)
+                                      | Q(category__isnull=False))
+    ).update(is_active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_maintenance_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(deactivate_invalid_promotions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(('is_active', False), ('product__isnull', True), ('category__isnull', True), _connector='OR'), name='promotion_single_target'),
+        ),
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(('is_active', False), models.Q(('kind', 'percent'), _negated=True), models.Q(('value__gt', 0), ('value__lte', 100)), _connector='OR'), name='promotion_percent_range'),
+        ),
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(('is_active', False), models.Q(('kind', 'buy_x_get_y'), _negated=True), models.Q(('buy_quantity__gt', 0), ('get_quantity__gt', 0)), _connector='OR'), name='promotion_bundle_quantities'),
+        ),
+        migrations.AddConstraint(
+            model_name='promotion',
+            constraint=models.CheckConstraint(condition=models.Q(('is_active', False), models.Q(('kind', 'cart_threshold'), _negated=True), models.Q(('category__isnull', True), ('min_subtotal__isnull', False), ('product__isnull', True)), _connector='OR'), name='promotion_cart_threshold'),
+        ),
+    ]
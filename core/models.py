@@ -1,9 +1,14 @@
+import uuid
+
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 
 class UserManager(BaseUserManager):
@@ -50,6 +55,7 @@ class Category(models.Model):
 
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255, db_index=True)
     description = models.TextField(
         blank=True, default="No description available.")
@@ -57,7 +63,7 @@ class Product(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     image = models.ImageField(
         upload_to='product_images/', blank=True, null=True)
-    create_date = models.DateTimeField(auto_now_add=True)
+    create_date = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"{self.name} ({self.category.name})"
@@ -65,23 +71,52 @@ class Product(models.Model):
     class Meta:
         ordering = ['-create_date']
         verbose_name_plural = "Products"
+        indexes = [
+            models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(fields=['category', 'price'], name='product_category_price_idx'),
+        ]
+
+
+class UserShard(models.Model):
+    """Directory entry: the database alias holding a user's carts and orders (core.sharding)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    alias = models.CharField(max_length=64, db_index=True)
+    moved_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"User #{self.user_id} on {self.alias}"
 
 
+# Models kept on the user's shard (core.sharding) refer to users and products
+# on the global database by id, without a foreign key constraint.
 class Cart(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    user = models.OneToOneField(User, on_delete=models.CASCADE, db_constraint=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last change to the cart or its items; see core.maintenance.
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Cart - {self.user.email}"
 
+    @cached_property
+    def pricing(self):
+        """The cart priced by the promotion engine (core.pricing)."""
+        from core import pricing
+
+        items = self.cart_items.prefetch_related('product')
+        return pricing.price_cart([(item.product, item.quantity) for item in items])
+
     @property
     def total_price(self):
-        return sum(item.product.price * item.quantity for item in self.cart_items.all())
+        return self.pricing.total
+
+    def touch(self):
+        Cart.objects.using(self._state.db).filter(pk=self.pk).update(updated_at=timezone.now())
 
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name="cart_items")
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.PositiveIntegerField(default=1)
 
     def __str__(self):
@@ -89,17 +124,26 @@ class CartItem(models.Model):
 
 
 class ShippingAddress(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     address = models.TextField()
     city = models.CharField(max_length=255)
     postal_code = models.CharField(max_length=20)
     country = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=20)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"Shipping Address for {self.user.email}"
 
 
+PAYMENT_STATUS_CHOICES = [
+    ('Pending', 'Pending'),
+    ('Processing', 'Processing'),
+    ('Completed', 'Completed'),
+    ('Failed', 'Failed'),
+]
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('Pending', 'Pending'),
@@ -107,27 +151,43 @@ class Order(models.Model):
         ('Delivered', 'Delivered'),
         ('Cancelled', 'Cancelled'),
     ]
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
     status = models.CharField(
-        max_length=20, choices=STATUS_CHOICES, default='Pending')
+        max_length=20, choices=STATUS_CHOICES, default='Pending', db_index=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     shipping_address = models.ForeignKey(
         ShippingAddress, on_delete=models.CASCADE, related_name="orders")
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Denormalized at checkout and on payment changes so order history can
+    # be rendered from this table alone.
+    items_snapshot = models.JSONField(default=list, blank=True)
+    item_count = models.PositiveIntegerField(default=0)
+    payment_status = models.CharField(
+        max_length=20, choices=PAYMENT_STATUS_CHOICES, default='Pending')
+
+    class Meta:
+        indexes = [
+            # Order history, and the latest pending order looked up at payment.
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['user', '-created_at'], condition=models.Q(status='Pending'),
+                         name='order_user_pending_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.user.email} - {self.status}"
 
-    @property
-    def payment_status(self):
-        return self.payment.payment_status if hasattr(self, "payment") else "Pending"
+    @staticmethod
+    def snapshot_item(product, quantity, price=None):
+        price = product.price if price is None else price
+        return {'id': product.id, 'name': product.name, 'price': str(price), 'quantity': quantity}
 
 
 class OrderItem(models.Model):
     order = models.ForeignKey(
         Order, related_name="items", on_delete=models.CASCADE)
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.PositiveIntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2)
 
@@ -139,12 +199,237 @@ class Payment(models.Model):
     order = models.OneToOneField(Order, on_delete=models.CASCADE)
     payment_method = models.CharField(max_length=50)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    payment_status = models.CharField(max_length=20, default='Pending', choices=[
-        ('Pending', 'Pending'),
-        ('Completed', 'Completed'),
-        ('Failed', 'Failed'),
-    ])
-    payment_date = models.DateTimeField(auto_now_add=True)
+    payment_status = models.CharField(
+        max_length=20, default='Pending', db_index=True, choices=PAYMENT_STATUS_CHOICES)
+    payment_date = models.DateTimeField(auto_now_add=True, db_index=True)
+    # Gateway processing state, maintained by core.payments.
+    provider = models.CharField(max_length=30, default='simulated')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    gateway_reference = models.CharField(max_length=100, blank=True)
+    last_error = models.CharField(max_length=255, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(payment_status__in=['Pending', 'Processing']),
+                         name='payment_open_idx'),
+        ]
 
     def __str__(self):
         return f"Payment for Order #{self.order.id} - {self.payment_status}"
+
+
+class ChunkedUpload(models.Model):
+    """Large file uploaded in numbered chunks and assembled on completion."""
+    STATUS_CHOICES = [
+        ('Uploading', 'Uploading'),
+        ('Complete', 'Complete'),
+    ]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    checksum = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default='Uploading')
+    file = models.FileField(upload_to='product_images/', blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Upload {self.id} - {self.filename} - {self.status}"
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+
+class DailySales(models.Model):
+    """Orders, units and revenue per day, maintained by core.rollups."""
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.date} - {self.orders} orders"
+
+
+class DailyProductSales(models.Model):
+    """Units and revenue per product per day, maintained by core.rollups."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='daily_product_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - product #{self.product_id} - {self.units} units"
+
+
+class DailyCategorySales(models.Model):
+    """Units and revenue per category per day, maintained by core.rollups."""
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'category'], name='daily_category_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - category #{self.category_id} - {self.units} units"
+
+
+class ProductCooccurrence(models.Model):
+    """How many orders contained both products; one row per ordered pair."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'other'], name='product_cooccurrence_unique'),
+        ]
+
+    def __str__(self):
+        return f"#{self.product_id} + #{self.other_id}: {self.count}"
+
+
+class ProductRecommendation(models.Model):
+    """Top-K products most often bought together with `product`."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_for')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'rank'], name='product_recommendation_rank_unique'),
+        ]
+
+    def __str__(self):
+        return f"#{self.product_id} -> #{self.recommended_id} ({self.rank})"
+
+
+class ProductCounter(models.Model):
+    """
+    Buffered engagement counters per product.
+
+    `trend_score` is the log of the time-decayed event weight, anchored
+    at a fixed epoch so that ranking by it needs no per-row decay.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='counter')
+    views = models.PositiveBigIntegerField(default=0, db_index=True)
+    add_to_cart = models.PositiveBigIntegerField(default=0)
+    trend_score = models.FloatField(null=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Counters for product #{self.product_id}"
+
+
+class ArchivedOrder(models.Model):
+    """
+    Delivered or cancelled order moved out of the live tables by
+    `archive_orders`, together with its items and payment.
+
+    On Postgres the table is range partitioned by month of `created_at`
+    (see core.archive), so its primary key there is (id, created_at).
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, db_constraint=False, db_index=False, related_name='archived_orders')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    discount_total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    shipping_address_id = models.BigIntegerField(null=True)
+    created_at = models.DateTimeField()
+    items_snapshot = models.JSONField(default=list)
+    item_count = models.PositiveIntegerField(default=0)
+    payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='Pending')
+    payment = models.JSONField(null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='archivedorder_user_created'),
+        ]
+
+    def __str__(self):
+        return f"Archived order #{self.id} - {self.status}"
+
+
+class Promotion(models.Model):
+    """
+    A price rule applied by core.pricing.
+
+    `percent` and `fixed` take `value` percent or `value` off the unit price
+    of the product, the category, or everything when neither is set;
+    `buy_x_get_y` makes `get_quantity` of every `buy_quantity` +
+    `get_quantity` units free; `cart_threshold` takes `value` off carts
+    whose subtotal reaches `min_subtotal`.
+    """
+    KIND_CHOICES = [
+        ('percent', 'Percent off'),
+        ('fixed', 'Fixed amount off'),
+        ('buy_x_get_y', 'Buy X get Y free'),
+        ('cart_threshold', 'Amount off above a cart subtotal'),
+    ]
+    name = models.CharField(max_length=255)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    product = models.ForeignKey(
+        Product, null=True, blank=True, on_delete=models.CASCADE, related_name='promotions')
+    category = models.ForeignKey(
+        Category, null=True, blank=True, on_delete=models.CASCADE, related_name='promotions')
+    value = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    buy_quantity = models.PositiveIntegerField(default=0)
+    get_quantity = models.PositiveIntegerField(default=0)
+    min_subtotal = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    starts_at = models.DateTimeField(null=True, blank=True)
+    ends_at = models.DateTimeField(null=True, blank=True)
+    is_active = models.BooleanField(default=True, db_index=True)
+
+    class Meta:
+        # The rules clean() checks, enforced for active rows however they are saved.
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(is_active=False) | models.Q(product__isnull=True) | models.Q(
+                    category__isnull=True),
+                name='promotion_single_target'),
+            models.CheckConstraint(
+                condition=models.Q(is_active=False) | ~models.Q(kind='percent') | models.Q(
+                    value__gt=0, value__lte=100),
+                name='promotion_percent_range'),
+            models.CheckConstraint(
+                condition=models.Q(is_active=False) | ~models.Q(kind='buy_x_get_y') | models.Q(
+                    buy_quantity__gt=0, get_quantity__gt=0),
+                name='promotion_bundle_quantities'),
+            models.CheckConstraint(
+                condition=models.Q(is_active=False) | ~models.Q(kind='cart_threshold') | models.Q(
+                    min_subtotal__isnull=False, product__isnull=True, category__isnull=True),
+                name='promotion_cart_threshold'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_kind_display()})"
+
+    def clean(self):
+        if self.product_id and self.category_id:
+            raise ValidationError("A promotion applies to a product or a category, not both.")
+        if self.kind == 'percent' and not 0 < self.value <= 100:
+            raise ValidationError({'value': "Percent off must be between 0 and 100."})
+        if self.kind == 'buy_x_get_y' and not (self.buy_quantity and self.get_quantity):
+            raise ValidationError("Buy X get Y needs both quantities.")
+        if self.kind == 'cart_threshold' and (self.min_subtotal is None or self.product_id or self.category_id):
+            raise ValidationError("A cart threshold needs a minimum subtotal and applies to the whole cart.")
@@ -0,0 +1,177 @@
+"""
+Prebuilt OpenAPI schema artifacts.
+
+Generating the schema introspects every view and serializer, so it is done
+once per fingerprint instead of per request. The fingerprint covers the
+URL conf, the source of the project packages that provide the views (their
+serializers, models and migrations included), APP_VERSION and the DRF and
+drf-yasg versions. The schema is built by `manage.py
+generate_openapi_schema` at build time, or lazily by the first request
+that finds no artifact for the current fingerprint. JSON and YAML
+documents, and gzipped copies of both, are written to OPENAPI_SCHEMA_DIR
+and then kept in memory; when they cannot be written (a read-only
+filesystem, say) the documents are served from memory alone.
+
+With DEBUG on and no APP_VERSION, artifacts on disk are ignored and each
+process (the autoreloader starts a new one per change) builds its own.
+"""
+import functools
+import gzip
+import hashlib
+import importlib
+import logging
+import os
+import threading
+from pathlib import Path
+
+import drf_yasg
+import rest_framework
+from django.conf import settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+from drf_yasg.generators import OpenAPISchemaGenerator
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_INFO = openapi.Info(
+    title='Event Manager API',
+    default_version='v1',
+    description='This is the API for event manager application',
+    terms_of_service='https://www.google.com/policies/terms/',
+    contact=openapi.Contact(email='user@example.com')
+)
+
+CODECS = {'json': OpenAPICodecJson, 'yaml': OpenAPICodecYaml}
+CONTENT_TYPES = {'json': 'application/json', 'yaml': 'application/yaml'}
+
+
+class SchemaDocument:
+    def __init__(self, fingerprint, fmt, body, compressed):
+        self.fingerprint = fingerprint
+        self.fmt = fmt
+        self.body = body
+        self.compressed = compressed
+        self.etag = f'"{fingerprint[:32]}-{fmt}"'
+        self.content_type = CONTENT_TYPES[fmt]
+
+
+_lock = threading.Lock()
+_documents = {}
+
+
+def _describe(patterns, prefix=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _describe(pattern.url_patterns, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            callback = pattern.callback
+            view = getattr(callback, 'cls', None) or getattr(callback, 'view_class', None) or callback
+            actions = sorted(getattr(callback, 'actions', None) or {})
+            yield f'{prefix}{pattern.pattern} {view.__module__}.{view.__qualname__} {actions}', view
+
+
+def _source_files(views):
+    """The .py files of the project packages the views come from."""
+    base_dir = Path(settings.BASE_DIR).resolve()
+    for package in sorted({view.__module__.split('.')[0] for view in views}):
+        module_file = getattr(importlib.import_module(package), '__file__', None)
+        if not module_file:
+            continue
+        root = Path(module_file).resolve().parent
+        if base_dir not in root.parents or 'site-packages' in root.parts:
+            continue
+        yield from sorted(root.rglob('*.py'))
+
+
+@functools.cache
+def fingerprint():
+    digest = hashlib.sha256()
+    digest.update(f'{settings.APP_VERSION}\n{rest_framework.VERSION}\n{drf_yasg.__version__}\n'.encode())
+    views = set()
+    for line, view in _describe(get_resolver().url_patterns):
+        digest.update(line.encode() + b'\n')
+        views.add(view)
+    for path in _source_files(views):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _path(fingerprint_, fmt, compressed=False):
+    name = f'openapi-{fingerprint_[:16]}.{fmt}' + ('.gz' if compressed else '')
+    return os.path.join(settings.OPENAPI_SCHEMA_DIR, name)
+
+
+def _write(path, data):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(data)
+    os.replace(temporary, path)
+
+
+def build():
+    """Generate the schema and encode it in every format."""
+    schema = OpenAPISchemaGenerator(SCHEMA_INFO).get_schema(request=None, public=True)
+    return {fmt: codec(validators=[]).encode(schema) for fmt, codec in CODECS.items()}
+
+
+def _encode(current):
+    return {fmt: SchemaDocument(current, fmt, body, gzip.compress(body, mtime=0)) for fmt, body in build().items()}
+
+
+def _write_documents(documents):
+    os.makedirs(settings.OPENAPI_SCHEMA_DIR, exist_ok=True)
+    paths = []
+    for document in documents.values():
+        for compressed, data in ((False, document.body), (True, document.compressed)):
+            path = _path(document.fingerprint, document.fmt, compressed)
+            _write(path, data)
+            paths.append(path)
+    return paths
+
+
+def write_artifacts(prune=False):
+    """
+    Build the schema and write the artifacts for the current fingerprint;
+    with `prune`, remove artifacts of other fingerprints.
+    """
+    current = fingerprint()
+    paths = _write_documents(_encode(current))
+    for name in os.listdir(settings.OPENAPI_SCHEMA_DIR) if prune else ():
+        path = os.path.join(settings.OPENAPI_SCHEMA_DIR, name)
+        if name.startswith('openapi-') and path not in paths:
+            os.remove(path)
+    return current, paths
+
+
+def _persistent():
+    return bool(settings.APP_VERSION) or not settings.DEBUG
+
+
+def _read(current, fmt):
+    try:
+        with open(_path(current, fmt), 'rb') as body, open(_path(current, fmt, True), 'rb') as compressed:
+            return SchemaDocument(current, fmt, body.read(), compressed.read())
+    except FileNotFoundError:
+        return None
+
+
+def get_document(fmt):
+    """The schema document in `fmt` for the current fingerprint, built if needed."""
+    current = fingerprint()
+    document = _documents.get((current, fmt))
+    if document is not None:
+        return document
+    with _lock:
+        if (current, fmt) not in _documents:
+            documents = {key: _read(current, key) for key in CODECS} if _persistent() else {}
+            if len(documents) != len(CODECS) or None in documents.values():
+                documents = _encode(current)
+                if _persistent():
+                    try:
+                        _write_documents(documents)
+                    except OSError:
+                        logger.warning('Could not write the OpenAPI schema to %s; serving it from memory.',
+                                       settings.OPENAPI_SCHEMA_DIR, exc_info=True)
+            _documents.update({(current, key): value for key, value in documents.items()})
+        return _documents[(current, fmt)]
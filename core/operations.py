@@ -0,0 +1,60 @@
+"""
+Migration operations for large, busy tables.
+
+On Postgres these build and drop indexes CONCURRENTLY, so the table stays
+writable while they run; elsewhere they behave like the plain operation.
+Like Django's AddIndexConcurrently they need `atomic = False` on the
+migration.
+"""
+from django.contrib.postgres.operations import AddIndexConcurrently as PostgresAddIndexConcurrently
+from django.contrib.postgres.operations import NotInTransactionMixin
+from django.db import models
+from django.db.migrations.operations import AddIndex, AlterField
+
+
+def _is_postgres(schema_editor):
+    return schema_editor.connection.vendor == 'postgresql'
+
+
+class AddIndexConcurrently(PostgresAddIndexConcurrently):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if _is_postgres(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        return AddIndex.database_forwards(self, app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if _is_postgres(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        return AddIndex.database_backwards(self, app_label, schema_editor, from_state, to_state)
+
+
+class AddFieldIndexConcurrently(NotInTransactionMixin, AlterField):
+    """AlterField that only adds db_index=True to `field`, as index `index_name`."""
+
+    def __init__(self, model_name, name, field, index_name, preserve_default=True):
+        self.index_name = index_name
+        super().__init__(model_name, name, field, preserve_default)
+
+    def deconstruct(self):
+        name, args, kwargs = super().deconstruct()
+        kwargs['index_name'] = self.index_name
+        return name, args, kwargs
+
+    def _index(self):
+        return models.Index(fields=[self.name], name=self.index_name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self._index(), concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if not _is_postgres(schema_editor):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        self._ensure_not_in_transaction(schema_editor)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self._index(), concurrently=True)
@@ -0,0 +1,249 @@
+"""
+Asynchronous payment processing against pluggable gateways.
+
+Checkout only records a Pending payment. `run_payment_worker` claims due
+payments in batches and charges them on an asyncio loop, so many gateway
+calls are in flight at once while each provider is held to its own
+concurrency limit (a semaphore) and timeout. Transient failures are retried
+with exponential backoff up to PAYMENT_MAX_ATTEMPTS; declines fail at once.
+Outcomes are buffered and written back with one bulk_update for payments
+and one for orders per flush.
+
+Gateway references are committed on their own before the outcomes are
+settled, so a payment that was charged but not settled (a failed flush, a
+worker that died) is completed on reclaim without being charged again.
+
+Gateways are configured in PAYMENT_GATEWAYS:
+
+    PAYMENT_GATEWAYS = {
+        'simulated': {
+            'BACKEND': 'core.payments.SimulatedGateway',
+            'CONCURRENCY': 50,
+            'TIMEOUT': 10,
+            'OPTIONS': {'latency': 0.2, 'failure_rate': 0.05},
+        },
+    }
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import timedelta
+from functools import cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core import sharding
+from core.models import Order, Payment
+
+logger = logging.getLogger(__name__)
+
+# Sent with the orders whose payment was settled by a batched write, which
+# bypasses the Order post_save signal.
+payments_settled = Signal()
+
+MAX_BACKOFF = 300
+
+
+class GatewayError(Exception):
+    """A charge that did not go through; retried when `retryable`."""
+    retryable = True
+
+
+class PaymentDeclined(GatewayError):
+    retryable = False
+
+
+class Gateway:
+    def __init__(self, name, **options):
+        self.name = name
+
+    async def charge(self, payment):
+        """
+        Charge `payment` and return the provider's reference for it.
+        `payment.id` is stable across retries; send it as the idempotency key.
+        """
+        raise NotImplementedError
+
+
+class SimulatedGateway(Gateway):
+    """
+    Local stand-in with configurable latency, transient failures and declines.
+    Like a real provider it honors the idempotency key: charging the same
+    payment again returns the first charge's reference.
+    """
+
+    def __init__(self, name, latency=0.2, jitter=0.1, failure_rate=0.0, decline_rate=0.0):
+        super().__init__(name)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self.charges = {}
+
+    async def charge(self, payment):
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if payment.id in self.charges:
+            return self.charges[payment.id]
+        roll = random.random()
+        if roll < self.decline_rate:
+            raise PaymentDeclined('Card declined.')
+        if roll < self.decline_rate + self.failure_rate:
+            raise GatewayError('Gateway unavailable.')
+        return self.charges.setdefault(payment.id, f'sim_{uuid.uuid4().hex[:20]}')
+
+
+@cache
+def get_gateway(name):
+    config = settings.PAYMENT_GATEWAYS[name]
+    return import_string(config['BACKEND'])(name, **config.get('OPTIONS', {}))
+
+
+def retry_delay(attempts):
+    delay = settings.PAYMENT_RETRY_BACKOFF * 2 ** (attempts - 1)
+    return timedelta(seconds=min(MAX_BACKOFF, delay * random.uniform(0.5, 1.5)))
+
+
+def claim_payments(limit, using=DEFAULT_DB_ALIAS):
+    """
+    Mark up to `limit` due payments on the `using` shard as Processing and
+    return them. Payments
+    left Processing by a worker that died are reclaimed after
+    PAYMENT_CLAIM_TIMEOUT seconds.
+    """
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.PAYMENT_CLAIM_TIMEOUT)
+    due = (
+        Q(payment_status='Pending') & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))
+        | Q(payment_status='Processing', claimed_at__lt=stale)
+    )
+    with transaction.atomic(using=using):
+        payments = list(
+            Payment.objects.using(using).filter(due).select_for_update(skip_locked=True).order_by('id')[:limit]
+        )
+        Payment.objects.using(using).filter(id__in=[payment.id for payment in payments]).update(
+            payment_status='Processing', claimed_at=now)
+    return payments
+
+
+def record_charges(payments, using=DEFAULT_DB_ALIAS):
+    """Commit the gateway references of charged payments ahead of `settle`."""
+    charged = [payment for payment in payments if payment.gateway_reference]
+    if charged:
+        Payment.objects.using(using).bulk_update(charged, ['gateway_reference'])
+
+
+def settle(payments, using=DEFAULT_DB_ALIAS):
+    """Write back processed payments and their orders in two batched updates."""
+    if not payments:
+        return
+    with transaction.atomic(using=using):
+        Payment.objects.using(using).bulk_update(
+            payments,
+            ['payment_status', 'attempts', 'next_attempt_at', 'claimed_at', 'gateway_reference', 'last_error'],
+        )
+        outcome = {payment.order_id: payment.payment_status for payment in payments}
+        orders = list(Order.objects.using(using).filter(id__in=list(outcome)).select_for_update())
+        for order in orders:
+            order.payment_status = outcome[order.id]
+            if order.payment_status == 'Completed' and order.status == 'Pending':
+                order.status = 'Shipped'
+        Order.objects.using(using).bulk_update(orders, ['payment_status', 'status'])
+        transaction.on_commit(lambda: payments_settled.send(sender=Payment, orders=orders), using=using)
+
+
+class PaymentWorker:
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.PAYMENT_WORKER_BATCH_SIZE
+        self.semaphores = {
+            name: asyncio.Semaphore(config.get('CONCURRENCY', 10))
+            for name, config in settings.PAYMENT_GATEWAYS.items()
+        }
+        self.in_flight = set()
+        self.processed = []
+        self.stopping = False
+        self.totals = {'Completed': 0, 'Failed': 0, 'retried': 0}
+
+    async def process(self, payment):
+        config = settings.PAYMENT_GATEWAYS.get(payment.provider)
+        payment.attempts += 1
+        payment.claimed_at = None
+        if payment.gateway_reference:
+            # Charged on an earlier claim whose outcome was never settled.
+            payment.payment_status, payment.last_error = 'Completed', ''
+            self.processed.append(payment)
+            return
+        try:
+            if config is None:
+                raise PaymentDeclined(f'Unknown payment provider {payment.provider!r}.')
+            async with self.semaphores[payment.provider]:
+                payment.gateway_reference = await asyncio.wait_for(
+                    get_gateway(payment.provider).charge(payment), config.get('TIMEOUT', 10))
+            payment.payment_status, payment.last_error = 'Completed', ''
+        except (GatewayError, asyncio.TimeoutError) as exc:
+            self.fail(payment, str(exc) or 'Gateway timed out.', getattr(exc, 'retryable', True))
+        except Exception as exc:
+            logger.exception('Charging payment %s failed unexpectedly.', payment.id)
+            self.fail(payment, str(exc), retryable=True)
+        self.processed.append(payment)
+
+    @staticmethod
+    def fail(payment, error, retryable):
+        """Schedule a retry, or fail the payment once it is out of attempts."""
+        payment.last_error = error[:255]
+        if retryable and payment.attempts < settings.PAYMENT_MAX_ATTEMPTS:
+            payment.payment_status = 'Pending'
+            payment.next_attempt_at = timezone.now() + retry_delay(payment.attempts)
+        else:
+            payment.payment_status = 'Failed'
+
+    async def flush(self):
+        processed, self.processed = self.processed, []
+        if processed:
+            by_shard = {}
+            for payment in processed:
+                by_shard.setdefault(payment._state.db, []).append(payment)
+            for alias, payments in by_shard.items():
+                try:
+                    await sync_to_async(record_charges)(payments, alias)
+                    await sync_to_async(settle)(payments, alias)
+                except Exception:
+                    # Left Processing; reclaimed after PAYMENT_CLAIM_TIMEOUT,
+                    # and not charged again if the reference was recorded.
+                    logger.exception('Settling %d payments on %s failed.', len(payments), alias)
+                    continue
+                for payment in payments:
+                    key = payment.payment_status if payment.payment_status != 'Pending' else 'retried'
+                    self.totals[key] += 1
+
+    async def run(self, once=False):
+        """Claim, charge and settle until stopped (or, with `once`, until idle)."""
+        while not self.stopping:
+            claimed = []
+            for alias in sharding.all_shards():
+                capacity = self.batch_size - len(self.in_flight) - len(claimed)
+                if capacity > 0:
+                    claimed += await sync_to_async(claim_payments)(capacity, alias)
+            for payment in claimed:
+                task = asyncio.create_task(self.process(payment))
+                self.in_flight.add(task)
+                task.add_done_callback(self.in_flight.discard)
+            if not claimed and not self.in_flight and not self.processed:
+                if once:
+                    break
+                await asyncio.sleep(settings.PAYMENT_WORKER_POLL_INTERVAL)
+                continue
+            await asyncio.sleep(settings.PAYMENT_WORKER_FLUSH_INTERVAL)
+            await self.flush()
+        if self.in_flight:
+            await asyncio.wait(self.in_flight)
+        await self.flush()
+        return self.totals
@@ -0,0 +1,204 @@
+"""
+Price evaluation with promotions.
+
+Active promotions are compiled once per promotion version into lookup
+tables keyed by product, by category and global: the best percent and
+fixed discount and the best buy-X-get-Y deal per key, plus cart
+thresholds sorted by subtotal with a running best discount. Pricing a
+cart or a page of products is then a single pass doing a few dict lookups
+per line and one bisect per cart, with no per-rule checks.
+
+Saving or deleting a Promotion bumps the promotion version (core.signals),
+and a compiled set also expires at the next promotion start or end.
+"""
+import bisect
+import logging
+import threading
+from dataclasses import dataclass, field
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+
+from core.cache import promotion_version
+from core.models import Promotion
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0')
+GLOBAL = None
+
+
+def money(value):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@dataclass
+class LineQuote:
+    product_id: int
+    quantity: int
+    unit_price: Decimal
+    discounted_unit_price: Decimal
+    free_units: int
+    total: Decimal
+
+    @property
+    def effective_unit_price(self):
+        """Unit price with the free bundle units spread over the line."""
+        return money(self.total / self.quantity) if self.quantity else self.discounted_unit_price
+
+
+@dataclass
+class CartQuote:
+    lines: list = field(default_factory=list)
+    cart_discount: Decimal = ZERO
+
+    @property
+    def subtotal(self):
+        """Total at list prices."""
+        return sum((line.unit_price * line.quantity for line in self.lines), ZERO)
+
+    @property
+    def items_total(self):
+        """Total after item promotions; what cart thresholds are measured against."""
+        return sum((line.total for line in self.lines), ZERO)
+
+    @property
+    def item_discount(self):
+        return self.subtotal - self.items_total
+
+    @property
+    def discount(self):
+        return self.item_discount + self.cart_discount
+
+    @property
+    def total(self):
+        return self.items_total - self.cart_discount
+
+
+class CompiledRules:
+    def __init__(self, promotions, valid_until):
+        self.valid_until = valid_until
+        # key: ('product', id), ('category', id) or GLOBAL
+        self.percent = {}
+        self.fixed = {}
+        self.bundles = {}
+        thresholds = []
+        for promotion in promotions:
+            try:
+                # Constraints keep invalid rules out of the table, but one bad
+                # row must never break pricing for every cart.
+                promotion.clean()
+            except ValidationError:
+                logger.warning('Skipping invalid promotion #%s.', promotion.pk, exc_info=True)
+                continue
+            if promotion.kind == 'cart_threshold':
+                thresholds.append((promotion.min_subtotal, promotion.value))
+                continue
+            key = self._key(promotion)
+            if promotion.kind == 'percent':
+                self.percent[key] = max(self.percent.get(key, ZERO), promotion.value / 100)
+            elif promotion.kind == 'fixed':
+                self.fixed[key] = max(self.fixed.get(key, ZERO), promotion.value)
+            elif promotion.kind == 'buy_x_get_y':
+                deal = (promotion.buy_quantity, promotion.get_quantity)
+                best = self.bundles.get(key)
+                if best is None or deal[1] / sum(deal) > best[1] / sum(best):
+                    self.bundles[key] = deal
+
+        thresholds.sort()
+        self.threshold_minimums = [minimum for minimum, _ in thresholds]
+        self.threshold_discounts = []
+        best = ZERO
+        for _, value in thresholds:
+            best = max(best, value)
+            self.threshold_discounts.append(best)
+
+    @staticmethod
+    def _key(promotion):
+        if promotion.product_id:
+            return 'product', promotion.product_id
+        if promotion.category_id:
+            return 'category', promotion.category_id
+        return GLOBAL
+
+    def _best(self, table, product_id, category_id):
+        return max(
+            table.get(('product', product_id), ZERO),
+            table.get(('category', category_id), ZERO),
+            table.get(GLOBAL, ZERO),
+        )
+
+    def unit_price(self, product_id, category_id, price):
+        percent = self._best(self.percent, product_id, category_id)
+        fixed = self._best(self.fixed, product_id, category_id)
+        return max(ZERO, money(min(price * (1 - percent), price - fixed)))
+
+    def bundle(self, product_id, category_id):
+        return (
+            self.bundles.get(('product', product_id))
+            or self.bundles.get(('category', category_id))
+            or self.bundles.get(GLOBAL)
+        )
+
+    def price_line(self, product, quantity):
+        unit = self.unit_price(product.id, product.category_id, product.price)
+        free = 0
+        deal = self.bundle(product.id, product.category_id)
+        if deal:
+            free = quantity // sum(deal) * deal[1]
+        return LineQuote(product.id, quantity, product.price, unit, free, unit * (quantity - free))
+
+    def cart_discount(self, subtotal):
+        position = bisect.bisect_right(self.threshold_minimums, subtotal)
+        return min(subtotal, self.threshold_discounts[position - 1]) if position else ZERO
+
+
+_lock = threading.Lock()
+_compiled = {}
+
+
+def compile_rules(now=None):
+    now = now or timezone.now()
+    promotions = list(
+        Promotion.objects.filter(is_active=True)
+        .filter(Q(starts_at__isnull=True) | Q(starts_at__lte=now))
+        .filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now))
+    )
+    upcoming = Promotion.objects.filter(is_active=True).filter(Q(starts_at__gt=now) | Q(ends_at__gt=now))
+    boundaries = [
+        moment for pair in upcoming.values_list('starts_at', 'ends_at')
+        for moment in pair if moment is not None and moment > now
+    ]
+    return CompiledRules(promotions, min(boundaries, default=None))
+
+
+def rules():
+    """Compiled rules for the current promotion version, built once per process."""
+    version = promotion_version()
+    compiled = _compiled.get(version)
+    now = timezone.now()
+    if compiled is None or (compiled.valid_until is not None and now >= compiled.valid_until):
+        with _lock:
+            compiled = _compiled.get(version)
+            if compiled is None or (compiled.valid_until is not None and now >= compiled.valid_until):
+                compiled = compile_rules(now)
+                _compiled.clear()
+                _compiled[version] = compiled
+    return compiled
+
+
+def display_prices(products):
+    """Promotional unit price of each product, keyed by id."""
+    compiled = rules()
+    return {product.id: compiled.unit_price(product.id, product.category_id, product.price) for product in products}
+
+
+def price_cart(lines):
+    """Price `lines` of (product, quantity) with every applicable promotion."""
+    compiled = rules()
+    quote = CartQuote(lines=[compiled.price_line(product, quantity) for product, quantity in lines])
+    quote.cart_discount = compiled.cart_discount(quote.items_total)
+    return quote
@@ -0,0 +1,144 @@
+"""
+On-demand statistical profiler for a running worker.
+
+`start(seconds)` starts a background thread that samples the Python stack
+of every other thread in the process every `interval` seconds via
+sys._current_frames() and counts identical stacks, so the worker keeps
+serving requests (the very ones being profiled) while it runs. The result
+is stored in the cache under the profile's id, where `result(id)` finds it
+from any worker, in the collapsed format read by flamegraph.pl, speedscope
+and similar tools: one line per distinct stack, frames from the outermost
+in separated by ';', then the sample count.
+
+Nothing is installed in the interpreter and no thread runs between
+profiles. A profile costs one stack walk per thread per interval while it
+runs, and only one profile runs per process at a time.
+"""
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+MAX_DEPTH = 128
+# Leaf functions of threads blocked waiting, left out unless idle stacks are wanted.
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'accept', 'sleep', '_wait_for_tstate_lock', 'readinto', 'recv_into'}
+
+_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _short_path(filename, prefixes):
+    for prefix in prefixes:
+        if filename.startswith(prefix + os.sep):
+            return filename[len(prefix) + 1:]
+    return filename
+
+
+class _FrameLabels(dict):
+    """Frame labels by code object, with paths relative to sys.path as it was when the profile started."""
+
+    def __init__(self):
+        super().__init__()
+        self.prefixes = sorted((path for path in sys.path if path), key=len, reverse=True)
+
+    def __missing__(self, code):
+        name = getattr(code, 'co_qualname', code.co_name)
+        label = f'{name} ({_short_path(code.co_filename, self.prefixes)}:{code.co_firstlineno})'.replace(';', ':')
+        self[code] = label
+        return label
+
+
+def _collapse(thread_name, frame, include_idle, frame_labels):
+    if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+        return None
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(frame_labels[frame.f_code])
+        frame = frame.f_back
+    labels.append(thread_name.replace(';', ':').replace(' ', '_'))
+    return ';'.join(reversed(labels))
+
+
+def sample(seconds, interval, include_idle=False):
+    """Sample the other threads for `seconds`; returns (stack counts, samples taken)."""
+    ignored = {threading.get_ident()}
+    frame_labels = _FrameLabels()
+    counts = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in ignored:
+                continue
+            stack = _collapse(names.get(thread_id, str(thread_id)), frame, include_idle, frame_labels)
+            if stack:
+                counts[stack] += 1
+        del frame
+        samples += 1
+        time.sleep(interval)
+    return counts, samples
+
+
+def collapsed(counts):
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(counts.items()))
+
+
+def _cache_key(profile_id):
+    return f'profile:{profile_id}'
+
+
+def _run(profile_id, seconds, interval, include_idle, info):
+    try:
+        counts, samples = sample(seconds, interval, include_idle)
+        cache.set(_cache_key(profile_id), {**info, 'status': 'done', 'samples': samples,
+                                           'collapsed': collapsed(counts)}, settings.PROFILER_RESULT_TIMEOUT)
+    except Exception:
+        logger.exception('Profile %s failed.', profile_id)
+        cache.set(_cache_key(profile_id), {**info, 'status': 'failed'}, settings.PROFILER_RESULT_TIMEOUT)
+    finally:
+        _lock.release()
+
+
+def start(seconds, interval, include_idle=False):
+    """
+    Start a profile of this process in the background and return its
+    description; raises ProfilerBusy if one is already running here.
+    """
+    if not _lock.acquire(blocking=False):
+        raise ProfilerBusy
+    info = {
+        'id': uuid.uuid4().hex,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'seconds': seconds,
+        'interval': interval,
+        'started_at': time.time(),
+    }
+    try:
+        cache.set(_cache_key(info['id']), {**info, 'status': 'running'},
+                  seconds + settings.PROFILER_RESULT_TIMEOUT)
+        threading.Thread(
+            target=_run, args=(info['id'], seconds, interval, include_idle, info), name='profiler', daemon=True,
+        ).start()
+    except Exception:
+        _lock.release()
+        raise
+    return {**info, 'status': 'running'}
+
+
+def result(profile_id):
+    """The stored state of a profile: running, done (with `collapsed`) or failed; None if unknown."""
+    return cache.get(_cache_key(profile_id))
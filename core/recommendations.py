@@ -0,0 +1,145 @@
+"""
+"Frequently bought together" recommendations.
+
+ProductCooccurrence is a sparse, symmetric product x product matrix of how
+many orders contained both products. Once a checkout commits, its order
+is added with one upsert and the top-K rows of the products involved are
+refreshed; `rebuild` recomputes everything in batches from OrderItem and
+the item snapshots of archived orders.
+Readers only ever touch the compact ProductRecommendation table.
+"""
+import heapq
+import itertools
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from core import sharding
+from core.models import ArchivedOrder, OrderItem, ProductCooccurrence, ProductRecommendation
+
+MAX_PRODUCTS_PER_ORDER = 50
+WRITE_BATCH_SIZE = 5000
+
+
+def _pairs(product_ids):
+    product_ids = sorted(set(product_ids))[:MAX_PRODUCTS_PER_ORDER]
+    return itertools.permutations(product_ids, 2)
+
+
+def _increment(pairs):
+    if not pairs:
+        return
+    table = connection.ops.quote_name(ProductCooccurrence._meta.db_table)
+    placeholders = ', '.join(['(%s, %s, 1)'] * len(pairs))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} (product_id, other_id, count) VALUES {placeholders} '
+            f'ON CONFLICT (product_id, other_id) DO UPDATE SET count = {table}.count + 1',
+            [value for pair in pairs for value in pair],
+        )
+
+
+def refresh_top_k(product_ids):
+    """
+    Rewrite the ProductRecommendation rows of `product_ids`.
+
+    Rows are upserted on (product, rank) rather than deleted and
+    re-inserted, so concurrent refreshes of the same product never collide
+    on the unique rank; ranks past a product's current list are removed.
+    """
+    top_k = settings.RECOMMENDATIONS_TOP_K
+    ranked = (
+        ProductCooccurrence.objects.filter(product_id__in=product_ids)
+        .annotate(position=Window(
+            RowNumber(), partition_by=F('product_id'), order_by=[F('count').desc(), F('other_id')]))
+        .filter(position__lte=top_k)
+        .values_list('product_id', 'other_id', 'count', 'position')
+    )
+    rows = [
+        ProductRecommendation(product_id=product_id, recommended_id=other_id, score=count, rank=position)
+        for product_id, other_id, count, position in ranked
+    ]
+    lengths = Counter(row.product_id for row in rows)
+    stale = Q()
+    for product_id in product_ids:
+        stale |= Q(product_id=product_id, rank__gt=lengths[product_id])
+    with transaction.atomic():
+        ProductRecommendation.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=['product', 'rank'], update_fields=['recommended', 'score'])
+        ProductRecommendation.objects.filter(stale).delete()
+
+
+def record_order(order):
+    """
+    Add one order's products to the co-occurrence matrix.
+
+    Called once the checkout has committed, so the upserts never hold locks
+    on hot products inside the checkout transaction.
+    """
+    product_ids = set(OrderItem.objects.using(order._state.db).filter(order=order).values_list('product_id', flat=True))
+    pairs = list(_pairs(product_ids))
+    if not pairs:
+        return
+    with transaction.atomic():
+        _increment(pairs)
+        refresh_top_k(product_ids)
+
+
+def _order_products(chunk_size):
+    """Yield the product ids of every order, live or archived, one order at a time."""
+    for alias in sharding.all_shards():
+        items = (
+            OrderItem.objects.using(alias).order_by('order_id')
+            .values_list('order_id', 'product_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        for _, group in itertools.groupby(items, key=lambda item: item[0]):
+            yield [product_id for _, product_id in group]
+        snapshots = ArchivedOrder.objects.using(alias).values_list('items_snapshot', flat=True)
+        for snapshot in snapshots.iterator(chunk_size=chunk_size):
+            yield [item['id'] for item in snapshot]
+
+
+def rebuild(chunk_size=10000):
+    """
+    Recompute the matrix and all top-K lists from every order.
+
+    Orders are streamed one shard after another, live items in order_id
+    order and then archived snapshots; pair counts for each chunk of
+    orders are accumulated in a Counter and merged, so only the sparse
+    matrix itself is held in memory.
+    """
+    counts = Counter()
+    batch = Counter()
+    for index, product_ids in enumerate(_order_products(chunk_size)):
+        batch.update(_pairs(product_ids))
+        if index % chunk_size == chunk_size - 1:
+            counts.update(batch)
+            batch = Counter()
+    counts.update(batch)
+
+    neighbours = defaultdict(list)
+    for (product_id, other_id), count in counts.items():
+        neighbours[product_id].append((count, -other_id))
+
+    top_k = settings.RECOMMENDATIONS_TOP_K
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        ProductCooccurrence.objects.all().delete()
+        ProductCooccurrence.objects.bulk_create(
+            (ProductCooccurrence(product_id=product_id, other_id=other_id, count=count)
+             for (product_id, other_id), count in counts.items()),
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        ProductRecommendation.objects.bulk_create(
+            (
+                ProductRecommendation(product_id=product_id, recommended_id=-negative_id, score=count, rank=rank)
+                for product_id, candidates in neighbours.items()
+                for rank, (count, negative_id) in enumerate(heapq.nlargest(top_k, candidates), start=1)
+            ),
+            batch_size=WRITE_BATCH_SIZE,
+        )
+    return len(counts), len(neighbours)
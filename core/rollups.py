@@ -0,0 +1,74 @@
+"""
+Incremental maintenance of the daily sales rollup tables.
+
+Every order that is not cancelled contributes its items to DailySales,
+DailyProductSales and DailyCategorySales for the day it was created.
+DailySales keeps the day's order count, which can't be summed from the
+per-category rows when an order spans several categories.
+`apply_order` adds (or, with sign=-1, removes) one order's contribution
+with a single upsert per table, so rollups stay current without ever
+scanning OrderItem. `rebuild_sales_rollups` recomputes them from scratch.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection
+
+from core.models import DailyCategorySales, DailyProductSales, DailySales, OrderItem, Product
+
+EXCLUDED_STATUSES = ('Cancelled',)
+
+
+def is_counted(status):
+    return status not in EXCLUDED_STATUSES
+
+
+def _upsert(model, key_columns, rows):
+    """Add `rows` of (*keys, orders, units, revenue) onto existing totals."""
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    keys = ', '.join(key_columns)
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * (len(key_columns) + 3)) + ')'] * len(rows))
+    params = [value for row in rows for value in row]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({keys}, orders, units, revenue) VALUES {placeholders} '
+            f'ON CONFLICT ({keys}) DO UPDATE SET '
+            f'orders = {table}.orders + EXCLUDED.orders, '
+            f'units = {table}.units + EXCLUDED.units, '
+            f'revenue = {table}.revenue + EXCLUDED.revenue',
+            params,
+        )
+
+
+def apply_order(order, sign=1):
+    """Add (sign=1) or subtract (sign=-1) an order's items from the rollups."""
+    day = order.created_at.date()
+    products = defaultdict(lambda: [0, Decimal(0)])
+    categories = defaultdict(lambda: [0, Decimal(0)])
+    # Items live on the order's shard, products on the global database.
+    items = list(OrderItem.objects.using(order._state.db).filter(order=order).values_list(
+        'product_id', 'quantity', 'price'))
+    category_of = dict(Product.objects.filter(id__in={item[0] for item in items}).values_list('id', 'category_id'))
+    for product_id, quantity, price in items:
+        for totals in (products[product_id], categories[category_of.get(product_id)]):
+            totals[0] += quantity
+            totals[1] += price
+    categories.pop(None, None)
+    if not items:
+        return
+
+    _upsert(DailySales, ['date'], [(
+        day, sign,
+        sign * sum(units for units, _ in products.values()),
+        sign * sum((revenue for _, revenue in products.values()), Decimal(0)),
+    )])
+    _upsert(DailyProductSales, ['date', 'product_id'], [
+        (day, product_id, sign, sign * units, sign * revenue)
+        for product_id, (units, revenue) in products.items()
+    ])
+    _upsert(DailyCategorySales, ['date', 'category_id'], [
+        (day, category_id, sign, sign * units, sign * revenue)
+        for category_id, (units, revenue) in categories.items()
+    ])
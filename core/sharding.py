@@ -0,0 +1,330 @@
+"""
+Horizontal sharding of user-owned data.
+
+Carts, cart items, shipping addresses, orders, order items, payments and
+archived orders (SHARDED_MODELS) live on one of the database aliases in
+USER_SHARDS, chosen per user. Users, the catalog, promotions, rollups and
+recommendations stay global on 'default'; rows on a shard refer to them by
+id only, so deleting a user or product cascades through the ORM on
+'default' and through `delete_user_rows` / `delete_product_rows`
+(core.signals) on the other shards.
+
+UserShard is the directory of which shard holds each user. New users are
+placed by a consistent-hash ring over USER_SHARDS, so adding a shard only
+changes where new users go; `rebalance_user_shards` moves existing users
+to where the ring now places them, online and one user at a time.
+
+ShardRouter (DATABASE_ROUTERS) sends queries on sharded models to the
+shard of the instance they relate to, else to the active shard: the shard
+of the authenticated user for requests (ShardMiddleware), or the one set
+with `use_shard` by commands and workers, which visit every shard in turn.
+
+The directory is cached in the default cache, which must be shared by
+all workers (see core.checks): a worker with its own cache would keep
+routing a moved user to the old shard until its entry expired.
+
+Every shard is migrated like 'default' (`migrate --database <alias>`); the
+global tables there stay empty. On Postgres and SQLite each shard hands
+out ids from its own range (see `reserve_id_range`), so rows keep their
+ids when their user is moved. With USER_SHARDS = ['default'] nothing is
+routed anywhere else.
+"""
+import bisect
+import contextlib
+import functools
+import hashlib
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from core.models import ArchivedOrder, Cart, CartItem, Order, OrderItem, Payment, ShippingAddress, User, UserShard
+
+# In the order rows are copied to a new shard; deleted in reverse.
+SHARDED_MODELS = [Cart, ShippingAddress, Order, OrderItem, Payment, CartItem, ArchivedOrder]
+SHARDED_LABELS = {model._meta.label_lower for model in SHARDED_MODELS}
+
+VIRTUAL_NODES = 128
+# Ids allocated on the shard at position n of USER_SHARDS start at n << ID_RANGE_BITS.
+ID_RANGE_BITS = 40
+
+_active = ContextVar('user_shard', default=None)
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_LABELS
+
+
+def all_shards():
+    return list(settings.USER_SHARDS)
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of user ids onto shard aliases."""
+
+    def __init__(self, aliases, replicas=VIRTUAL_NODES):
+        points = sorted((_hash(f'{alias}#{index}'), alias) for alias in aliases for index in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.aliases = [alias for _, alias in points]
+
+    def node(self, key):
+        position = bisect.bisect(self.hashes, _hash(key)) % len(self.hashes)
+        return self.aliases[position]
+
+
+@functools.cache
+def _ring(aliases):
+    return HashRing(aliases)
+
+
+def placement(user_id):
+    """The shard the ring places `user_id` on."""
+    return _ring(tuple(all_shards())).node(user_id)
+
+
+def _cache_key(user_id):
+    return f'user-shard:{user_id}'
+
+
+def assign(user_id):
+    """Create the directory entry of a new user and return its shard."""
+    entry, _ = UserShard.objects.get_or_create(user_id=user_id, defaults={'alias': placement(user_id)})
+    return entry.alias
+
+
+def shard_for_user(user_id):
+    """The shard holding `user_id`'s data, from the (cached) directory."""
+    shards = settings.USER_SHARDS
+    if len(shards) == 1:
+        return shards[0]
+    alias = cache.get(_cache_key(user_id))
+    if alias is None:
+        alias = UserShard.objects.filter(user_id=user_id).values_list('alias', flat=True).first()
+        alias = alias or assign(user_id)
+        cache.set(_cache_key(user_id), alias, settings.USER_SHARD_CACHE_TIMEOUT)
+    return alias
+
+
+def current_shard():
+    """The explicitly activated shard, or the shard of the current request's user."""
+    active = _active.get()
+    if active is None or isinstance(active, str):
+        return active
+    user = getattr(active, 'user', None)
+    if user is None or not user.is_authenticated:
+        return None
+    cached = getattr(active, '_user_shard', None)
+    if cached is None or cached[0] != user.pk:
+        cached = active._user_shard = (user.pk, shard_for_user(user.pk))
+    return cached[1]
+
+
+@contextlib.contextmanager
+def use_shard(alias):
+    """Route sharded queries without a related instance to `alias`."""
+    token = _active.set(alias)
+    try:
+        yield alias
+    finally:
+        _active.reset(token)
+
+
+def each_shard():
+    """Yield every shard alias with that shard active."""
+    for alias in all_shards():
+        with use_shard(alias):
+            yield alias
+
+
+class ShardMiddleware:
+    """Make the request's user's shard the active one while it is served."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        # The request itself is stored: DRF authenticates the user inside
+        # the view, after this middleware has run.
+        token = _active.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _active.reset(token)
+
+    async def __acall__(self, request):
+        token = _active.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            _active.reset(token)
+
+
+def _instance_shard(instance):
+    if instance._state.db:
+        return instance._state.db
+    user_id = getattr(instance, 'user_id', None)
+    if user_id:
+        return shard_for_user(user_id)
+    for related in instance._state.fields_cache.values():
+        if related is not None and is_sharded(type(related)) and related._state.db:
+            return related._state.db
+    return None
+
+
+class ShardRouter:
+    def _route(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            if is_sharded(type(instance)):
+                alias = _instance_shard(instance)
+                if alias:
+                    return alias
+            elif isinstance(instance, User) and instance.pk:
+                return shard_for_user(instance.pk)
+        return current_shard()
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows refer to users and products on 'default' by id.
+        if is_sharded(type(obj1)) or is_sharded(type(obj2)):
+            return True
+        return None
+
+
+def reserve_id_range(alias):
+    """Start the id sequences of the sharded tables on `alias` at its range."""
+    if alias not in settings.USER_SHARDS:
+        return
+    start = settings.USER_SHARDS.index(alias) << ID_RANGE_BITS
+    if not start:
+        return
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in SHARDED_MODELS:
+            if not model._meta.pk.auto_created:
+                continue
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, model._meta.pk.column])
+                sequence = cursor.fetchone()[0]
+                cursor.execute(f'SELECT last_value FROM {sequence}')
+                if cursor.fetchone()[0] < start:
+                    cursor.execute('SELECT setval(%s, %s, false)', [sequence, start])
+            elif connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start - 1])
+                elif row[0] < start - 1:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start - 1, table])
+
+
+def _user_rows(alias, user_id):
+    """Querysets of every row of `user_id` on `alias`, in copy order."""
+    manager = {model: model.objects.using(alias) for model in SHARDED_MODELS}
+    return [
+        (Cart, manager[Cart].filter(user_id=user_id)),
+        (ShippingAddress, manager[ShippingAddress].filter(user_id=user_id)),
+        (Order, manager[Order].filter(user_id=user_id)),
+        (OrderItem, manager[OrderItem].filter(order__user_id=user_id)),
+        (Payment, manager[Payment].filter(order__user_id=user_id)),
+        (CartItem, manager[CartItem].filter(cart__user_id=user_id)),
+        (ArchivedOrder, manager[ArchivedOrder].filter(user_id=user_id)),
+    ]
+
+
+def _other_shards():
+    # Deletes on 'default' cascade to its sharded rows through the ORM as usual.
+    return [alias for alias in all_shards() if alias != DEFAULT_DB_ALIAS]
+
+
+def delete_user_rows(user_id):
+    """Apply a user's deletion to the rows it owns on the other shards."""
+    for alias in _other_shards():
+        with transaction.atomic(using=alias):
+            for model, queryset in reversed(_user_rows(alias, user_id)):
+                queryset.delete()
+
+
+def delete_product_rows(product_id):
+    """Apply a product's deletion to cart and order items on the other shards."""
+    for alias in _other_shards():
+        with transaction.atomic(using=alias):
+            CartItem.objects.using(alias).filter(product_id=product_id).delete()
+            OrderItem.objects.using(alias).filter(product_id=product_id).delete()
+
+
+def _copy(source, target, user_id, lock):
+    """Copy the user's rows on `source` to `target`; return them by model."""
+    from core import archive
+
+    copied = []
+    for model, queryset in _user_rows(source, user_id):
+        if lock and model in (Cart, ShippingAddress, Order):
+            queryset = queryset.select_for_update()
+        rows = list(queryset.order_by('pk'))
+        if model is ArchivedOrder and rows:
+            archive.ensure_partitions((row.created_at for row in rows), using=target)
+        model.objects.using(target).bulk_create(rows)
+        copied.append((model, [row.pk for row in rows]))
+    return copied
+
+
+def _delete(alias, copied):
+    for model, ids in reversed(copied):
+        model.objects.using(alias).filter(pk__in=ids).delete()
+
+
+def move_user(user_id, target):
+    """
+    Move every row of `user_id` to the `target` shard and repoint the
+    directory. Returns the number of rows moved.
+
+    The user's carts, addresses and orders are locked on the source while
+    they are copied, so updates to them wait for the move. Rows inserted
+    meanwhile, or by requests that still routed to the source, are swept
+    across in a second pass after the directory has been switched; requests
+    already in flight at that point are caught by a later `sweep_user`.
+    """
+    source = UserShard.objects.filter(user_id=user_id).values_list('alias', flat=True).first()
+    source = source or assign(user_id)
+    if source == target:
+        return 0
+
+    with transaction.atomic(using=source):
+        with transaction.atomic(using=target):
+            # Leftovers of an earlier, interrupted move to `target`.
+            for model, queryset in reversed(_user_rows(target, user_id)):
+                queryset.delete()
+            copied = _copy(source, target, user_id, lock=True)
+        # The copy is committed before the directory points at it.
+        UserShard.objects.filter(user_id=user_id).update(alias=target, moved_at=timezone.now())
+        _delete(source, copied)
+    cache.delete(_cache_key(user_id))
+
+    return sum(len(ids) for _, ids in copied) + sweep_user(user_id, source, target)
+
+
+def sweep_user(user_id, source, target):
+    """Move rows of `user_id` written to `source` after it moved to `target`."""
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        swept = _copy(source, target, user_id, lock=False)
+        _delete(source, swept)
+    return sum(len(ids) for _, ids in swept)
@@ -0,0 +1,78 @@
+"""
+Signal handlers keeping derived data in step with the models.
+"""
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save
+from django.dispatch import receiver
+
+from core import rollups, sharding
+from core.cache import bump_catalog_version, bump_promotion_version
+from core.models import Category, Order, Payment, Product, Promotion, User
+
+
+def is_stock_update(update_fields):
+    """Whether a save only wrote the stock level, as checkout does."""
+    return bool(update_fields) and set(update_fields) <= {'quantity'}
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog(sender, instance, update_fields=None, **kwargs):
+    # Stock changes on every purchase; cached catalog data only depends on
+    # it through the in-stock facet, which changes when a product sells out.
+    if sender is Product and is_stock_update(update_fields) and instance.quantity > 0:
+        return
+    bump_catalog_version()
+
+
+@receiver([post_save, post_delete], sender=Promotion)
+def invalidate_promotions(sender, **kwargs):
+    bump_promotion_version()
+
+
+@receiver(post_init, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # Read from __dict__ so a deferred status is not fetched just for this.
+    instance._loaded_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Order)
+def update_sales_rollups(sender, instance, created, **kwargs):
+    """
+    Move an order in or out of the rollups when it is cancelled or
+    reinstated. New orders are added by checkout once their items exist.
+    """
+    previous = instance._loaded_status
+    instance._loaded_status = instance.status
+    if created or previous is None:
+        return
+    was_counted, is_counted = rollups.is_counted(previous), rollups.is_counted(instance.status)
+    if was_counted != is_counted:
+        rollups.apply_order(instance, sign=1 if is_counted else -1)
+
+
+@receiver(post_save, sender=Payment)
+def sync_order_payment_status(sender, instance, **kwargs):
+    Order.objects.using(instance._state.db).filter(pk=instance.order_id).exclude(
+        payment_status=instance.payment_status).update(payment_status=instance.payment_status)
+
+
+@receiver(post_save, sender=User)
+def assign_user_shard(sender, instance, created, **kwargs):
+    if created:
+        sharding.assign(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_user_rows(sender, instance, **kwargs):
+    sharding.delete_user_rows(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def delete_sharded_product_rows(sender, instance, **kwargs):
+    sharding.delete_product_rows(instance.pk)
+
+
+@receiver(post_migrate)
+def reserve_shard_id_range(sender, using, **kwargs):
+    if sender.name == 'core':
+        sharding.reserve_id_range(using)
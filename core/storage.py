@@ -0,0 +1,76 @@
+"""
+Content-addressed media storage.
+"""
+import hashlib
+import os
+import re
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.utils.deconstruct import deconstructible
+
+HASHED_NAME_RE = re.compile(r'(?:^|/)[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(?:\.[A-Za-z0-9]+)?$')
+
+
+def content_digest(content):
+    """Return the sha256 hex digest of a file, reading it in chunks."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def digest_from_name(name):
+    """Return the digest embedded in a content-addressed name, or None."""
+    match = HASHED_NAME_RE.search(name or '')
+    return match.group('digest') if match else None
+
+
+@deconstructible(path='core.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that names files after the sha256 of their content.
+
+    `product_images/photo.JPG` is stored as
+    `product_images/<d[:2]>/<digest>.jpg`, so identical uploads share one
+    blob and a name never points at different bytes. Unreferenced blobs are
+    removed by the `gc_media` management command.
+    """
+
+    def hashed_name(self, name, content):
+        dir_name, file_name = os.path.split(str(name).replace('\\', '/'))
+        ext = os.path.splitext(file_name)[1].lower()
+        digest = content_digest(content)
+        return '/'.join(part for part in (dir_name, digest[:2], digest + ext) if part)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        validate_file_name(name, allow_relative_path=True)
+        name = self.hashed_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        if max_length and len(name) > max_length:
+            raise SuspiciousFileOperation(
+                'Storage can not find an available filename for "%s". '
+                'Please make sure that the corresponding file field '
+                'allows sufficient "max_length".' % name
+            )
+
+        if self.exists(name):
+            try:
+                # Reusing a blob restarts gc_media's grace period, so an old
+                # orphan is not collected before the new reference commits.
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass
+        return self._save(name, content)
@@ -1,3 +1,1131 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import admin as core_admin
+from core import explain, maintenance, openapi, payments, profiler, recommendations, rollups, sharding, tracing
+from core.models import (
+    ArchivedOrder, Cart, CartItem, Category, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem,
+    Payment, Product, ProductCooccurrence, ProductRecommendation, ShippingAddress, User, UserShard,
+)
+
+
+def create_order(user, product, quantity=1):
+    """A pending order of `quantity` x `product`, written to the user's shard."""
+    # Manager.create() routes without the instance, so activate the shard as requests do.
+    with sharding.use_shard(sharding.shard_for_user(user.pk)):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        address = ShippingAddress.objects.create(
+            user=user, address='1 Main St', city='Tbilisi', postal_code='0100', country='GE', phone_number='555')
+        order = Order.objects.create(
+            user=user, cart=cart, shipping_address=address, total_price=product.price * quantity, status='Pending')
+        OrderItem.objects.create(order=order, product=product, quantity=quantity, price=product.price * quantity)
+    return order
+
+
+class HashRingTests(TestCase):
+    def test_placement_is_stable(self):
+        ring = sharding.HashRing(['a', 'b'])
+        self.assertEqual([ring.node(key) for key in range(100)], [ring.node(key) for key in range(100)])
+
+    def test_adding_a_shard_only_moves_users_to_it(self):
+        before, after = sharding.HashRing(['a', 'b']), sharding.HashRing(['a', 'b', 'c'])
+        moved = [key for key in range(3000) if before.node(key) != after.node(key)]
+        self.assertTrue(all(after.node(key) == 'c' for key in moved))
+        self.assertAlmostEqual(len(moved) / 3000, 1 / 3, delta=0.1)
+
+
+@override_settings(USER_SHARDS=['default', 'other'])
+class ShardRoutingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = sharding.ShardRouter()
+        self.user = User.objects.create_user('shopper@example.com', 'pw')
+
+    def test_new_user_is_placed_by_the_ring(self):
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, sharding.placement(self.user.pk))
+
+    def test_directory_is_cached(self):
+        alias = sharding.shard_for_user(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.shard_for_user(self.user.pk), alias)
+
+    def test_instances_route_to_their_users_shard(self):
+        UserShard.objects.filter(user=self.user).update(alias='other')
+        self.assertEqual(self.router.db_for_write(Order, instance=Order(user=self.user)), 'other')
+        self.assertEqual(self.router.db_for_read(Cart, instance=self.user), 'other')
+
+    def test_related_instances_follow_their_parent(self):
+        order = Order(user_id=self.user.pk)
+        order._state.db = 'other'
+        item = OrderItem(order=order)
+        self.assertEqual(self.router.db_for_write(OrderItem, instance=item), 'other')
+
+    def test_global_models_stay_on_default(self):
+        with sharding.use_shard('other'):
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+            self.assertEqual(self.router.db_for_write(UserShard), 'default')
+
+    def test_queries_without_an_instance_use_the_active_shard(self):
+        self.assertIsNone(self.router.db_for_read(Order))
+        with sharding.use_shard('other'):
+            self.assertEqual(self.router.db_for_read(Order), 'other')
+        self.assertEqual(list(sharding.each_shard()), ['default', 'other'])
+
+
+class SingleShardTests(TestCase):
+    @override_settings(USER_SHARDS=['default'])
+    def test_single_shard_skips_the_directory(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(sharding.shard_for_user(12345), 'default')
+
+
+@skipUnless(len(settings.USER_SHARDS) > 1, 'Needs a second database in USER_SHARDS.')
+class MoveUserTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Books')
+        self.product = Product.objects.create(category=category, name='Dune', price=Decimal('10.00'), quantity=5)
+        self.user = User.objects.create_user('mover@example.com', 'pw')
+        self.source = sharding.shard_for_user(self.user.pk)
+        self.target = next(alias for alias in settings.USER_SHARDS if alias != self.source)
+        self.order = create_order(self.user, self.product)
+        with sharding.use_shard(self.source):
+            CartItem.objects.create(cart=self.order.cart, product=self.product, quantity=2)
+            Payment.objects.create(order=self.order, payment_method='card', amount=self.order.total_price)
+
+    def counts(self, alias):
+        return {model.__name__: queryset.count() for model, queryset in sharding._user_rows(alias, self.user.pk)}
+
+    def test_move_user_copies_rows_and_repoints_the_directory(self):
+        before = self.counts(self.source)
+
+        moved = sharding.move_user(self.user.pk, self.target)
+
+        self.assertEqual(moved, sum(before.values()))
+        self.assertEqual(self.counts(self.target), before)
+        self.assertEqual(sum(self.counts(self.source).values()), 0)
+        self.assertEqual(UserShard.objects.get(user=self.user).alias, self.target)
+        self.assertEqual(sharding.shard_for_user(self.user.pk), self.target)
+        # Rows keep their ids, so references held elsewhere stay valid.
+        self.assertTrue(Order.objects.using(self.target).filter(pk=self.order.pk).exists())
+
+    def test_move_to_the_current_shard_is_a_no_op(self):
+        self.assertEqual(sharding.move_user(self.user.pk, self.source), 0)
+        self.assertEqual(Order.objects.using(self.source).filter(user=self.user).count(), 1)
+
+    def test_sweep_moves_rows_written_to_the_old_shard(self):
+        sharding.move_user(self.user.pk, self.target)
+        # Written by a request that still routed to the old shard.
+        ShippingAddress.objects.using(self.source).create(
+            user_id=self.user.pk, address='2 Side St', city='Batumi', postal_code='6000', country='GE',
+            phone_number='555')
+
+        self.assertEqual(sharding.sweep_user(self.user.pk, self.source, self.target), 1)
+        self.assertEqual(ShippingAddress.objects.using(self.target).filter(user_id=self.user.pk).count(), 2)
+        self.assertFalse(ShippingAddress.objects.using(self.source).filter(user_id=self.user.pk).exists())
+
+    def test_deleting_the_user_deletes_rows_on_every_shard(self):
+        sharding.move_user(self.user.pk, self.target)
+        self.user.delete()
+        for alias in settings.USER_SHARDS:
+            self.assertEqual(sum(self.counts(alias).values()), 0)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        User.objects.bulk_create([User(email=f'user{index}@example.com') for index in range(3)])
+
+    def postgres(self, estimate):
+        """Stand in for a Postgres connection whose planner estimates `estimate` rows."""
+        connection = mock.MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (estimate,)
+        return mock.patch.object(core_admin, 'connections', {'default': connection}), cursor
+
+    def count(self, queryset):
+        return core_admin.EstimatedCountPaginator(queryset, 50).count
+
+    def test_large_unfiltered_tables_use_the_planner_estimate(self):
+        patch, cursor = self.postgres(250000)
+        with patch, self.assertNumQueries(0):
+            self.assertEqual(self.count(User.objects.order_by('id')), 250000)
+        self.assertEqual(cursor.execute.call_args[0][1], [User._meta.db_table])
+
+    def test_small_estimates_and_filtered_lists_are_counted_exactly(self):
+        patch, cursor = self.postgres(40)
+        with patch:
+            self.assertEqual(self.count(User.objects.order_by('id')), 3)
+        patch, cursor = self.postgres(250000)
+        with patch:
+            self.assertEqual(self.count(User.objects.filter(email__startswith='user1').order_by('id')), 1)
+        cursor.execute.assert_not_called()
+
+    def test_other_databases_count_exactly(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.count(User.objects.order_by('id')), 3)
+
+
+class ShardedAdminTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('staff@example.com', 'pw'))
+        category = Category.objects.create(name='Books')
+        self.product = Product.objects.create(category=category, name='Dune', price=Decimal('10.00'), quantity=5)
+        self.shopper = User.objects.create_user('shopper@example.com', 'pw')
+        self.shard = settings.USER_SHARDS[-1]
+        UserShard.objects.filter(user=self.shopper).update(alias=self.shard)
+        cache.clear()
+        self.order = create_order(self.shopper, self.product)
+
+    def test_changelist_lists_orders_of_the_selected_shard(self):
+        response = self.client.get('/admin/core/order/', {'shard': self.shard})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([order.pk for order in response.context['cl'].result_list], [self.order.pk])
+        self.assertContains(response, 'shopper@example.com')
+
+    def test_search_by_email_resolves_the_user_on_default(self):
+        response = self.client.get('/admin/core/order/', {'shard': self.shard, 'q': 'Shopper@example.com'})
+
+        self.assertEqual([order.pk for order in response.context['cl'].result_list], [self.order.pk])
+
+    def test_change_page_finds_the_order_and_its_items_on_their_shard(self):
+        response = self.client.get(f'/admin/core/order/{self.order.pk}/change/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['original'].pk, self.order.pk)
+        self.assertEqual(len(response.context['inline_admin_formsets'][0].formset.queryset), 1)
+
+    @skipUnless(len(settings.USER_SHARDS) > 1, 'Needs a second database in USER_SHARDS.')
+    def test_other_shards_are_not_listed(self):
+        response = self.client.get('/admin/core/order/', {'shard': settings.USER_SHARDS[0]})
+
+        self.assertEqual(list(response.context['cl'].result_list), [])
+
+
+class ScriptedGateway(payments.Gateway):
+    """Plays back `outcomes` one charge at a time, repeating the last one."""
+
+    def __init__(self, name, outcomes=('ok',)):
+        super().__init__(name)
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    async def charge(self, payment):
+        self.calls.append(payment.id)
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if outcome == 'slow':
+            await asyncio.sleep(1)
+        elif isinstance(outcome, Exception):
+            raise outcome
+        return f'ref-{payment.id}'
+
+
+def scripted(*outcomes, timeout=10):
+    return {'test': {'BACKEND': 'core.tests.ScriptedGateway', 'TIMEOUT': timeout,
+                     'OPTIONS': {'outcomes': outcomes}}}
+
+
+@override_settings(PAYMENT_GATEWAYS=scripted('ok'), PAYMENT_MAX_ATTEMPTS=3, PAYMENT_RETRY_BACKOFF=60,
+                   PAYMENT_WORKER_FLUSH_INTERVAL=0)
+class PaymentWorkerTests(TestCase):
+    # The worker claims payments on every shard.
+    databases = '__all__'
+
+    def setUp(self):
+        payments.get_gateway.cache_clear()
+        self.addCleanup(payments.get_gateway.cache_clear)
+        category = Category.objects.create(name='Books')
+        product = Product.objects.create(category=category, name='Dune', price=Decimal('10.00'), quantity=5)
+        self.order = create_order(User.objects.create_user('payer@example.com', 'pw'), product)
+        self.payment = Payment.objects.using(self.order._state.db).create(
+            order=self.order, payment_method='card', amount=self.order.total_price, provider='test')
+
+    def run_worker(self):
+        return async_to_sync(payments.PaymentWorker().run)(once=True)
+
+    def gateway(self):
+        return payments.get_gateway('test')
+
+    def test_successful_charge_completes_payment_and_ships_order(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            totals = self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(totals['Completed'], 1)
+        self.assertEqual(
+            (self.payment.payment_status, self.payment.attempts, self.payment.gateway_reference),
+            ('Completed', 1, f'ref-{self.payment.pk}'))
+        self.assertIsNone(self.payment.claimed_at)
+        self.assertEqual((self.order.status, self.order.payment_status), ('Shipped', 'Completed'))
+
+    @override_settings(PAYMENT_GATEWAYS=scripted(payments.GatewayError('Gateway unavailable.')))
+    def test_transient_failure_is_scheduled_for_retry(self):
+        totals = self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(totals['retried'], 1)
+        self.assertEqual((self.payment.payment_status, self.payment.attempts), ('Pending', 1))
+        self.assertEqual(self.payment.last_error, 'Gateway unavailable.')
+        self.assertGreater(self.payment.next_attempt_at, timezone.now())
+        # Not due yet, so not claimed again.
+        self.assertEqual(payments.claim_payments(10, self.payment._state.db), [])
+
+    @override_settings(PAYMENT_GATEWAYS=scripted(payments.GatewayError('Gateway unavailable.')),
+                       PAYMENT_RETRY_BACKOFF=0)
+    def test_transient_failures_stop_at_max_attempts(self):
+        self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.attempts), ('Failed', 3))
+        self.assertEqual(len(self.gateway().calls), 3)
+
+    @override_settings(PAYMENT_GATEWAYS=scripted(KeyError('bug')), PAYMENT_RETRY_BACKOFF=0)
+    def test_unexpected_errors_stop_at_max_attempts(self):
+        with self.assertLogs('core.payments', 'ERROR'):
+            self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.attempts), ('Failed', 3))
+
+    @override_settings(PAYMENT_GATEWAYS=scripted(payments.PaymentDeclined('Card declined.')))
+    def test_decline_fails_without_retrying(self):
+        self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.attempts), ('Failed', 1))
+        self.assertEqual(len(self.gateway().calls), 1)
+
+    @override_settings(PAYMENT_GATEWAYS=scripted('slow', timeout=0.01))
+    def test_timeout_is_retried(self):
+        self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.last_error), ('Pending', 'Gateway timed out.'))
+
+    def test_unknown_provider_fails(self):
+        Payment.objects.using(self.payment._state.db).filter(pk=self.payment.pk).update(provider='nope')
+        self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, 'Failed')
+        self.assertIn('nope', self.payment.last_error)
+
+    def test_charge_is_not_repeated_when_settling_failed(self):
+        with mock.patch('core.payments.settle', side_effect=RuntimeError('database went away')), \
+                self.assertLogs('core.payments', 'ERROR'):
+            self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.payment_status, self.payment.gateway_reference),
+                         ('Processing', f'ref-{self.payment.pk}'))
+
+        # Reclaimed once the claim has gone stale.
+        stale = timezone.now() - timedelta(seconds=settings.PAYMENT_CLAIM_TIMEOUT + 1)
+        Payment.objects.using(self.payment._state.db).filter(pk=self.payment.pk).update(claimed_at=stale)
+        self.run_worker()
+
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payment_status, 'Completed')
+        self.assertEqual(len(self.gateway().calls), 1)
+
+    def test_claim_skips_claimed_payments_until_they_go_stale(self):
+        alias = self.payment._state.db
+        self.assertEqual([payment.pk for payment in payments.claim_payments(10, alias)], [self.payment.pk])
+        self.assertEqual(payments.claim_payments(10, alias), [])
+
+        stale = timezone.now() - timedelta(seconds=settings.PAYMENT_CLAIM_TIMEOUT + 1)
+        Payment.objects.using(alias).filter(pk=self.payment.pk).update(claimed_at=stale)
+        self.assertEqual([payment.pk for payment in payments.claim_payments(10, alias)], [self.payment.pk])
+
+
+class ImportProductsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def write_jsonl(self, rows):
+        return self.write('products.jsonl', ''.join(json.dumps(row) + '\n' for row in rows))
+
+    def run_import(self, path, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', path, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_import_creates_products_and_categories(self):
+        path = self.write('products.csv', (
+            'sku,name,category,description,price,quantity\n'
+            'BK-1,Dune,Books,Spice,20,5\n'
+            'CD-1,Blue,Music,,9.5,\n'
+        ))
+
+        self.run_import(path)
+
+        dune, blue = Product.objects.order_by('sku')
+        self.assertEqual((dune.name, dune.category.name, dune.price, dune.quantity),
+                         ('Dune', 'Books', Decimal('20.00'), 5))
+        self.assertEqual((blue.category.name, blue.quantity, blue.description),
+                         ('Music', 1, Product._meta.get_field('description').default))
+
+    def test_reimport_upserts_by_sku_and_the_last_row_wins(self):
+        self.run_import(self.write_jsonl([
+            {'sku': 'BK-1', 'name': 'Dune', 'category': 'Books', 'price': '20', 'quantity': 5},
+        ]))
+        self.run_import(self.write_jsonl([
+            {'sku': 'BK-1', 'name': 'Dune (2nd ed.)', 'category': 'Books', 'price': '22', 'quantity': 7},
+            {'sku': 'BK-1', 'name': 'Dune (3rd ed.)', 'category': 'Books', 'price': '25', 'quantity': 9},
+        ]))
+
+        product = Product.objects.get()
+        self.assertEqual((product.name, product.price, product.quantity), ('Dune (3rd ed.)', Decimal('25.00'), 9))
+
+    def test_repeated_skus_in_a_batch_are_counted_as_superseded(self):
+        path = self.write_jsonl([
+            {'sku': 'BK-1', 'name': 'Dune', 'category': 'Books', 'price': '20'},
+            {'sku': 'BK-2', 'name': 'Emma', 'category': 'Books', 'price': '10'},
+            {'sku': 'BK-1', 'name': 'Dune (2nd ed.)', 'category': 'Books', 'price': '22'},
+            {'sku': 'BK-1', 'name': 'Dune (3rd ed.)', 'category': 'Books', 'price': '25'},
+            {'sku': 'BK-3', 'name': 'Ulysses', 'category': 'Books', 'price': 'free'},
+        ])
+
+        stdout, _ = self.run_import(path, '--verbosity', '2')
+
+        self.assertEqual(sorted(Product.objects.values_list('sku', 'name')),
+                         [('BK-1', 'Dune (3rd ed.)'), ('BK-2', 'Emma')])
+        self.assertIn('Line 1: superseded by line 3.', stdout)
+        self.assertIn('Line 3: superseded by line 4.', stdout)
+        self.assertIn('Read 5 rows, loaded 2, superseded 2, rejected 1', stdout)
+
+    def test_invalid_rows_are_rejected_one_by_one(self):
+        rejects = os.path.join(self.directory, 'rejects.jsonl')
+        path = self.write('products.jsonl', '\n'.join([
+            json.dumps({'sku': 'OK-1', 'name': 'Fine', 'category': 'Misc', 'price': '1', 'quantity': 3}),
+            json.dumps({'sku': 'Q-1', 'name': 'Half', 'category': 'Misc', 'price': '1', 'quantity': 2.5}),
+            json.dumps({'sku': 'Q-2', 'name': 'Huge', 'category': 'Misc', 'price': '1', 'quantity': 2 ** 31}),
+            json.dumps({'sku': 'Q-3', 'name': 'Negative', 'category': 'Misc', 'price': '1', 'quantity': -1}),
+            json.dumps({'sku': 'P-1', 'name': 'Pricey', 'category': 'Misc', 'price': 'lots'}),
+            json.dumps({'sku': 'N-1', 'category': 'Misc', 'price': '1'}),
+            json.dumps({'sku': 'W-1', 'name': 'Whole', 'category': 'Misc', 'price': '1', 'quantity': 4.0}),
+            '{not json',
+        ]) + '\n')
+
+        stdout, _ = self.run_import(path, '--rejects', rejects)
+
+        self.assertEqual(sorted(Product.objects.values_list('sku', 'quantity')), [('OK-1', 3), ('W-1', 4)])
+        with open(rejects, encoding='utf-8') as handle:
+            rejected = {entry['line']: entry['errors'] for entry in map(json.loads, handle)}
+        self.assertEqual(rejected, {
+            2: ['quantity is not an integer.'],
+            3: ['quantity is out of range.'],
+            4: ['quantity is out of range.'],
+            5: ['price is not a number.'],
+            6: ['name is required.'],
+            8: [rejected[8][0]],
+        })
+        self.assertTrue(rejected[8][0].startswith('Invalid JSON'))
+        self.assertIn('loaded 2, superseded 0, rejected 6', stdout)
+
+    def test_insert_only_reports_duplicate_skus_per_row(self):
+        category = Category.objects.create(name='Books')
+        Product.objects.create(category=category, sku='BK-1', name='Dune', price=Decimal('20.00'))
+        path = self.write_jsonl([
+            {'sku': 'BK-1', 'name': 'Dune again', 'category': 'Books', 'price': '20'},
+            {'sku': 'BK-2', 'name': 'Emma', 'category': 'Books', 'price': '10'},
+            {'sku': 'BK-2', 'name': 'Emma again', 'category': 'Books', 'price': '10'},
+            {'name': 'No sku', 'category': 'Books', 'price': '5'},
+        ])
+
+        stdout, stderr = self.run_import(path, '--insert-only', '--batch-size', '2')
+
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)), ['Dune', 'Emma', 'No sku'])
+        self.assertIn('Line 1: sku already exists.', stderr)
+        self.assertIn('Line 3: sku already exists.', stderr)
+        self.assertIn('loaded 2, superseded 0, rejected 2', stdout)
+
+    def test_missing_file_is_a_command_error(self):
+        with self.assertRaises(CommandError):
+            self.run_import(os.path.join(self.directory, 'missing.csv'))
+
+
+class SalesRollupTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('rollup@example.com', 'pw')
+        self.books = Category.objects.create(name='Books')
+        self.music = Category.objects.create(name='Music')
+        self.dune = Product.objects.create(category=self.books, name='Dune', price=Decimal('20.00'), quantity=50)
+        self.emma = Product.objects.create(category=self.books, name='Emma', price=Decimal('10.00'), quantity=50)
+        self.blue = Product.objects.create(category=self.music, name='Blue', price=Decimal('5.00'), quantity=50)
+
+    def place(self, *lines):
+        """An order of (product, quantity) lines, added to the rollups as checkout does."""
+        order = create_order(self.user, lines[0][0], lines[0][1])
+        for product, quantity in lines[1:]:
+            OrderItem.objects.using(order._state.db).create(
+                order=order, product=product, quantity=quantity, price=product.price * quantity)
+        rollups.apply_order(order)
+        return order
+
+    def totals(self):
+        return (
+            list(DailySales.objects.values_list('orders', 'units', 'revenue')),
+            dict(DailyProductSales.objects.values_list('product_id', 'units')),
+            {row[0]: row[1:] for row in DailyCategorySales.objects.values_list(
+                'category_id', 'orders', 'units', 'revenue')},
+        )
+
+    def test_orders_on_the_same_day_are_added_up(self):
+        self.place((self.dune, 1))
+        self.place((self.dune, 2), (self.blue, 1))
+
+        days, products, categories = self.totals()
+        self.assertEqual(days, [(2, 4, Decimal('65.00'))])
+        self.assertEqual(products, {self.dune.id: 3, self.blue.id: 1})
+        self.assertEqual(categories, {self.books.id: (2, 3, Decimal('60.00')), self.music.id: (1, 1, Decimal('5.00'))})
+        self.assertEqual(DailyProductSales.objects.get(product=self.dune).orders, 2)
+
+    def test_an_order_spanning_products_of_a_category_counts_once(self):
+        self.place((self.dune, 1), (self.emma, 1), (self.blue, 1))
+
+        days, _, categories = self.totals()
+        self.assertEqual(days, [(1, 3, Decimal('35.00'))])
+        self.assertEqual(categories[self.books.id], (1, 2, Decimal('30.00')))
+
+    def test_cancelling_and_reinstating_an_order_moves_it_out_and_back(self):
+        self.place((self.dune, 1))
+        order = self.place((self.dune, 2), (self.blue, 1))
+
+        order.status = 'Cancelled'
+        order.save()
+        days, products, categories = self.totals()
+        self.assertEqual(days, [(1, 1, Decimal('20.00'))])
+        self.assertEqual(products, {self.dune.id: 1, self.blue.id: 0})
+        self.assertEqual(categories[self.music.id], (0, 0, Decimal('0.00')))
+
+        order.status = 'Pending'
+        order.save()
+        self.assertEqual(self.totals()[0], [(2, 4, Decimal('65.00'))])
+
+    def test_rebuild_matches_the_incremental_rollups(self):
+        self.place((self.dune, 1))
+        self.place((self.dune, 2), (self.emma, 1), (self.blue, 1))
+        cancelled = self.place((self.blue, 3))
+        cancelled.status = 'Cancelled'
+        cancelled.save()
+        incremental = self.totals()
+        DailySales.objects.update(orders=0, units=0, revenue=0)
+        DailyProductSales.objects.all().delete()
+
+        call_command('rebuild_sales_rollups', stdout=io.StringIO())
+
+        days, products, categories = self.totals()
+        self.assertEqual(days, incremental[0])
+        self.assertEqual({key: value for key, value in incremental[1].items() if value}, products)
+        self.assertEqual({key: value for key, value in incremental[2].items() if value[0]}, categories)
+
+
+class RecommendationTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('regular@example.com', 'pw')
+        category = Category.objects.create(name='Books')
+        self.a, self.b, self.c, self.d = [
+            Product.objects.create(category=category, name=name, price=Decimal('10.00'), quantity=50)
+            for name in 'ABCD'
+        ]
+
+    def order(self, *products):
+        order = create_order(self.user, products[0])
+        for product in products[1:]:
+            OrderItem.objects.using(order._state.db).create(order=order, product=product, price=product.price)
+        recommendations.record_order(order)
+        return order
+
+    def recommended(self, product):
+        return list(ProductRecommendation.objects.filter(product=product).values_list('recommended', 'score'))
+
+    def matrix(self):
+        return set(ProductCooccurrence.objects.values_list('product', 'other', 'count'))
+
+    def test_each_order_adds_its_pairs(self):
+        self.order(self.a, self.b)
+        self.order(self.a, self.b, self.c)
+        self.order(self.d)
+
+        self.assertEqual(self.recommended(self.a), [(self.b.id, 2), (self.c.id, 1)])
+        self.assertEqual(self.recommended(self.c), [(self.a.id, 1), (self.b.id, 1)])
+        self.assertEqual(self.recommended(self.d), [])
+
+    @override_settings(RECOMMENDATIONS_TOP_K=2)
+    def test_lists_keep_the_top_k_by_count_then_id(self):
+        self.order(self.a, self.b, self.c, self.d)
+        self.order(self.a, self.d)
+
+        self.assertEqual(self.recommended(self.a), [(self.d.id, 2), (self.b.id, 1)])
+        self.assertEqual(list(ProductRecommendation.objects.filter(product=self.a).values_list('rank', flat=True)),
+                         [1, 2])
+
+    def test_rebuild_counts_live_and_archived_orders(self):
+        self.order(self.a, self.b)
+        archived = self.order(self.a, self.c)
+        alias = archived._state.db
+        ArchivedOrder.objects.using(alias).create(
+            id=archived.id, user=self.user, status='Delivered', total_price=archived.total_price,
+            created_at=archived.created_at,
+            items_snapshot=[Order.snapshot_item(self.a, 1), Order.snapshot_item(self.c, 1)])
+        Order.objects.using(alias).filter(pk=archived.pk).delete()
+        matrix, lists = self.matrix(), self.recommended(self.a)
+        ProductCooccurrence.objects.all().delete()
+        ProductRecommendation.objects.all().delete()
+
+        call_command('rebuild_recommendations', chunk_size=1, stdout=io.StringIO())
+
+        self.assertEqual(self.matrix(), matrix)
+        self.assertEqual(self.recommended(self.a), lists)
+
+
+class OrderArchiveTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Books'), name='Dune', price=Decimal('20.00'), quantity=50)
+        self.user = User.objects.create_user('archive@example.com', 'pw')
+        self.other = User.objects.create_user('other@example.com', 'pw')
+        self.old = timezone.now() - timedelta(days=430)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def order(self, status, created_at, user=None, quantity=2):
+        order = create_order(user or self.user, self.product, quantity)
+        Order.objects.using(order._state.db).filter(pk=order.pk).update(
+            status=status, created_at=created_at, items_snapshot=[Order.snapshot_item(self.product, quantity)],
+            item_count=quantity)
+        return order
+
+    def archive(self, *args):
+        stdout = io.StringIO()
+        call_command('archive_orders', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def live_ids(self):
+        return {pk for alias in sharding.all_shards() for pk in Order.objects.using(alias).values_list('pk', flat=True)}
+
+    def archived(self):
+        return {order.id: order for alias in sharding.all_shards() for order in ArchivedOrder.objects.using(alias)}
+
+    def test_old_closed_orders_move_with_their_items_and_payment(self):
+        delivered, cancelled = self.order('Delivered', self.old), self.order('Cancelled', self.old)
+        others = self.order('Delivered', self.old, user=self.other)
+        pending, recent = self.order('Pending', self.old), self.order('Delivered', timezone.now())
+        Payment.objects.using(delivered._state.db).create(
+            order=delivered, payment_method='card', amount=delivered.total_price, payment_status='Completed')
+
+        self.assertIn('Archived 3 orders created before', self.archive('--batch-size', '1'))
+
+        archived = self.archived()
+        self.assertEqual(set(archived), {delivered.id, cancelled.id, others.id})
+        self.assertEqual(self.live_ids(), {pending.id, recent.id})
+        self.assertFalse(OrderItem.objects.using(delivered._state.db).filter(order_id=delivered.id).exists())
+        self.assertFalse(Payment.objects.using(delivered._state.db).exists())
+        row = archived[delivered.id]
+        self.assertEqual((row.user_id, row.status, row.total_price, row.item_count, row.payment_status),
+                         (self.user.id, 'Delivered', Decimal('40.00'), 2, 'Completed'))
+        self.assertEqual(row.items_snapshot, [
+            {'id': self.product.id, 'name': 'Dune', 'price': '20.00', 'quantity': 2, 'total': '40.00'}])
+        self.assertEqual((row.payment['method'], row.payment['amount'], row.payment['status']),
+                         ('card', '40.00', 'Completed'))
+        self.assertIsNone(archived[cancelled.id].payment)
+
+    def test_dry_run_only_counts(self):
+        self.order('Delivered', self.old)
+        self.order('Cancelled', self.old)
+        self.order('Delivered', self.old - timedelta(days=120))
+
+        self.assertIn('1 orders created before', self.archive('--dry-run', '--older-than-months', '15'))
+        self.assertIn('3 orders created before', self.archive('--dry-run'))
+        self.assertEqual(len(self.live_ids()), 3)
+        with self.assertRaises(CommandError):
+            self.archive('--older-than-months', '0')
+
+    def test_order_history_reads_the_live_and_archived_orders(self):
+        archived = self.order('Delivered', self.old)
+        live = self.order('Pending', timezone.now())
+        others = self.order('Delivered', self.old, user=self.other)
+        self.archive()
+
+        self.assertEqual([order['id'] for order in self.client.get('/api/store/order/').data], [live.id])
+        listed = self.client.get('/api/store/order/', {'include_archived': '1'}).data
+        self.assertEqual([order['id'] for order in listed], [live.id, archived.id])
+        self.assertEqual(listed[1]['items'][0]['total'], '40.00')
+        self.assertEqual(set(listed[0]), set(listed[1]))
+
+        response = self.client.get(f'/api/store/order/{archived.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['status'], response.data['item_count']), ('Delivered', 2))
+        self.assertEqual(self.client.get(f'/api/store/order/{live.id}/').data['status'], 'Pending')
+        self.assertEqual(self.client.get(f'/api/store/order/{others.id}/').status_code, 404)
+
+
+class IndexAdvisorTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('advised@example.com', 'pw')
+        self.order = create_order(self.user, Product.objects.create(
+            category=Category.objects.create(name='Books'), name='Dune', price=Decimal('10.00'), quantity=5))
+
+    def postgres_plan(self, plan):
+        """Stand in for a Postgres connection whose EXPLAIN returns `plan`."""
+        connection = mock.MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [(json.dumps([{'Plan': plan}]),)]
+        return mock.patch.object(explain, 'connections', {'default': connection}), cursor
+
+    def advise(self, *args):
+        stdout = io.StringIO()
+        call_command('index_advisor', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_postgres_scans_under_a_sort_suggest_a_partial_index(self):
+        patch, cursor = self.postgres_plan({
+            'Node Type': 'Limit', 'Plan Rows': 1, 'Plans': [{
+                'Node Type': 'Sort', 'Plan Rows': 3, 'Actual Rows': 3, 'Sort Key': ['core_order.created_at DESC'],
+                'Plans': [{
+                    'Node Type': 'Seq Scan', 'Relation Name': 'core_order', 'Plan Rows': 3, 'Actual Rows': 3,
+                    'Rows Removed by Filter': 997,
+                    'Filter': "((user_id = 5) AND ((status)::text = 'Pending'::text))",
+                }],
+            }],
+        })
+        with patch:
+            sort, scan = explain.explain('SELECT 1')
+
+        self.assertEqual(cursor.execute.call_args[0][0], 'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT 1')
+        self.assertEqual((sort.kind, sort.detail, sort.rows), ('sort', 'core_order.created_at DESC', 3))
+        self.assertEqual((scan.kind, scan.table, scan.rows), ('seq_scan', 'core_order', 1000))
+        self.assertEqual(scan.columns, ['user_id', 'created_at DESC'])
+        self.assertEqual(scan.suggestion, 'CREATE INDEX CONCURRENTLY core_order_user_id_created_at_idx ON core_order '
+                                          "(user_id, created_at DESC) WHERE status = 'Pending'")
+
+    def test_postgres_range_filters_follow_the_equality_columns(self):
+        patch, cursor = self.postgres_plan({
+            'Node Type': 'Seq Scan', 'Relation Name': 'core_product', 'Plan Rows': 40,
+            'Filter': "((price >= '10'::numeric) AND (price <= '100'::numeric) AND (category_id = 2))",
+        })
+        with patch:
+            [scan] = explain.explain('SELECT 1', analyze=False)
+
+        self.assertEqual(cursor.execute.call_args[0][0], 'EXPLAIN (FORMAT JSON) SELECT 1')
+        self.assertEqual(scan.rows, 40)
+        self.assertEqual(scan.suggestion, 'CREATE INDEX CONCURRENTLY core_product_category_id_price_idx '
+                                          'ON core_product (category_id, price)')
+
+    @skipUnless(connection.vendor == 'sqlite', 'Reads the sqlite query plan.')
+    def test_sqlite_plans_report_scans_and_sorts(self):
+        findings = explain.explain('SELECT * FROM core_product ORDER BY quantity')
+
+        self.assertEqual([(finding.kind, finding.table) for finding in findings],
+                         [('seq_scan', 'core_product'), ('sort', '')])
+        self.assertFalse(any(finding.suggestion for finding in findings))
+        self.assertEqual(explain.explain('SELECT * FROM core_product WHERE id = 1'), [])
+
+    def test_replayed_requests_are_rolled_back(self):
+        output = self.advise('--no-analyze')
+
+        self.assertIn('GET /api/store/order/', output)
+        self.assertIn('POST /api/store/payment/', output)
+        self.assertNotIn('responded', output)
+        self.assertIn('No missing indexes found.', output)
+        self.assertFalse(Payment.objects.using(self.order._state.db).exists())
+
+    def test_suggestions_are_counted_and_small_tables_skipped(self):
+        finding = explain.Finding('seq_scan', 'core_order', 'user_id = 5', suggestion='CREATE INDEX x ON core_order')
+        with mock.patch.object(explain, 'explain', return_value=[finding]):
+            self.assertIn('No missing indexes found.', self.advise())
+            output = self.advise('--min-rows', '0', '--user', self.user.email, '--endpoint', 'GET:/api/store/cart/')
+
+        self.assertIn('GET /api/store/cart/', output)
+        self.assertIn('  seq_scan: core_order user_id = 5\n    in: SELECT', output)
+        self.assertRegex(output, r'Suggested indexes\n  CREATE INDEX x ON core_order;  -- \d+ queries\n$')
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(CommandError):
+            self.advise('--user', 'nobody@example.com')
+        with self.assertRaises(CommandError):
+            self.advise('--endpoint', 'GET:api/store/cart/')
+
+
+class MaintenanceTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Books'), name='Dune', price=Decimal('10.00'), quantity=5)
+        self.user = User.objects.create_user('keeper@example.com', 'pw')
+        self.alias = sharding.shard_for_user(self.user.pk)
+        self.stale = timezone.now() - timedelta(days=400)
+
+    def cart(self, email, items=0, stale=True):
+        user = User.objects.create_user(email, 'pw')
+        with sharding.use_shard(sharding.shard_for_user(user.pk)):
+            cart = Cart.objects.create(user=user)
+            for _ in range(items):
+                CartItem.objects.create(cart=cart, product=self.product)
+        if stale:
+            Cart.objects.using(cart._state.db).filter(pk=cart.pk).update(updated_at=self.stale)
+        return cart
+
+    def age(self, model, *instances, field='created_at'):
+        model.objects.using(self.alias).filter(pk__in=[instance.pk for instance in instances]).update(
+            **{field: self.stale})
+
+    def address(self):
+        return ShippingAddress.objects.using(self.alias).create(
+            user=self.user, address='2 Side St', city='Batumi', postal_code='6000', country='GE', phone_number='5')
+
+    def run_everywhere(self, job, **options):
+        return sum(maintenance.run_job(job, alias, rows_per_second=0, **options).affected
+                   for alias in sharding.all_shards())
+
+    def test_abandoned_cart_items_empties_only_stale_carts(self):
+        stale, fresh = self.cart('stale@example.com', items=2), self.cart('fresh@example.com', items=1, stale=False)
+
+        self.assertEqual(self.run_everywhere(maintenance.AbandonedCartItems()), 2)
+        self.assertFalse(CartItem.objects.using(stale._state.db).filter(cart=stale).exists())
+        self.assertTrue(CartItem.objects.using(fresh._state.db).filter(cart=fresh).exists())
+
+    def test_empty_carts_keeps_carts_with_items_or_orders(self):
+        empty = self.cart('empty@example.com')
+        self.cart('full@example.com', items=1)
+        self.cart('fresh@example.com', stale=False)
+        ordered = create_order(self.user, self.product).cart
+        self.age(Cart, ordered, field='updated_at')
+
+        self.assertEqual(self.run_everywhere(maintenance.EmptyCarts()), 1)
+        self.assertEqual(Cart.objects.using(empty._state.db).filter(pk=empty.pk).count(), 0)
+        self.assertEqual(sum(Cart.objects.using(alias).count() for alias in sharding.all_shards()), 3)
+
+    def test_expire_pending_orders_cancels_unpaid_orders_and_restocks(self):
+        unpaid = create_order(self.user, self.product, quantity=2)
+        paying = create_order(self.user, self.product)
+        Payment.objects.using(self.alias).create(order=paying, payment_method='card', amount=paying.total_price)
+        shipped = create_order(self.user, self.product)
+        Order.objects.using(self.alias).filter(pk=shipped.pk).update(status='Shipped')
+        fresh = create_order(self.user, self.product)
+        self.age(Order, unpaid, paying, shipped)
+
+        with self.captureOnCommitCallbacks(using=self.alias, execute=True):
+            self.assertEqual(self.run_everywhere(maintenance.ExpirePendingOrders()), 1)
+
+        statuses = dict(Order.objects.using(self.alias).values_list('pk', 'status'))
+        self.assertEqual(statuses, {unpaid.pk: 'Cancelled', paying.pk: 'Pending', shipped.pk: 'Shipped',
+                                    fresh.pk: 'Pending'})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 7)
+
+    def test_unused_addresses_keeps_addresses_of_live_and_archived_orders(self):
+        unused, archived, fresh = self.address(), self.address(), self.address()
+        shipped_to = create_order(self.user, self.product).shipping_address
+        ArchivedOrder.objects.using(self.alias).create(
+            id=10 ** 9, user=self.user, status='Delivered', total_price=10, shipping_address_id=archived.pk,
+            created_at=self.stale)
+        self.age(ShippingAddress, unused, archived, shipped_to)
+
+        self.assertEqual(self.run_everywhere(maintenance.UnusedAddresses()), 1)
+        self.assertEqual(set(ShippingAddress.objects.using(self.alias).values_list('pk', flat=True)),
+                         {archived.pk, fresh.pk, shipped_to.pk})
+
+    def test_rows_taken_by_live_traffic_are_skipped(self):
+        cart = self.cart('busy@example.com', items=3)
+        items = list(CartItem.objects.using(cart._state.db).filter(cart=cart).order_by('pk'))
+        calls = []
+
+        def checkout_second_item(using):
+            # Stands in for SKIP LOCKED: the row is gone by the time the batch locks it.
+            calls.append(using)
+            if len(calls) == 2:
+                CartItem.objects.using(using).filter(pk=items[1].pk).delete()
+
+        with mock.patch.object(maintenance, '_set_lock_timeout', side_effect=checkout_second_item):
+            stats = maintenance.run_job(maintenance.AbandonedCartItems(), cart._state.db, batch_size=1,
+                                        rows_per_second=0)
+
+        self.assertEqual((stats.batches, stats.scanned, stats.affected, stats.skipped), (3, 3, 2, 1))
+        self.assertFalse(CartItem.objects.using(cart._state.db).exists())
+
+    def test_a_lock_timeout_gives_up_the_batch(self):
+        cart = self.cart('locked@example.com', items=2)
+
+        with mock.patch.object(maintenance, '_set_lock_timeout', side_effect=OperationalError('lock timeout')), \
+                mock.patch.object(maintenance, 'LOCK_TIMEOUT_BACKOFF', 0), \
+                self.assertLogs('core.maintenance', 'WARNING'):
+            stats = maintenance.run_job(maintenance.AbandonedCartItems(), cart._state.db, batch_size=1,
+                                        rows_per_second=0)
+
+        self.assertEqual((stats.batches, stats.affected, stats.skipped, stats.lock_timeouts), (2, 0, 2, 2))
+        self.assertEqual(CartItem.objects.using(cart._state.db).count(), 2)
+
+    def test_dry_run_only_counts(self):
+        cart = self.cart('dry@example.com', items=2)
+
+        self.assertEqual(self.run_everywhere(maintenance.AbandonedCartItems(), dry_run=True), 2)
+        self.assertEqual(CartItem.objects.using(cart._state.db).count(), 2)
+
+    def test_rate_limiter_sleeps_off_rows_over_the_rate(self):
+        with mock.patch.object(maintenance, 'time') as clock:
+            clock.monotonic.return_value = 100.0
+            limiter = maintenance.RateLimiter(10)
+            limiter.wait(5)
+            clock.sleep.assert_called_once_with(0.5)
+
+            clock.sleep.reset_mock()
+            clock.monotonic.return_value = 102.0
+            limiter.wait(5)
+            clock.sleep.assert_not_called()
+
+            maintenance.RateLimiter(0).wait(1000)
+            clock.sleep.assert_not_called()
+
+    @override_settings(MAINTENANCE_JOBS={'empty_carts': {'interval': 60}})
+    def test_jobs_fall_back_to_their_defaults(self):
+        [empty_carts] = maintenance.get_jobs()
+        self.assertEqual((empty_carts.max_age, empty_carts.interval), (timedelta(days=7), 60))
+
+        [addresses] = maintenance.get_jobs(['unused_addresses'])
+        self.assertEqual((addresses.max_age, addresses.interval), (timedelta(days=365), 86400))
+
+    def test_unknown_jobs_in_the_setting_are_rejected(self):
+        for jobs in ({'old_carts': {}}, {'empty_carts': {'maxage': timedelta(days=1)}}):
+            with override_settings(MAINTENANCE_JOBS=jobs), self.assertRaises(CommandError):
+                call_command('run_maintenance', stdout=io.StringIO())
+
+
+@override_settings(TRACING_ENABLED=True, TRACING_SAMPLE_RATE=0, TRACING_MAX_PER_SECOND=100)
+class TracingTests(TestCase):
+    url = '/api/store/products/'
+
+    def setUp(self):
+        # Instrumentation is only installed at startup when TRACING_ENABLED is set.
+        tracing.install()
+        tracing.recent.clear()
+        self.enterContext(mock.patch.object(tracing, 'sampler', tracing._Sampler()))
+        Product.objects.create(
+            category=Category.objects.create(name='Books'), name='Dune', price=Decimal('20.00'), quantity=5)
+        self.staff = APIClient()
+        self.staff.force_authenticate(User.objects.create_superuser('staff@example.com', 'pw'))
+
+    def test_unsampled_requests_are_untouched(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('X-Trace-Id', response)
+        self.assertEqual(len(tracing.recent), 0)
+
+    @override_settings(TRACING_ENABLED=False)
+    def test_disabled_tracing_ignores_the_header(self):
+        self.assertNotIn('Server-Timing', self.client.get(self.url, headers={'X-Trace': '1'}))
+
+    def test_forced_request_reports_its_spans(self):
+        response = self.client.get(self.url, headers={'X-Trace': '1'})
+
+        [trace] = tracing.recent
+        self.assertEqual(response['X-Trace-Id'], trace.id)
+        timing = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertTrue({'middleware', 'view', 'sql', 'queryset', 'serialize', 'total'} <= timing.keys())
+        self.assertEqual((trace.view, trace.status), ('store:product-list', 200))
+        self.assertTrue(any(span['category'] == 'sql' for span in trace.as_dict()['spans']))
+
+    @override_settings(TRACING_SAMPLE_RATE=1)
+    def test_sampled_requests_are_traced_without_the_header(self):
+        self.assertIn('Server-Timing', self.client.get(self.url))
+
+    @override_settings(TRACING_MAX_PER_SECOND=2)
+    def test_traces_per_second_are_capped(self):
+        request = RequestFactory().get(self.url, headers={'X-Trace': '1'})
+        sampler = tracing._Sampler()
+        with mock.patch.object(tracing, 'time') as clock:
+            clock.monotonic.return_value = 1000.0
+            self.assertEqual([sampler.should_sample(request) for _ in range(3)], [True, True, False])
+            clock.monotonic.return_value = 1000.5
+            self.assertEqual([sampler.should_sample(request) for _ in range(2)], [True, False])
+
+    def test_traces_endpoint_is_staff_only_and_filters(self):
+        self.client.get(self.url, headers={'X-Trace': '1'})
+
+        self.assertEqual(self.staff.get('/api/store/debug/traces/').data[0]['path'], self.url)
+        self.assertEqual(self.staff.get('/api/store/debug/traces/', {'min_ms': 10 ** 6}).data, [])
+        shopper = APIClient()
+        shopper.force_authenticate(User.objects.create_user('shopper@example.com', 'pw'))
+        self.assertEqual(shopper.get('/api/store/debug/traces/').status_code, 403)
+        self.assertEqual(shopper.post('/api/store/debug/profile/').status_code, 403)
+
+    def test_profile_runs_in_the_background_and_returns_collapsed_stacks(self):
+        response = self.staff.post('/api/store/debug/profile/?seconds=0.2&interval_ms=5')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(self.staff.post('/api/store/debug/profile/').status_code, 409)
+        url = f"/api/store/debug/profile/{response.data['id']}/"
+
+        deadline = time.monotonic() + 5
+        while (response := self.staff.get(url)).status_code == 202 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(int(response['X-Profile-Samples']), 0)
+        self.assertEqual(self.staff.get('/api/store/debug/profile/unknown/').status_code, 404)
+
+    def test_profile_paths_are_relative_to_the_current_sys_path(self):
+        code = compile('pass', '/srv/app/shop/views.py', 'exec')
+        with mock.patch.object(sys, 'path', ['/srv/app']):
+            self.assertEqual(profiler._FrameLabels()[code], '<module> (shop/views.py:1)')
+        with mock.patch.object(sys, 'path', ['/srv']):
+            self.assertEqual(profiler._FrameLabels()[code], '<module> (app/shop/views.py:1)')
+
+
+class SchemaDocumentTests(TestCase):
+    url = '/docs/openapi.json'
+    body = b'{"openapi": "stub"}'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(OPENAPI_SCHEMA_DIR=self.directory))
+        self.build = self.enterContext(
+            mock.patch.object(openapi, 'build', return_value={'json': self.body, 'yaml': b'openapi: stub\n'}))
+        openapi._documents.clear()
+        self.addCleanup(openapi._documents.clear)
+
+    def test_matching_etags_get_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, response.content), (200, self.body))
+        etag = response['ETag']
+
+        for if_none_match in (etag, f'"stale", {etag}', f'W/{etag}', '*'):
+            response = self.client.get(self.url, headers={'If-None-Match': if_none_match})
+            self.assertEqual(response.status_code, 304, if_none_match)
+            self.assertEqual(response['ETag'], etag)
+        for if_none_match in ('"stale"', etag[1:-1], f'"x{etag[1:]}'):
+            self.assertEqual(self.client.get(self.url, headers={'If-None-Match': if_none_match}).status_code, 200)
+
+    def test_gzip_is_served_when_accepted(self):
+        response = self.client.get(self.url, headers={'Accept-Encoding': 'gzip, br'})
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_artifacts_are_written_once_and_reused(self):
+        self.client.get(self.url)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
+        openapi._documents.clear()
+
+        self.assertEqual(self.client.get('/docs/openapi.yaml').content, b'openapi: stub\n')
+        self.assertEqual(self.build.call_count, 1)
+
+    def test_read_only_schema_dir_serves_from_memory(self):
+        with mock.patch.object(openapi, '_write', side_effect=PermissionError('read-only')), \
+                self.assertLogs('core.openapi', 'WARNING'):
+            response = self.client.get(self.url)
+
+        self.assertEqual((response.status_code, response.content), (200, self.body))
+        self.assertEqual(self.client.get('/docs/openapi.yaml').status_code, 200)
+        self.assertEqual(self.build.call_count, 1)
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.media_root = directory.name
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root))
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Books'), name='Dune', price=Decimal('20.00'),
+            image=SimpleUploadedFile('Dune.PNG', b'dune cover'))
+        self.name = self.product.image.name
+
+    def legacy(self, name, content=b'legacy'):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        return path
+
+    def test_content_addressed_files_are_immutable(self):
+        response = self.client.get(f'/media/{self.name}')
+
+        self.assertEqual(b''.join(response.streaming_content), b'dune cover')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(f'/media/{self.name}', headers={'If-None-Match': response['ETag']})
+                         .status_code, 304)
+
+    @override_settings(MEDIA_SERVE_MODE='x-accel-redirect')
+    def test_accel_redirect_is_built_from_the_validated_name_only(self):
+        self.assertRegex(self.name, r'^product_images/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        response = self.client.get(f'/media/product_images/../{self.name}')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+
+        self.legacy('product_images/ab/photo.png', b'old photo')
+        response = self.client.get('/media/product_images/ab/photo.png')
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), b'old photo')
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get('/media/../secrets.txt')
+        self.assertIn(response.status_code, (400, 404))
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_gc_media_keeps_referenced_and_recent_blobs(self):
+        orphan = default_storage.save('product_images/old.png', ContentFile(b'old orphan'))
+        recent = default_storage.save('product_images/new.png', ContentFile(b'new orphan'))
+        two_days_ago = time.time() - 2 * 86400
+        os.utime(default_storage.path(orphan), (two_days_ago, two_days_ago))
+        os.utime(default_storage.path(self.name), (two_days_ago, two_days_ago))
+        self.legacy('product_images/legacy.png')
+
+        stdout = io.StringIO()
+        call_command('gc_media', stdout=stdout)
+
+        self.assertIn('Deleted 1 orphaned file(s)', stdout.getvalue())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(self.name))
+        self.assertTrue(default_storage.exists(recent))
+        self.assertTrue(default_storage.exists('product_images/legacy.png'))
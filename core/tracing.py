@@ -0,0 +1,332 @@
+"""
+Request tracing for production workers, enabled with TRACING_ENABLED=1.
+
+A small fraction of requests (TRACING_SAMPLE_RATE, plus requests sent with
+`X-Trace: 1`, all capped at TRACING_MAX_PER_SECOND per process) get a
+Trace that records timed spans for:
+
+- middleware: the request time outside the view;
+- auth, permissions and filter: DRF authentication (JWT decoding), the
+  permission checks and filter backends such as ProductFilter;
+- queryset and sql: QuerySet evaluation and every statement executed, on
+  every database alias;
+- serialize and render: serializer `.data` (nested serializers and
+  SerializerMethodFields such as OrderSerializer.get_items included) and
+  rendering of DRF responses.
+
+Instrumented functions check a context variable and return straight away
+on requests that are not sampled, so tracing can stay enabled. A sampled
+response carries a Server-Timing header with per-category totals (shown
+by browser dev tools) and an X-Trace-Id. The trace is logged, at WARNING
+when slower than TRACING_SLOW_REQUEST_MS, and kept in a per-process
+buffer of recent traces for the staff traces endpoint.
+"""
+import functools
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ['middleware', 'auth', 'permissions', 'filter', 'queryset', 'sql', 'serialize', 'render', 'view']
+MAX_SPANS = 500
+MAX_SPAN_NAME = 200
+RECENT_TRACES = 200
+
+_current = ContextVar('trace', default=None)
+_ids = itertools.count(1)
+_installed = False
+recent = deque(maxlen=RECENT_TRACES)
+
+
+class Trace:
+    def __init__(self, method, path):
+        self.id = f'{os.getpid()}-{next(_ids)}'
+        self.method = method
+        self.path = path
+        self.view = None
+        self.status = None
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = None
+        self.depth = 0
+        self.spans = []
+        self.dropped = 0
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def span(self, category, name):
+        return _Span(self, category, name)
+
+    def sql(self, execute, sql, params, many, context):
+        with self.span('sql', sql):
+            return execute(sql, params, many, context)
+
+    def finish(self, request, response):
+        self.duration = time.perf_counter() - self.started
+        self.status = response.status_code
+        match = getattr(request, 'resolver_match', None)
+        self.view = match.view_name if match else None
+        self.totals['middleware'] = max(0.0, self.duration - self.totals.get('view', 0.0))
+        self.counts['middleware'] = 1
+
+    def server_timing(self):
+        metrics = [
+            f'{category};dur={self.totals[category] * 1000:.1f};desc="{self.counts[category]}"'
+            for category in CATEGORIES if category in self.totals
+        ]
+        return ', '.join(metrics + [f'total;dur={self.duration * 1000:.1f}'])
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'view': self.view,
+            'status': self.status,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 3),
+            'totals_ms': {category: round(value * 1000, 3) for category, value in self.totals.items()},
+            'counts': dict(self.counts),
+            'spans': [
+                {'category': category, 'name': name, 'depth': depth,
+                 'start_ms': round(start * 1000, 3), 'duration_ms': round(duration * 1000, 3)}
+                for category, name, depth, start, duration in sorted(self.spans, key=lambda span: span[3])
+            ],
+            'dropped_spans': self.dropped,
+        }
+
+
+class _Span:
+    __slots__ = ('trace', 'category', 'name', 'depth', 'start')
+
+    def __init__(self, trace, category, name):
+        self.trace = trace
+        self.category = category
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.trace.depth
+        self.trace.depth += 1
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        trace = self.trace
+        trace.depth -= 1
+        duration = end - self.start
+        trace.totals[self.category] += duration
+        trace.counts[self.category] += 1
+        if len(trace.spans) < MAX_SPANS:
+            trace.spans.append(
+                (self.category, str(self.name)[:MAX_SPAN_NAME], self.depth, self.start - trace.started, duration))
+        else:
+            trace.dropped += 1
+
+
+def current():
+    return _current.get()
+
+
+def traced(category, name=None):
+    """
+    Record calls of the decorated function as `category` spans on sampled
+    requests. `name` is a string or a callable taking the call's arguments.
+    """
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with trace.span(category, label(*args, **kwargs) if callable(label) else label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _Sampler:
+    """Sampling decision with a per-process cap on traces per second."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # None until the first request, which starts with a full second's
+        # allowance rather than having to wait for one to accrue.
+        self.allowance = None
+        self.checked = time.monotonic()
+
+    def should_sample(self, request):
+        forced = request.headers.get('X-Trace') == '1'
+        if not forced and random.random() >= settings.TRACING_SAMPLE_RATE:
+            return False
+        rate = settings.TRACING_MAX_PER_SECOND
+        with self.lock:
+            now = time.monotonic()
+            accrued = rate if self.allowance is None else self.allowance + (now - self.checked) * rate
+            self.allowance = min(rate, accrued)
+            self.checked = now
+            if self.allowance < 1:
+                return False
+            self.allowance -= 1
+        return True
+
+
+sampler = _Sampler()
+
+
+class TraceMiddleware:
+    """Start a Trace for sampled requests; must be first in MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace = self.start(request)
+        if trace is None:
+            return self.get_response(request)
+        token = _current.set(trace)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(trace, request, response)
+
+    async def __acall__(self, request):
+        trace = self.start(request)
+        if trace is None:
+            return await self.get_response(request)
+        token = _current.set(trace)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(trace, request, response)
+
+    @staticmethod
+    def start(request):
+        if not settings.TRACING_ENABLED or not sampler.should_sample(request):
+            return None
+        return Trace(request.method, request.path)
+
+    @staticmethod
+    def finish(trace, request, response):
+        trace.finish(request, response)
+        recent.append(trace)
+        server_timing = trace.server_timing()
+        response['Server-Timing'] = server_timing
+        response['X-Trace-Id'] = trace.id
+        slow = trace.duration * 1000 >= settings.TRACING_SLOW_REQUEST_MS
+        logger.log(
+            logging.WARNING if slow else logging.INFO, 'trace %s %s %s %s %.1fms %s',
+            trace.id, trace.method, trace.path, trace.status, trace.duration * 1000, server_timing,
+        )
+        return response
+
+
+class TraceViewMiddleware:
+    """Time the view itself; must be last in MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace = _current.get()
+        if trace is None:
+            return self.get_response(request)
+        with trace.span('view', request.path):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        trace = _current.get()
+        if trace is None:
+            return await self.get_response(request)
+        with trace.span('view', request.path):
+            return await self.get_response(request)
+
+
+def _sql(execute, sql, params, many, context):
+    # Installed on every connection, so queries run from sync_to_async
+    # threads and on any alias still find the request's trace through the
+    # context variable.
+    trace = _current.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    return trace.sql(execute, sql, params, many, context)
+
+
+def _add_sql_wrapper(connection, **kwargs):
+    if _sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_sql)
+
+
+def _wrap_property(cls, attribute, category, name=None):
+    prop = getattr(cls, attribute)
+    setattr(cls, attribute, property(traced(category, name)(prop.fget), prop.fset, prop.fdel, prop.__doc__))
+
+
+def _queryset_name(queryset):
+    return queryset.model._meta.label
+
+
+def install():
+    """Instrument Django and DRF; called once from CoreConfig.ready."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    from django.db.backends.signals import connection_created
+    from django.db.models.query import QuerySet
+
+    connection_created.connect(_add_sql_wrapper)
+    for connection in connections.all(initialized_only=True):
+        _add_sql_wrapper(connection)
+    from rest_framework import generics, response, serializers, views
+
+    original_fetch_all = QuerySet._fetch_all
+    traced_fetch_all = traced('queryset', _queryset_name)(original_fetch_all)
+
+    @functools.wraps(original_fetch_all)
+    def _fetch_all(self):
+        # Only the evaluation that actually runs the query is worth a span.
+        if self._result_cache is None:
+            return traced_fetch_all(self)
+        return original_fetch_all(self)
+
+    QuerySet._fetch_all = _fetch_all
+
+    views.APIView.perform_authentication = traced('auth')(views.APIView.perform_authentication)
+    views.APIView.check_permissions = traced('permissions')(views.APIView.check_permissions)
+    views.APIView.check_object_permissions = traced('permissions')(views.APIView.check_object_permissions)
+    generics.GenericAPIView.filter_queryset = traced(
+        'filter', lambda view, queryset: f'{type(view).__name__}.filter_queryset')(
+        generics.GenericAPIView.filter_queryset)
+    for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+        _wrap_property(serializer_class, 'data', 'serialize', lambda serializer: type(serializer).__name__
+                       if not isinstance(serializer, serializers.ListSerializer)
+                       else f'{type(serializer.child).__name__}(many=True)')
+    _wrap_property(response.Response, 'rendered_content', 'render',
+                   lambda rendered: type(getattr(rendered, 'accepted_renderer', None)).__name__)
@@ -0,0 +1,109 @@
+"""
+Views for serving uploaded media and the prebuilt API schema.
+"""
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.encoding import filepath_to_uri
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+from core import openapi
+from core.storage import digest_from_name
+
+
+def _media_response(name, full_path):
+    """
+    Hand a content-addressed file to the web server when MEDIA_SERVE_MODE
+    asks for it; `name` is None for files without a validated digest, which
+    are always streamed by Django.
+    """
+    mode = settings.MEDIA_SERVE_MODE
+    if name and mode == 'x-accel-redirect':
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + filepath_to_uri(name)
+        # Let nginx pick the content type from the file it serves.
+        del response['Content-Type']
+        return response
+    if name and mode == 'x-sendfile':
+        response = HttpResponse()
+        response['X-Sendfile'] = full_path
+        del response['Content-Type']
+        return response
+    # FileResponse hands the file object to wsgi.file_wrapper, so servers
+    # that support it send the file with sendfile() instead of copying it.
+    return FileResponse(open(full_path, 'rb'))
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file from MEDIA_ROOT.
+
+    Content-addressed files never change, so they are served with a
+    far-future immutable Cache-Control and their digest as the ETag.
+    """
+    full_path = safe_join(settings.MEDIA_ROOT, path)
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Media file not found.')
+    if os.path.isdir(full_path):
+        raise Http404('Media file not found.')
+
+    # The normalized name below MEDIA_ROOT, not the raw URL path, is what
+    # the digest is read from and what the web server is pointed at.
+    name = Path(os.path.relpath(full_path, os.path.abspath(settings.MEDIA_ROOT))).as_posix()
+    digest = digest_from_name(name)
+    etag = f'"{digest}"' if digest else None
+
+    response = get_conditional_response(request, etag=etag) if etag else None
+    if response is None:
+        response = _media_response(name if digest else None, full_path)
+
+    if etag:
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, immutable=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    else:
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_LEGACY_CACHE_MAX_AGE)
+    return response
+
+
+@require_safe
+def schema_document(request, fmt):
+    """
+    Serve the OpenAPI schema from its prebuilt artifact (core.openapi), with
+    its fingerprint as the ETag and gzip when the client accepts it.
+    """
+    document = openapi.get_document(fmt)
+    not_modified = get_conditional_response(request, etag=document.etag)
+    if not_modified is not None:
+        response = not_modified
+    elif 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = HttpResponse(document.compressed, content_type=document.content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(document.body, content_type=document.content_type)
+    response['ETag'] = document.etag
+    patch_vary_headers(response, ['Accept-Encoding'])
+    patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_CACHE_MAX_AGE)
+    return response
+
+
+def prebuilt_schema(ui_view):
+    """
+    Wrap a drf-yasg UI view so that its ?format=openapi (json, yaml) spec
+    requests are answered from the prebuilt schema instead of regenerating it.
+    """
+    def view(request, *args, **kwargs):
+        fmt = {'openapi': 'json', 'json': 'json', 'yaml': 'yaml'}.get(request.GET.get('format'))
+        if fmt:
+            return schema_document(request, fmt)
+        return ui_view(request, *args, **kwargs)
+
+    return view
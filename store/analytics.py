@@ -0,0 +1,65 @@
+"""
+Sales analytics read exclusively from the daily rollup tables.
+"""
+from datetime import timedelta
+
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+
+from core.models import DailyCategorySales, DailyProductSales, DailySales
+
+GROUPINGS = ('day', 'category', 'day_category', 'product')
+TOTALS = dict(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+
+
+def _parse(params, name, default):
+    value = params.get(name)
+    if not value:
+        return default
+    parsed = parse_date(value)
+    if parsed is None:
+        raise serializers.ValidationError({name: "Use the YYYY-MM-DD format."})
+    return parsed
+
+
+def sales_report(params):
+    today = timezone.now().date()
+    date_to = _parse(params, 'date_to', today)
+    date_from = _parse(params, 'date_from', date_to - timedelta(days=6))
+    group_by = params.get('group_by', 'day')
+    if group_by not in GROUPINGS:
+        raise serializers.ValidationError({'group_by': f"Choose one of {', '.join(GROUPINGS)}."})
+    try:
+        limit = min(max(int(params.get('limit', 10)), 1), 100)
+    except ValueError:
+        raise serializers.ValidationError({'limit': "A valid integer is required."})
+
+    categories = DailyCategorySales.objects.filter(date__range=(date_from, date_to))
+    if group_by == 'day':
+        # Per-category rows would count an order once for each of its categories.
+        results = (DailySales.objects.filter(date__range=(date_from, date_to))
+                   .values('date', 'orders', 'units', 'revenue').order_by('date'))
+    elif group_by == 'category':
+        results = categories.values('category_id', 'category__name').annotate(**TOTALS).order_by('-revenue')
+    elif group_by == 'day_category':
+        results = (categories.values('date', 'category_id', 'category__name')
+                   .annotate(**TOTALS).order_by('date', '-revenue'))
+    else:
+        results = (
+            DailyProductSales.objects.filter(date__range=(date_from, date_to))
+            .values('product_id', 'product__name')
+            .annotate(**TOTALS)
+            .order_by('-units')[:limit]
+        )
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'group_by': group_by,
+        'results': [
+            {key.replace('__', '_'): value for key, value in row.items()}
+            for row in results
+        ],
+    }
@@ -0,0 +1,184 @@
+"""
+In-memory prefix index for product type-ahead.
+
+Every word of a product's normalized name and category name contributes
+its prefixes, up to MAX_PREFIX characters, to a dict of prefix -> product
+ids. Each list is kept in rank order (units sold, then name) and capped at
+TOP_PER_PREFIX, so memory grows with the number of words rather than with
+the square of name lengths, and a lookup returns the most popular matches
+without scanning or sorting. Queries of several words are looked up by
+their most selective word and filtered on the rest. One index is shared by all
+threads of a worker; writers hold a lock, and readers take it only for the
+lookup.
+
+The index is kept current in-process by Product/Category signals
+(store.signals). Writes that skip signals, or happen in other workers,
+bump the catalog version; a worker that notices a new version rebuilds in
+the background, at most once per AUTOCOMPLETE_REFRESH_INTERVAL. A product
+removed in-process leaves its lists a little short until then.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from django.conf import settings
+from django.db.models import Sum
+
+from core.cache import catalog_version
+from core.models import DailyProductSales, Product
+
+logger = logging.getLogger(__name__)
+
+MAX_PREFIX = 12
+TOP_PER_PREFIX = 200
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD.sub(' ', text.casefold()).strip()
+
+
+def index_words(name, category):
+    """The distinct words of the name and the category."""
+    return frozenset(normalize(name).split()) | frozenset(normalize(category).split())
+
+
+def prefixes(words):
+    return {word[:length] for word in words for length in range(1, min(len(word), MAX_PREFIX) + 1)}
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._prefixes = {}
+        self._products = {}
+        self._version = None
+        self._built_at = 0.0
+        self._building = False
+
+    def _rank(self, product_id):
+        name, _, _, popularity, _ = self._products[product_id]
+        return -popularity, name, product_id
+
+    def _insert(self, product_id, name, category_id, category, popularity):
+        words = index_words(name, category)
+        self._products[product_id] = (name, category_id, category, popularity, words)
+        for prefix in prefixes(words):
+            ranked = self._prefixes.setdefault(prefix, [])
+            bisect.insort(ranked, product_id, key=self._rank)
+            del ranked[TOP_PER_PREFIX:]
+
+    def _remove(self, product_id):
+        entry = self._products.get(product_id)
+        if entry is None:
+            return
+        for prefix in prefixes(entry[4]):
+            ranked = self._prefixes.get(prefix)
+            if ranked and product_id in ranked:
+                ranked.remove(product_id)
+        del self._products[product_id]
+
+    def build(self):
+        version = catalog_version()
+        popularity = dict(
+            DailyProductSales.objects.values('product_id').annotate(units=Sum('units'))
+            .values_list('product_id', 'units')
+        )
+        products = {}
+        rows = Product.objects.values_list('id', 'name', 'category_id', 'category__name').order_by()
+        for product_id, name, category_id, category in rows.iterator(chunk_size=5000):
+            products[product_id] = (
+                name, category_id, category, popularity.get(product_id) or 0, index_words(name, category))
+        # Products are visited in rank order, so each list fills with its
+        # best TOP_PER_PREFIX matches and then stops growing.
+        lists = {}
+        for product_id in sorted(products, key=lambda pid: (-products[pid][3], products[pid][0], pid)):
+            for prefix in prefixes(products[product_id][4]):
+                ranked = lists.setdefault(prefix, [])
+                if len(ranked) < TOP_PER_PREFIX:
+                    ranked.append(product_id)
+        with self._lock:
+            self._prefixes, self._products = lists, products
+            self._version, self._built_at = version, time.monotonic()
+        logger.info('Autocomplete index built with %d products and %d prefixes.', len(products), len(lists))
+
+    def _rebuild_in_background(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Autocomplete index rebuild failed.')
+        finally:
+            self._building = False
+
+    def warm_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._rebuild_in_background, name='autocomplete-index', daemon=True).start()
+
+    def ensure_fresh(self):
+        if self._version is None:
+            with self._lock:
+                if self._version is None:
+                    self.build()
+            return
+        if (catalog_version() != self._version
+                and time.monotonic() - self._built_at >= settings.AUTOCOMPLETE_REFRESH_INTERVAL):
+            self.warm_in_background()
+
+    def upsert(self, product):
+        if self._version is None:
+            return
+        with self._lock:
+            popularity = self._products.get(product.id, (None, None, None, 0))[3]
+            self._remove(product.id)
+            self._insert(product.id, product.name, product.category_id, product.category.name, popularity)
+            self._version = catalog_version()
+
+    def remove(self, product_id):
+        if self._version is None:
+            return
+        with self._lock:
+            self._remove(product_id)
+            self._version = catalog_version()
+
+    def rename_category(self, category):
+        if self._version is None:
+            return
+        with self._lock:
+            for product_id in [pid for pid, entry in self._products.items() if entry[1] == category.id]:
+                name, _, _, popularity, _ = self._products[product_id]
+                self._remove(product_id)
+                self._insert(product_id, name, category.id, category.name, popularity)
+            self._version = catalog_version()
+
+    def search(self, query, limit=10):
+        terms = normalize(query).split()
+        if not terms:
+            return []
+        self.ensure_fresh()
+        with self._lock:
+            products = self._products
+            # The shortest list is the most selective, and complete when
+            # below the cap.
+            candidates = min((self._prefixes.get(term[:MAX_PREFIX], ()) for term in terms), key=len)
+            results = []
+            for product_id in candidates:
+                words = products[product_id][4]
+                if all(any(word.startswith(term) for word in words) for term in terms):
+                    results.append(product_id)
+                    if len(results) == limit:
+                        break
+            return [
+                {'id': pid, 'name': products[pid][0], 'category': products[pid][2]}
+                for pid in results
+            ]
+
+
+product_index = PrefixIndex()
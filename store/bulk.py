@@ -0,0 +1,161 @@
+"""
+Bulk create and update of products.
+
+A payload is validated in one pass: per-row field validation runs in
+Python, while categories, existing products and sku collisions are each
+resolved with a single query for the whole payload. Nothing is written
+unless every row is valid, and then all rows are applied with
+bulk_create/bulk_update inside one transaction.
+"""
+from collections import Counter
+from decimal import Decimal
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from rest_framework import serializers
+
+from core.cache import bump_catalog_version, invalidation_events
+from core.models import Category, Product
+from .events import publish_stock
+
+WRITE_BATCH_SIZE = 1000
+
+
+class ProductBulkItemSerializer(serializers.Serializer):
+    """Field-level validation for one row; relations are checked in bulk."""
+    id = serializers.IntegerField(required=False)
+    sku = serializers.CharField(max_length=64, required=False, allow_null=True, allow_blank=True)
+    name = serializers.CharField(max_length=255)
+    category = serializers.IntegerField()
+    description = serializers.CharField(required=False, allow_blank=True)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal('0'))
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+
+def _validate_rows(payload, partial):
+    rows, errors = [], {}
+    for index, raw in enumerate(payload):
+        serializer = ProductBulkItemSerializer(data=raw, partial=partial)
+        if serializer.is_valid():
+            rows.append(dict(serializer.validated_data))
+        else:
+            rows.append(None)
+            errors[index] = dict(serializer.errors)
+    return rows, errors
+
+
+def _add_error(errors, index, field, message):
+    errors.setdefault(index, {}).setdefault(field, []).append(message)
+
+
+def bulk_write_products(payload, mode):
+    """
+    Apply `payload` (a list of product dicts) and return (ok, results, events).
+
+    `mode` is 'create', 'update' or 'partial_update'. Updates identify rows
+    by `id`. When any row is invalid nothing is written and `results`
+    holds the errors per row index.
+    """
+    if not isinstance(payload, list):
+        raise serializers.ValidationError("Expected a list of products.")
+    if len(payload) > settings.BULK_PRODUCT_MAX_ROWS:
+        raise serializers.ValidationError(
+            f"At most {settings.BULK_PRODUCT_MAX_ROWS} products can be written per request.")
+
+    creating = mode == 'create'
+    rows, errors = _validate_rows(payload, partial=mode == 'partial_update')
+
+    with transaction.atomic():
+        category_ids = {row['category'] for row in rows if row and 'category' in row}
+        categories = Category.objects.in_bulk(category_ids)
+
+        products = {}
+        if not creating:
+            ids = [row['id'] for row in rows if row and 'id' in row]
+            products = Product.objects.select_for_update().in_bulk(ids)
+
+        skus = [row['sku'] for row in rows if row and row.get('sku')]
+        sku_owners = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'id'))
+        sku_counts = Counter(skus)
+        id_counts = Counter(row.get('id') for row in rows if row and not creating)
+
+        for index, row in enumerate(rows):
+            if row is None:
+                continue
+            if creating:
+                row.pop('id', None)
+            if 'sku' in row and not row['sku']:
+                row['sku'] = None
+            if 'category' in row and row['category'] not in categories:
+                _add_error(errors, index, 'category', f"Invalid pk \"{row['category']}\" - object does not exist.")
+            if not creating:
+                if 'id' not in row:
+                    _add_error(errors, index, 'id', "This field is required.")
+                elif row['id'] not in products:
+                    _add_error(errors, index, 'id', f"Product {row['id']} does not exist.")
+                elif id_counts[row['id']] > 1:
+                    _add_error(errors, index, 'id', "Product appears more than once in the payload.")
+            sku = row.get('sku')
+            if sku:
+                owner = sku_owners.get(sku)
+                if sku_counts[sku] > 1:
+                    _add_error(errors, index, 'sku', "Sku appears more than once in the payload.")
+                elif owner is not None and (creating or owner != row.get('id')):
+                    _add_error(errors, index, 'sku', "Product with this sku already exists.")
+
+        if errors:
+            results = [
+                {'index': index, 'errors': errors[index]} if index in errors else {'index': index}
+                for index in range(len(rows))
+            ]
+            return False, results, []
+
+        if creating:
+            created = Product.objects.bulk_create(
+                [
+                    Product(
+                        category=categories[row.pop('category')],
+                        **row,
+                    )
+                    for row in rows
+                ],
+                batch_size=WRITE_BATCH_SIZE,
+            )
+            results = [
+                {'index': index, 'id': product.id, 'status': 'created'}
+                for index, product in enumerate(created)
+            ]
+            touched = created
+        else:
+            fields = set()
+            touched = []
+            old_categories = set()
+            for row in rows:
+                product = products[row.pop('id')]
+                old_categories.add(product.category_id)
+                if 'category' in row:
+                    product.category = categories[row.pop('category')]
+                    fields.add('category')
+                for field, value in row.items():
+                    setattr(product, field, value)
+                    fields.add(field)
+                touched.append(product)
+            if fields:
+                Product.objects.bulk_update(touched, sorted(fields), batch_size=WRITE_BATCH_SIZE)
+            if 'quantity' in fields:
+                for product in touched:
+                    transaction.on_commit(partial(publish_stock, product))
+            results = [
+                {'index': index, 'id': product.id, 'status': 'updated'}
+                for index, product in enumerate(touched)
+            ]
+            category_ids |= old_categories
+
+        transaction.on_commit(bump_catalog_version)
+
+    events = invalidation_events(
+        product_ids=[product.id for product in touched],
+        category_ids=category_ids | {product.category_id for product in touched},
+    )
+    return True, results, events
@@ -0,0 +1,196 @@
+"""
+Buffered product view and add-to-cart counters.
+
+Request handlers only increment an in-process buffer (or a Redis hash when
+PRODUCT_COUNTERS_BACKEND is 'redis'); a background thread per worker
+drains it every PRODUCT_COUNTERS_FLUSH_INTERVAL seconds and applies the
+totals to ProductCounter in one batched upsert. The trending and most
+viewed rankings are recomputed after each flush and cached, so neither the
+hot read path nor the ranking endpoint writes or scans anything.
+
+Trend scores decay with a half-life of TRENDING_HALF_LIFE_HOURS. Rather
+than decaying every row, each event's weight is scaled *up* by
+2 ** (hours since EPOCH / half-life) and the log of the sum is stored;
+ordering by that value equals ordering by the decayed score at any time.
+"""
+import atexit
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from core.models import Product, ProductCounter
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2025, 1, 1)
+VIEW, ADD_TO_CART = 0, 1
+EVENT_NAMES = {VIEW: 'view', ADD_TO_CART: 'cart'}
+RANKING_CACHE_KEYS = {'trending': 'product-ranking:trending', 'views': 'product-ranking:views'}
+
+
+def log_weight_offset(now):
+    hours = (now.replace(tzinfo=None) - EPOCH).total_seconds() / 3600
+    return hours / settings.TRENDING_HALF_LIFE_HOURS * math.log(2)
+
+
+def log_add(a, b):
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+class LocalBuffer:
+    """Counts kept in this process until the next flush."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: [0, 0])
+
+    def record(self, product_id, event):
+        with self._lock:
+            self._counts[product_id][event] += 1
+
+    def drain(self):
+        with self._lock:
+            counts, self._counts = self._counts, defaultdict(lambda: [0, 0])
+        return counts
+
+
+class RedisBuffer:
+    """Counts shared by all workers in one Redis hash, drained atomically."""
+    key = 'product-counters'
+
+    def __init__(self, url):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def record(self, product_id, event):
+        self._client.hincrby(self.key, f'{product_id}:{EVENT_NAMES[event]}', 1)
+
+    def drain(self):
+        import redis
+
+        # RENAME is atomic, so increments made after it land in a fresh hash.
+        snapshot = f'{self.key}:flushing:{uuid.uuid4().hex}'
+        try:
+            self._client.rename(self.key, snapshot)
+        except redis.ResponseError:
+            return {}
+        raw = self._client.hgetall(snapshot)
+        self._client.delete(snapshot)
+
+        names = {name: event for event, name in EVENT_NAMES.items()}
+        counts = defaultdict(lambda: [0, 0])
+        for field, value in raw.items():
+            product_id, name = field.decode().split(':')
+            counts[int(product_id)][names[name]] += int(value)
+        return counts
+
+
+def flush_counts(counts):
+    """Apply drained counts to ProductCounter and refresh the cached rankings."""
+    if not counts:
+        return 0
+    now = timezone.now()
+    offset = log_weight_offset(now)
+    cart_weight = settings.TRENDING_ADD_TO_CART_WEIGHT
+    product_ids = set(Product.objects.filter(id__in=list(counts)).values_list('id', flat=True))
+
+    with transaction.atomic():
+        ProductCounter.objects.bulk_create(
+            [ProductCounter(product_id=product_id) for product_id in product_ids], ignore_conflicts=True)
+        rows = list(ProductCounter.objects.select_for_update().filter(product_id__in=product_ids).order_by('pk'))
+        for row in rows:
+            views, carts = counts[row.product_id]
+            row.views += views
+            row.add_to_cart += carts
+            weight = views + cart_weight * carts
+            if weight:
+                row.trend_score = log_add(row.trend_score, math.log(weight) + offset)
+            row.updated_at = now
+        ProductCounter.objects.bulk_update(rows, ['views', 'add_to_cart', 'trend_score', 'updated_at'])
+
+    refresh_rankings()
+    return len(rows)
+
+
+def refresh_rankings():
+    size = settings.TRENDING_RANKING_SIZE
+    trending = list(
+        ProductCounter.objects.filter(trend_score__isnull=False)
+        .order_by('-trend_score').values_list('product_id', flat=True)[:size]
+    )
+    most_viewed = list(ProductCounter.objects.order_by('-views').values_list('product_id', flat=True)[:size])
+    cache.set_many({RANKING_CACHE_KEYS['trending']: trending, RANKING_CACHE_KEYS['views']: most_viewed}, None)
+    return {'trending': trending, 'views': most_viewed}
+
+
+def ranking(name):
+    product_ids = cache.get(RANKING_CACHE_KEYS[name])
+    if product_ids is None:
+        product_ids = refresh_rankings()[name]
+    return product_ids
+
+
+class CounterRecorder:
+    """Process-wide entry point; starts the flusher thread on first use."""
+
+    def __init__(self):
+        self._buffer = None
+        self._lock = threading.Lock()
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            with self._lock:
+                if self._buffer is None:
+                    if settings.PRODUCT_COUNTERS_BACKEND == 'redis':
+                        self._buffer = RedisBuffer(settings.REDIS_URL)
+                    else:
+                        self._buffer = LocalBuffer()
+                    threading.Thread(target=self._run, name='product-counters', daemon=True).start()
+                    atexit.register(self.flush)
+        return self._buffer
+
+    def record(self, product_id, event):
+        try:
+            self.buffer.record(int(product_id), event)
+        except Exception:
+            # Counters are best effort and must never fail the request.
+            logger.exception('Could not record product event.')
+
+    def flush(self):
+        if self._buffer is None:
+            return 0
+        return flush_counts(self._buffer.drain())
+
+    def _run(self):
+        while True:
+            time.sleep(settings.PRODUCT_COUNTERS_FLUSH_INTERVAL)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing product counters failed.')
+
+
+recorder = CounterRecorder()
+
+
+def record_view(product_id):
+    recorder.record(product_id, VIEW)
+
+
+def record_add_to_cart(product_id):
+    recorder.record(product_id, ADD_TO_CART)
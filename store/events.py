@@ -0,0 +1,176 @@
+"""
+Fan-out of stock and order status changes to Server-Sent Events streams.
+
+Model signals (store.signals) publish small JSON messages on channels
+named 'product:<id>' and 'user:<id>'. Each worker keeps one registry of
+the channels its open streams are subscribed to; delivering a message is
+a dict lookup plus a queue put per subscriber, and an idle stream is just
+a coroutine waiting on its queue.
+
+With EVENTS_BACKEND = 'redis', messages are published to Redis instead and
+a single listener task per worker relays them into the local registry, so
+changes made by any worker reach streams held open by all of them.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REDIS_PREFIX = 'events:'
+QUEUE_SIZE = 100
+RETRY_MS = 3000
+
+
+def product_channel(product_id):
+    return f'product:{product_id}'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class Subscription:
+    """One open stream: a bounded queue fed from any thread."""
+
+    def __init__(self, channels):
+        self.channels = set(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The stream's event loop has already shut down.
+            pass
+
+    def _put(self, message):
+        # A client that cannot keep up loses its oldest updates, not the newest.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._redis = None
+        self._listener = None
+
+    @property
+    def uses_redis(self):
+        return settings.EVENTS_BACKEND == 'redis'
+
+    def subscribe(self, channels):
+        subscription = Subscription(channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].add(subscription)
+        if self.uses_redis:
+            self._ensure_listener()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.deliver(message)
+
+    def publish(self, channel, payload):
+        message = json.dumps(payload)
+        if not self.uses_redis:
+            self.dispatch(channel, message)
+            return
+        try:
+            if self._redis is None:
+                import redis
+
+                self._redis = redis.Redis.from_url(settings.REDIS_URL)
+            self._redis.publish(REDIS_PREFIX + channel, message)
+        except Exception:
+            # Updates are best effort; clients resync when they reconnect.
+            logger.exception('Could not publish event on %s.', channel)
+
+    def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        import redis.asyncio
+
+        while True:
+            try:
+                client = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+                async with client.pubsub() as pubsub:
+                    await pubsub.psubscribe(REDIS_PREFIX + '*')
+                    async for item in pubsub.listen():
+                        if item['type'] == 'pmessage':
+                            channel = item['channel'].decode()[len(REDIS_PREFIX):]
+                            self.dispatch(channel, item['data'].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Event listener lost its Redis connection; reconnecting.')
+                await asyncio.sleep(1)
+
+
+broker = Broker()
+
+
+def stock_message(product_id, quantity):
+    return {'type': 'stock', 'product': product_id, 'quantity': quantity}
+
+
+def publish_stock(product):
+    broker.publish(product_channel(product.id), stock_message(product.id, product.quantity))
+
+
+def publish_order(order):
+    broker.publish(user_channel(order.user_id), {
+        'type': 'order', 'order': order.id, 'status': order.status, 'payment_status': order.payment_status,
+    })
+
+
+def format_event(message):
+    """Encode a published message as one SSE frame named after its type."""
+    event = json.loads(message)['type']
+    return f'event: {event}\ndata: {message}\n\n'
+
+
+async def stream(channels, initial=()):
+    """
+    Yield SSE frames: `initial` messages first, then everything published
+    on `channels`, with a comment line as keep-alive while idle.
+    """
+    subscription = broker.subscribe(channels)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        for payload in initial:
+            yield format_event(json.dumps(payload))
+        while True:
+            try:
+                message = await subscription.get(settings.EVENTS_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            yield format_event(message)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,166 @@
+"""
+Row generators and encoders for the streaming export endpoints.
+
+Every export is read with `.values(...).iterator(chunk_size=...)`, which
+uses a server-side cursor on Postgres, and encoded one row at a time, so
+memory stays flat regardless of how many rows are exported. Orders are
+read from each user shard in turn (core.sharding), and product names are
+looked up in the global catalog a chunk of rows at a time.
+
+Under ASGI a synchronous iterator would be drained into memory before the
+first byte is sent, so the views hand those requests `async_lines()`,
+which pulls one chunk of encoded lines at a time in a worker thread.
+"""
+import csv
+import itertools
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework import serializers
+
+from core import sharding
+from core.models import Order, Product
+
+CHUNK_SIZE = 2000
+
+ORDER_FIELDS = ['id', 'user_id', 'status', 'total_price', 'created_at',
+                'payment__payment_method', 'payment__payment_status', 'payment__amount', 'payment__payment_date']
+ORDER_ITEM_FIELDS = ['items__product_id', 'items__product__name', 'items__quantity', 'items__price']
+ORDER_CSV_HEADER = ['order_id', 'user_id', 'status', 'total_price', 'created_at', 'payment_method',
+                    'payment_status', 'payment_amount', 'payment_date', 'product_id', 'product_name',
+                    'quantity', 'line_total']
+PRODUCT_FIELDS = ['id', 'sku', 'name', 'category_id', 'category__name', 'description', 'price', 'quantity',
+                  'create_date']
+PRODUCT_CSV_HEADER = ['id', 'sku', 'name', 'category_id', 'category_name', 'description', 'price', 'quantity',
+                      'create_date']
+
+
+class Echo:
+    """Pseudo-buffer whose write() hands the row back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+class ExportParamsSerializer(serializers.Serializer):
+    export_format = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'date_to': "Must not be before date_from."})
+        return attrs
+
+
+class OrderExportParamsSerializer(ExportParamsSerializer):
+    status = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_status(self, value):
+        statuses = [status for status in value.split(',') if status]
+        unknown = set(statuses) - {choice for choice, _ in Order.STATUS_CHOICES}
+        if unknown:
+            raise serializers.ValidationError(f"Unknown status: {', '.join(sorted(unknown))}.")
+        return statuses
+
+
+class ProductExportParamsSerializer(ExportParamsSerializer):
+    category = serializers.IntegerField(required=False, min_value=1)
+
+
+def _filter_dates(queryset, params, field):
+    if params.get('date_from'):
+        queryset = queryset.filter(**{f'{field}__gte': params['date_from']})
+    if params.get('date_to'):
+        # Half-open range so the created_at index can be used directly.
+        queryset = queryset.filter(**{f'{field}__lt': params['date_to'] + timedelta(days=1)})
+    return queryset
+
+
+def order_rows(params):
+    """Yield one dict per order-item row, LEFT JOINed to its order and payment."""
+    queryset = _filter_dates(Order.objects.all(), params, 'created_at')
+    if params.get('status'):
+        queryset = queryset.filter(status__in=params['status'])
+    fields = [field for field in ORDER_FIELDS + ORDER_ITEM_FIELDS if field != 'items__product__name']
+    rows = itertools.chain.from_iterable(
+        queryset.using(alias).order_by('id', 'items__id').values(*fields).iterator(chunk_size=CHUNK_SIZE)
+        for alias in sharding.all_shards()
+    )
+    return _with_product_names(rows)
+
+
+def _with_product_names(rows):
+    names = {}
+    while chunk := list(itertools.islice(rows, CHUNK_SIZE)):
+        missing = {row['items__product_id'] for row in chunk} - names.keys() - {None}
+        names.update(Product.objects.filter(id__in=missing).values_list('id', 'name'))
+        for row in chunk:
+            row['items__product__name'] = names.get(row['items__product_id'])
+            yield row
+
+
+def product_rows(params):
+    queryset = _filter_dates(Product.objects.all(), params, 'create_date')
+    if params.get('category'):
+        queryset = queryset.filter(category_id=params['category'])
+    return queryset.order_by('id').values(*PRODUCT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def orders_ndjson(rows):
+    """Group consecutive item rows back into one JSON document per order."""
+    for order_id, group in itertools.groupby(rows, key=lambda row: row['id']):
+        group = list(group)
+        first = group[0]
+        document = {
+            'id': order_id,
+            'user': first['user_id'],
+            'status': first['status'],
+            'total_price': first['total_price'],
+            'created_at': first['created_at'],
+            'payment': {
+                'payment_method': first['payment__payment_method'],
+                'payment_status': first['payment__payment_status'],
+                'amount': first['payment__amount'],
+                'payment_date': first['payment__payment_date'],
+            } if first['payment__payment_status'] else None,
+            'items': [
+                {
+                    'product': row['items__product_id'],
+                    'name': row['items__product__name'],
+                    'quantity': row['items__quantity'],
+                    'total_price': row['items__price'],
+                }
+                for row in group if row['items__product_id'] is not None
+            ],
+        }
+        yield json.dumps(document, cls=DjangoJSONEncoder) + '\n'
+
+
+def orders_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(ORDER_CSV_HEADER)
+    for row in rows:
+        yield writer.writerow([row[field] for field in ORDER_FIELDS + ORDER_ITEM_FIELDS])
+
+
+def products_ndjson(rows):
+    for row in rows:
+        row['category_name'] = row.pop('category__name')
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def products_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(PRODUCT_CSV_HEADER)
+    for row in rows:
+        yield writer.writerow([row[field] for field in PRODUCT_FIELDS])
+
+
+async def async_lines(lines):
+    """Serve a synchronous line iterator to an ASGI response one chunk at a time."""
+    next_chunk = sync_to_async(lambda: ''.join(itertools.islice(lines, CHUNK_SIZE)))
+    while chunk := await next_chunk():
+        yield chunk
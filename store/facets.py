@@ -0,0 +1,90 @@
+"""
+Facets for the product list: category counts, a price histogram and the
+in-stock count, computed with one grouped aggregate over the filtered
+queryset and cached per normalized filter and catalog version.
+"""
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, IntegerField, Q, Value, When
+from rest_framework import serializers
+
+from core.cache import catalog_version
+from .filters import ProductFilter
+
+MAX_BUCKETS = 20
+
+
+def price_boundaries(params):
+    raw = params.get('price_buckets')
+    if not raw:
+        return [Decimal(str(value)) for value in settings.PRODUCT_FACET_PRICE_BUCKETS]
+    try:
+        boundaries = sorted({Decimal(value.strip()) for value in raw.split(',') if value.strip()})
+    except InvalidOperation:
+        raise serializers.ValidationError({'price_buckets': "Use a comma separated list of prices."})
+    if not 1 <= len(boundaries) <= MAX_BUCKETS:
+        raise serializers.ValidationError({'price_buckets': f"Use between 1 and {MAX_BUCKETS} boundaries."})
+    return boundaries
+
+
+def cache_key(params, boundaries):
+    filters = {
+        name: params.get(name, '').strip().lower()
+        for name in ProductFilter.base_filters
+        if params.get(name, '').strip()
+    }
+    filters['price_buckets'] = [str(boundary) for boundary in boundaries]
+    digest = hashlib.sha1(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+    return f'product-facets:{catalog_version()}:{digest}'
+
+
+def product_facets(queryset, params):
+    boundaries = price_boundaries(params)
+    key = cache_key(params, boundaries)
+    facets = cache.get(key)
+    if facets is not None:
+        return facets
+
+    # Bucket i holds prices in [boundaries[i - 1], boundaries[i]). The first
+    # and last buckets are open ended, so the histogram adds up to the total.
+    bucket = Case(
+        *[When(price__lt=upper, then=Value(index)) for index, upper in enumerate(boundaries)],
+        default=Value(len(boundaries)),
+        output_field=IntegerField(),
+    )
+    rows = (
+        queryset.order_by()
+        .values('category_id', 'category__name', bucket=bucket)
+        .annotate(count=Count('id'), in_stock=Count('id', filter=Q(quantity__gt=0)))
+    )
+
+    categories = {}
+    histogram = [0] * (len(boundaries) + 1)
+    total = in_stock = 0
+    for row in rows:
+        category = categories.setdefault(
+            row['category_id'], {'id': row['category_id'], 'name': row['category__name'], 'count': 0})
+        category['count'] += row['count']
+        histogram[row['bucket']] += row['count']
+        total += row['count']
+        in_stock += row['in_stock']
+
+    facets = {
+        'total': total,
+        'in_stock': in_stock,
+        'categories': sorted(categories.values(), key=lambda item: (-item['count'], item['name'])),
+        'price': [
+            {
+                'min': str(lower) if lower is not None else None,
+                'max': str(upper) if upper is not None else None,
+                'count': count,
+            }
+            for lower, upper, count in zip([None] + boundaries, boundaries + [None], histogram)
+        ],
+    }
+    cache.set(key, facets, settings.PRODUCT_FACETS_CACHE_TIMEOUT)
+    return facets
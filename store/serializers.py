@@ -1,6 +1,10 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from core.models import Category, Product, Cart, CartItem, ShippingAddress, Order, OrderItem, Payment
+from core import pricing
+from core.models import Category, Product, Cart, CartItem, ShippingAddress, Order, OrderItem, Payment, \
+    ChunkedUpload, ArchivedOrder
+from .uploads import received_chunks
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -12,14 +16,39 @@ class CategorySerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
     image = serializers.ImageField(required=False)
+    upload_id = serializers.UUIDField(write_only=True, required=False)
+    display_price = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'category', 'description', 'price', 'quantity', 'image']
+        fields = ['id', 'sku', 'name', 'category', 'description', 'price', 'display_price', 'quantity', 'image',
+                  'upload_id']
+
+    def get_display_price(self, obj):
+        prices = self.context.get('display_prices')
+        if prices is None or obj.id not in prices:
+            prices = pricing.display_prices([obj])
+        return str(prices[obj.id])
+
+    def validate_upload_id(self, value):
+        request = self.context.get('request')
+        upload = ChunkedUpload.objects.filter(id=value, user=request.user, status='Complete').first()
+        if upload is None:
+            raise serializers.ValidationError("No completed upload with this id.")
+        return upload
 
     def create(self, validated_data):
+        upload = validated_data.pop('upload_id', None)
+        if upload is not None:
+            validated_data['image'] = upload.file.name
         return Product.objects.create(**validated_data)
 
+    def update(self, instance, validated_data):
+        upload = validated_data.pop('upload_id', None)
+        if upload is not None:
+            validated_data['image'] = upload.file.name
+        return super().update(instance, validated_data)
+
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
@@ -38,11 +67,13 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 class CartSerializer(serializers.ModelSerializer):
     cart_items = CartItemSerializer(many=True, read_only=True)
+    subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, source='pricing.subtotal', read_only=True)
+    discount = serializers.DecimalField(max_digits=10, decimal_places=2, source='pricing.discount', read_only=True)
     total_price = serializers.ReadOnlyField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'created_at', 'cart_items', 'total_price']
+        fields = ['id', 'user', 'created_at', 'cart_items', 'subtotal', 'discount', 'total_price']
 
 
 class ShippingAddressSerializer(serializers.ModelSerializer):
@@ -51,12 +82,6 @@ class ShippingAddressSerializer(serializers.ModelSerializer):
         fields = ['phone_number', 'address', 'city', 'country', 'postal_code']
 
 
-class ProductForOrderSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Product
-        fields = ['id', 'name', 'price']
-
-
 class ProductForOrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -75,40 +100,88 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 
 class OrderSerializer(serializers.ModelSerializer):
-    items = serializers.SerializerMethodField()
+    items = serializers.JSONField(source='items_snapshot', read_only=True)
     shipping_address = serializers.PrimaryKeyRelatedField(queryset=ShippingAddress.objects.all())
     user = serializers.PrimaryKeyRelatedField(read_only=True)
     total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     status = serializers.CharField(read_only=True)
-    payment_status = serializers.SerializerMethodField()
+    payment_status = serializers.CharField(read_only=True)
     created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'status', 'shipping_address', 'items', 'total_price', 'payment_status', 'created_at']
-        read_only_fields = ['status', 'total_price', 'items', 'user', 'payment_status', 'created_at']
+        fields = ['id', 'user', 'status', 'shipping_address', 'items', 'item_count', 'discount_total', 'total_price',
+                  'payment_status', 'created_at']
+        read_only_fields = ['status', 'total_price', 'discount_total', 'items', 'item_count', 'user', 'payment_status',
+                            'created_at']
 
-    def get_items(self, obj):
-        order_items = obj.items.all()
-        return [
-            ProductForOrderSerializer(order_item.product).data
-            for order_item in order_items
-        ]
 
-    def get_payment_status(self, obj):
-        return obj.payment_status
+class ArchivedOrderSerializer(serializers.ModelSerializer):
+    """Renders an archived order in the same shape as OrderSerializer."""
+    items = serializers.JSONField(source='items_snapshot')
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+    shipping_address = serializers.IntegerField(source='shipping_address_id')
+    created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S")
+
+    class Meta:
+        model = ArchivedOrder
+        fields = ['id', 'user', 'status', 'shipping_address', 'items', 'item_count', 'discount_total', 'total_price',
+                  'payment_status', 'created_at']
+        read_only_fields = fields
 
 
 class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
-        fields = ['payment_method', 'amount', 'payment_date']
-        read_only_fields = ['amount', 'payment_date']
+        fields = ['payment_method', 'amount', 'payment_status', 'payment_date']
+        read_only_fields = ['amount', 'payment_status', 'payment_date']
 
     def create(self, validated_data):
         order = validated_data['order']
         validated_data['amount'] = order.total_price
 
         validated_data['payment_status'] = 'Pending'
+        validated_data['provider'] = settings.PAYMENT_DEFAULT_GATEWAY
 
         return super().create(validated_data)
+
+
+class ChunkedUploadSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False)
+    total_chunks = serializers.ReadOnlyField()
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChunkedUpload
+        fields = ['id', 'filename', 'size', 'chunk_size', 'checksum', 'status', 'total_chunks',
+                  'received_chunks', 'file', 'created_at']
+        read_only_fields = ['id', 'status', 'file', 'created_at']
+
+    def validate_size(self, value):
+        if not 0 < value <= settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Size must be between 1 and {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes.")
+        return value
+
+    def validate_chunk_size(self, value):
+        if not settings.CHUNKED_UPLOAD_MIN_CHUNK_SIZE <= value <= settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError(
+                f"Chunk size must be between {settings.CHUNKED_UPLOAD_MIN_CHUNK_SIZE} and "
+                f"{settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE} bytes.")
+        return value
+
+    def validate_checksum(self, value):
+        value = value.lower()
+        if len(value) != 64 or any(c not in '0123456789abcdef' for c in value):
+            raise serializers.ValidationError("Checksum must be a hex encoded sha256 digest.")
+        return value
+
+    def create(self, validated_data):
+        validated_data.setdefault('chunk_size', settings.CHUNKED_UPLOAD_CHUNK_SIZE)
+        return super().create(validated_data)
+
+    @staticmethod
+    def get_received_chunks(obj):
+        if obj.status == 'Complete':
+            return list(range(obj.total_chunks))
+        return received_chunks(obj)
@@ -0,0 +1,47 @@
+"""
+Signal handlers keeping in-process API caches and event streams current.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core.models import Category, Order, Product
+from core.payments import payments_settled
+from core.signals import is_stock_update
+from . import events
+from .autocomplete import product_index
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, update_fields=None, **kwargs):
+    if not is_stock_update(update_fields):
+        product_index.upsert(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    product_index.remove(instance.id)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category(sender, instance, created, **kwargs):
+    if not created:
+        product_index.rename_category(instance)
+
+
+@receiver(post_save, sender=Product)
+def publish_stock(sender, instance, **kwargs):
+    transaction.on_commit(partial(events.publish_stock, instance))
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, using, **kwargs):
+    transaction.on_commit(partial(events.publish_order, instance), using=using)
+
+
+@receiver(payments_settled)
+def publish_settled_orders(sender, orders, **kwargs):
+    for order in orders:
+        events.publish_order(order)
@@ -1,3 +1,723 @@
-from django.test import TestCase
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core import pricing, sharding
+from core.cache import bump_catalog_version, catalog_version
+from store import autocomplete, counters, events
+from core.models import (
+    Cart, Category, ChunkedUpload, DailyProductSales, Order, OrderItem, Payment, Product, ProductCounter,
+    ProductRecommendation, Promotion, ShippingAddress, User,
+)
+
+
+class CheckoutPricingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        pricing._compiled.clear()
+        self.user = User.objects.create_user('buyer@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.address = ShippingAddress.objects.create(
+            user=self.user, address='1 Main St', city='Tbilisi', postal_code='0100', country='GE', phone_number='555')
+        self.books = Category.objects.create(name='Books')
+        self.book = Product.objects.create(category=self.books, name='Dune', price=Decimal('20.00'), quantity=10)
+        self.pen = Product.objects.create(
+            category=Category.objects.create(name='Stationery'), name='Pen', price=Decimal('2.50'), quantity=10)
+
+    def add_to_cart(self, product, quantity):
+        response = self.client.post('/api/store/cart-items/', {'product': product.id, 'quantity': quantity},
+                                    format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def checkout(self):
+        return self.client.post('/api/store/order/', {'shipping_address': self.address.id}, format='json')
+
+    def orders(self):
+        return Order.objects.using(sharding.shard_for_user(self.user.pk))
+
+    def test_checkout_without_promotions_charges_list_prices(self):
+        self.add_to_cart(self.book, 2)
+        self.add_to_cart(self.pen, 1)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(Decimal(response.data['total_price']), Decimal('42.50'))
+        self.assertEqual(Decimal(response.data['discount_total']), Decimal('0'))
+
+    def test_best_of_product_and_category_discounts_applies(self):
+        Promotion.objects.create(name='Books 10%', kind='percent', category=self.books, value=10)
+        Promotion.objects.create(name='Dune 25%', kind='percent', product=self.book, value=25)
+        Promotion.objects.create(name='Dune 3 off', kind='fixed', product=self.book, value=3)
+        self.add_to_cart(self.book, 2)
+        self.add_to_cart(self.pen, 1)
+
+        order = self.orders().get(pk=self.checkout().data['id'])
+
+        self.assertEqual(order.total_price, Decimal('32.50'))
+        self.assertEqual(order.discount_total, Decimal('10.00'))
+        self.assertEqual(order.items.get(product=self.book).price, Decimal('30.00'))
+        self.assertEqual(order.items_snapshot[0]['price'], '15.00')
+
+    def test_buy_x_get_y_makes_units_free_and_spreads_them_in_the_snapshot(self):
+        Promotion.objects.create(name='3 for 2', kind='buy_x_get_y', product=self.book, buy_quantity=2,
+                                 get_quantity=1)
+        self.add_to_cart(self.book, 3)
+
+        order = self.orders().get(pk=self.checkout().data['id'])
+
+        self.assertEqual(order.total_price, Decimal('40.00'))
+        self.assertEqual(order.discount_total, Decimal('20.00'))
+        self.assertEqual(order.items_snapshot[0]['price'], '13.33')
+
+    def test_cart_threshold_is_measured_after_item_discounts(self):
+        Promotion.objects.create(name='Spend 40', kind='cart_threshold', min_subtotal=40, value=5)
+        Promotion.objects.create(name='Spend 30', kind='cart_threshold', min_subtotal=30, value=2)
+        Promotion.objects.create(name='Dune 10%', kind='percent', product=self.book, value=10)
+        self.add_to_cart(self.book, 2)
+
+        order = self.orders().get(pk=self.checkout().data['id'])
+
+        # 2 x 18.00 = 36.00 reaches the 30 threshold only.
+        self.assertEqual(order.total_price, Decimal('34.00'))
+        self.assertEqual(order.discount_total, Decimal('6.00'))
+
+    def test_promotions_outside_their_window_are_ignored(self):
+        now = timezone.now()
+        Promotion.objects.create(name='Ended', kind='percent', product=self.book, value=50,
+                                 ends_at=now - timedelta(hours=1))
+        Promotion.objects.create(name='Upcoming', kind='percent', product=self.book, value=50,
+                                 starts_at=now + timedelta(hours=1))
+        Promotion.objects.create(name='Off', kind='percent', product=self.book, value=50, is_active=False)
+        self.add_to_cart(self.book, 1)
+
+        self.assertEqual(Decimal(self.checkout().data['total_price']), Decimal('20.00'))
+
+    def test_saving_a_promotion_reprices_the_next_checkout(self):
+        self.add_to_cart(self.book, 1)
+        self.assertEqual(Decimal(self.checkout().data['total_price']), Decimal('20.00'))
+
+        Promotion.objects.create(name='Dune half off', kind='percent', product=self.book, value=50)
+        self.add_to_cart(self.book, 1)
+
+        self.assertEqual(Decimal(self.checkout().data['total_price']), Decimal('10.00'))
+
+    def test_checkout_decrements_stock(self):
+        self.add_to_cart(self.book, 4)
+
+        self.checkout()
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 6)
+
+    def test_committed_checkout_updates_the_recommendations(self):
+        self.add_to_cart(self.book, 1)
+        self.add_to_cart(self.pen, 1)
+
+        with self.captureOnCommitCallbacks(using=sharding.shard_for_user(self.user.pk), execute=True):
+            self.checkout()
+
+        self.assertEqual(set(ProductRecommendation.objects.values_list('product', 'recommended', 'score', 'rank')),
+                         {(self.book.id, self.pen.id, 1, 1), (self.pen.id, self.book.id, 1, 1)})
+
+    def test_insufficient_stock_rejects_the_order(self):
+        self.add_to_cart(self.book, 3)
+        Product.objects.filter(pk=self.book.pk).update(quantity=2)
+
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.orders().exists())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 2)
+
+    def test_order_history_is_served_from_the_order_summary(self):
+        self.add_to_cart(self.book, 2)
+        self.add_to_cart(self.pen, 1)
+        self.checkout()
+        response = self.client.post('/api/store/payment/', {'payment_method': 'card'}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+        with CaptureQueriesContext(connections[sharding.shard_for_user(self.user.pk)]) as queries:
+            response = self.client.get('/api/store/order/')
+
+        [order] = response.data
+        self.assertEqual([(item['name'], item['quantity']) for item in order['items']], [('Dune', 2), ('Pen', 1)])
+        self.assertEqual((order['item_count'], order['payment_status']), (3, 'Pending'))
+        tables = [table for query in queries for table in ('core_orderitem', 'core_payment') if table in query['sql']]
+        self.assertEqual(tables, [])
+
+    def test_payment_updates_keep_the_order_summary_in_sync(self):
+        self.add_to_cart(self.book, 1)
+        self.checkout()
+        self.client.post('/api/store/payment/', {'payment_method': 'card'}, format='json')
+        payment = Payment.objects.using(sharding.shard_for_user(self.user.pk)).get()
+
+        payment.payment_status = 'Failed'
+        payment.save()
+
+        self.assertEqual(self.orders().get().payment_status, 'Failed')
+
+
+class ProductFacetTests(TestCase):
+    url = '/api/store/products/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.books = Category.objects.create(name='Books')
+        self.music = Category.objects.create(name='Music')
+        products = [
+            ('Leaflet', self.books, '-1.00', 1), ('Pamphlet', self.books, '5.00', 0), ('Dune', self.books, '20.00', 3),
+            ('Vinyl', self.music, '30.00', 1), ('Box set', self.music, '2000.00', 1),
+        ]
+        for name, category, price, quantity in products:
+            Product.objects.create(category=category, name=name, price=Decimal(price), quantity=quantity)
+
+    def facets(self, **params):
+        response = self.client.get(self.url, {'facets': 'true', **params})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['facets']
+
+    def histogram(self, facets):
+        return [(bucket['min'], bucket['max'], bucket['count']) for bucket in facets['price']]
+
+    def test_default_buckets_count_every_product_once(self):
+        facets = self.facets()
+
+        self.assertEqual((facets['total'], facets['in_stock']), (5, 4))
+        self.assertEqual([(category['name'], category['count']) for category in facets['categories']],
+                         [('Books', 3), ('Music', 2)])
+        self.assertEqual(self.histogram(facets), [
+            (None, '0', 1), ('0', '10', 1), ('10', '25', 1), ('25', '50', 1), ('50', '100', 0), ('100', '250', 0),
+            ('250', '500', 0), ('500', '1000', 0), ('1000', None, 1),
+        ])
+        self.assertEqual(sum(bucket['count'] for bucket in facets['price']), facets['total'])
+
+    def test_custom_buckets_follow_the_filters(self):
+        facets = self.facets(price_buckets='25, 10', category=self.books.id)
+
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(self.histogram(facets), [(None, '10', 2), ('10', '25', 1), ('25', None, 0)])
+
+    def test_invalid_buckets_are_rejected(self):
+        for price_buckets in ('cheap', ','.join(str(price) for price in range(21))):
+            response = self.client.get(self.url, {'facets': 'true', 'price_buckets': price_buckets})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('price_buckets', response.data)
+
+    def test_cached_until_the_catalog_version_changes(self):
+        self.assertEqual(self.facets()['in_stock'], 4)
+        # A queryset update sends no signals, so the cached facets are served.
+        Product.objects.update(quantity=0)
+        self.assertEqual(self.facets()['in_stock'], 4)
+
+        bump_catalog_version()
+
+        self.assertEqual(self.facets()['in_stock'], 0)
+
+
+class ProductCounterTests(TestCase):
+    url = '/api/store/products/'
+
+    def setUp(self):
+        cache.clear()
+        # A buffer of our own, so no flusher thread is started.
+        self.enterContext(mock.patch.object(counters.recorder, '_buffer', counters.LocalBuffer()))
+        self.client = APIClient()
+        category = Category.objects.create(name='Books')
+        self.dune, self.emma, self.ulysses = [
+            Product.objects.create(category=category, name=name, price=Decimal('10.00'), quantity=5)
+            for name in ('Dune', 'Emma', 'Ulysses')
+        ]
+
+    def counts(self):
+        return {row[0]: row[1:] for row in ProductCounter.objects.values_list('product_id', 'views', 'add_to_cart')}
+
+    def ranking(self, **params):
+        response = self.client.get(f'{self.url}trending/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [product['name'] for product in response.data]
+
+    def test_views_are_buffered_until_the_flush(self):
+        for product in (self.dune, self.dune, self.emma):
+            self.assertEqual(self.client.get(f'{self.url}{product.id}/').status_code, 200)
+        counters.record_add_to_cart(self.emma.id)
+        counters.record_view(999999)
+        self.assertEqual(self.counts(), {})
+
+        self.assertEqual(counters.recorder.flush(), 2)
+
+        self.assertEqual(self.counts(), {self.dune.id: (2, 0), self.emma.id: (1, 1)})
+        self.assertEqual(counters.recorder.flush(), 0)
+        counters.record_view(self.dune.id)
+        counters.recorder.flush()
+        self.assertEqual(self.counts()[self.dune.id], (3, 0))
+
+    def test_trending_weighs_add_to_cart_and_decays_old_events(self):
+        start = datetime(2026, 1, 1)
+        with mock.patch.object(counters.timezone, 'now', return_value=start):
+            counters.flush_counts({self.dune.id: [5, 0], self.emma.id: [1, 1]})
+        # Two half-lives later two views weigh as much as eight older ones.
+        with mock.patch.object(counters.timezone, 'now', return_value=start + timedelta(hours=48)):
+            counters.flush_counts({self.ulysses.id: [2, 0]})
+
+        self.assertEqual(self.ranking(), ['Ulysses', 'Emma', 'Dune'])
+        self.assertEqual(self.ranking(by='views', limit=2), ['Dune', 'Ulysses'])
+
+    def test_rankings_are_served_from_the_cache(self):
+        counters.flush_counts({self.dune.id: [1, 0]})
+        ProductCounter.objects.update(views=0, trend_score=None)
+
+        self.assertEqual(self.ranking(), ['Dune'])
+        cache.clear()
+        self.assertEqual(self.ranking(), [])
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(f'{self.url}trending/', {'by': 'sales'}).status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}trending/', {'limit': 'ten'}).status_code, 400)
+
+
+class AutocompleteTests(TestCase):
+    databases = '__all__'
+    url = '/api/store/autocomplete/'
+
+    def setUp(self):
+        cache.clear()
+        self.index = autocomplete.PrefixIndex()
+        self.enterContext(mock.patch('store.views.product_index', self.index))
+        self.enterContext(mock.patch('store.signals.product_index', self.index))
+        self.client = APIClient()
+        self.books = Category.objects.create(name='Books')
+        music = Category.objects.create(name='Music')
+        self.dune, self.messiah, self.dunkirk = [
+            Product.objects.create(category=self.books, name=name, price=Decimal('10.00'), quantity=5)
+            for name in ('Dune', 'Dune Messiah', 'Dunkirk')
+        ]
+        self.dusty, self.cafe = [
+            Product.objects.create(category=music, name=name, price=Decimal('10.00'), quantity=5)
+            for name in ('Dusty Springfield', 'Café del Mar')
+        ]
+        today = timezone.now().date()
+        DailyProductSales.objects.create(date=today, product=self.dune, units=5)
+        DailyProductSales.objects.create(date=today, product=self.messiah, units=4)
+        DailyProductSales.objects.create(date=today - timedelta(days=1), product=self.messiah, units=5)
+
+    def names(self, query, limit=10):
+        return [product['name'] for product in self.index.search(query, limit)]
+
+    def test_prefixes_rank_by_units_sold_then_name(self):
+        self.assertEqual(self.names('du'), ['Dune Messiah', 'Dune', 'Dunkirk', 'Dusty Springfield'])
+        self.assertEqual(self.names('DUNE', limit=1), ['Dune Messiah'])
+        self.assertEqual(self.names('dune mes'), ['Dune Messiah'])
+        self.assertEqual(self.names('music du'), ['Dusty Springfield'])
+        self.assertEqual(self.names('cafe'), ['Café del Mar'])
+        self.assertEqual(self.names('books dunk'), ['Dunkirk'])
+        self.assertEqual(self.names(' -- '), [])
+        self.assertEqual(self.names('dunes'), [])
+
+    def test_lists_keep_only_the_best_matches(self):
+        with mock.patch.object(autocomplete, 'TOP_PER_PREFIX', 2):
+            self.index.build()
+            self.assertEqual(self.names('du'), ['Dune Messiah', 'Dune'])
+            Product.objects.create(category=self.books, name='Duel', price=Decimal('10.00'), quantity=5)
+            self.dunkirk.name = 'Dunkirk Spirit'
+            self.dunkirk.save()
+
+            self.assertEqual(self.names('du'), ['Dune Messiah', 'Dune'])
+            self.assertEqual(self.names('duel'), ['Duel'])
+
+    def test_signals_update_the_lists(self):
+        self.index.build()
+
+        self.dunkirk.name = 'Atonement'
+        self.dunkirk.save()
+        self.messiah.delete()
+        Product.objects.create(category=self.books, name='Duet', price=Decimal('10.00'), quantity=5)
+        self.books.name = 'Novels'
+        self.books.save()
+        # A stock update leaves the lists alone.
+        self.dune.name = 'Renamed'
+        self.dune.save(update_fields=['quantity'])
+
+        self.assertEqual(self.names('du'), ['Dune', 'Duet', 'Dusty Springfield'])
+        self.assertEqual(self.names('aton'), ['Atonement'])
+        self.assertEqual(self.names('novels'), ['Dune', 'Atonement', 'Duet'])
+        self.assertEqual(self.names('books'), [])
+        self.assertEqual(self.index.search('aton')[0]['category'], 'Novels')
+
+    def test_rebuilt_when_the_catalog_version_changes(self):
+        self.index.build()
+        Product.objects.filter(id=self.cafe.id).update(name='Zebra')
+        self.assertEqual(self.names('zebra'), [])
+
+        bump_catalog_version()
+        with mock.patch.object(self.index, 'warm_in_background', side_effect=self.index.build) as warm:
+            with override_settings(AUTOCOMPLETE_REFRESH_INTERVAL=3600):
+                self.assertEqual(self.names('zebra'), [])
+            warm.assert_not_called()
+
+            with override_settings(AUTOCOMPLETE_REFRESH_INTERVAL=0):
+                self.assertEqual(self.names('zebra'), ['Zebra'])
+                self.assertEqual(self.names('zebra'), ['Zebra'])
+            warm.assert_called_once()
+
+    def test_endpoint(self):
+        response = self.client.get(self.url, {'q': 'dune', 'limit': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [{'id': self.messiah.id, 'name': 'Dune Messiah', 'category': 'Books'}])
+        self.assertEqual(self.client.get(self.url).data, [])
+        self.assertEqual(len(self.client.get(self.url, {'q': 'd', 'limit': 0}).data), 1)
+        self.assertEqual(self.client.get(self.url, {'q': 'd', 'limit': 'ten'}).status_code, 400)
+
+
+@override_settings(EVENTS_BACKEND='local')
+class EventStreamTests(TestCase):
+    url = '/api/store/events/'
+
+    def setUp(self):
+        self.broker = events.Broker()
+        self.enterContext(mock.patch.object(events, 'broker', self.broker))
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Books'), name='Dune', price=Decimal('10.00'), quantity=5)
+
+    def stock_event(self, quantity):
+        return events.format_event(json.dumps(events.stock_message(self.product.id, quantity)))
+
+    def test_format_event_names_the_frame_after_the_message_type(self):
+        message = json.dumps({'type': 'order', 'order': 7, 'status': 'Shipped'})
+
+        self.assertEqual(events.format_event(message), f'event: order\ndata: {message}\n\n')
+
+    async def test_a_full_subscription_drops_its_oldest_messages(self):
+        with mock.patch.object(events, 'QUEUE_SIZE', 2):
+            subscription = events.Subscription(['product:1'])
+        for message in ('a', 'b', 'c'):
+            subscription.deliver(message)
+        thread = threading.Thread(target=subscription.deliver, args=('d',))
+        thread.start()
+        thread.join()
+        # Deliveries are handed to the subscription's event loop.
+        await asyncio.sleep(0)
+
+        self.assertEqual([await subscription.get(1), await subscription.get(1)], ['c', 'd'])
+        with self.assertRaises(asyncio.TimeoutError):
+            await subscription.get(0.01)
+
+    @override_settings(EVENTS_HEARTBEAT_INTERVAL=0.01)
+    async def test_stream_sends_initial_messages_then_updates_and_keep_alives(self):
+        frames = events.stream([events.product_channel(self.product.id)], [events.stock_message(self.product.id, 5)])
+
+        self.assertEqual(await anext(frames), f'retry: {events.RETRY_MS}\n\n')
+        self.assertEqual(await anext(frames), self.stock_event(5))
+        events.broker.publish(events.product_channel(0), events.stock_message(0, 1))
+        events.publish_stock(Product(id=self.product.id, quantity=4))
+        self.assertEqual(await anext(frames), self.stock_event(4))
+        self.assertEqual(await anext(frames), ': keep-alive\n\n')
+        self.assertEqual(await anext(frames), ': keep-alive\n\n')
+
+        await frames.aclose()
+        self.assertEqual(self.broker._subscribers, {})
+
+    async def test_endpoint_streams_the_current_stock_first(self):
+        response = await self.async_client.get(self.url, {'products': f'{self.product.id},{self.product.id}'})
+
+        self.assertEqual((response['Content-Type'], response['Cache-Control']), ('text/event-stream', 'no-cache'))
+        frames = response.streaming_content
+        self.assertEqual(await anext(frames), f'retry: {events.RETRY_MS}\n\n'.encode())
+        self.assertEqual(await anext(frames), self.stock_event(5).encode())
+
+    async def test_endpoint_rejects_invalid_requests(self):
+        self.assertEqual((await self.async_client.get(self.url, {'products': 'x'})).status_code, 400)
+        self.assertEqual((await self.async_client.get(self.url)).status_code, 400)
+        response = await self.async_client.get(self.url, {'products': '1', 'token': 'nope'})
+        self.assertEqual(response.status_code, 401)
+
+
+class BulkProductWriteTests(TestCase):
+    url = '/api/store/products/bulk/'
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('staff@example.com', 'pw'))
+        self.books = Category.objects.create(name='Books')
+        self.music = Category.objects.create(name='Music')
+        self.dune = Product.objects.create(
+            category=self.books, sku='BK-1', name='Dune', price=Decimal('20.00'), quantity=10)
+
+    def row(self, **fields):
+        return {'name': 'Emma', 'category': self.books.id, 'price': '9.99', 'quantity': 3, **fields}
+
+    def test_create_writes_every_row_and_returns_ids_in_order(self):
+        version = catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, [self.row(sku='BK-2'), self.row(name='Ulysses')], format='json')
+
+        self.assertEqual(response.status_code, 201, response.data)
+        ids = [result['id'] for result in response.data['results']]
+        self.assertEqual(list(Product.objects.filter(id__in=ids).order_by('id').values_list('name', flat=True)),
+                         ['Emma', 'Ulysses'])
+        self.assertEqual(Product.objects.get(id=ids[1]).sku, None)
+        self.assertIn(f'category:{self.books.id}', response.data['invalidated'])
+        self.assertGreater(catalog_version(), version)
+
+    def test_one_invalid_row_rejects_the_whole_payload(self):
+        payload = [
+            self.row(sku='NEW-1'),
+            self.row(category=999999),
+            self.row(sku='BK-1'),
+            self.row(sku='DUP'),
+            self.row(sku='DUP'),
+            self.row(price='-1'),
+        ]
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = {result['index']: result.get('errors', {}) for result in response.data['results']}
+        self.assertEqual(errors[0], {})
+        self.assertIn('category', errors[1])
+        self.assertIn('sku', errors[2])
+        self.assertIn('sku', errors[3])
+        self.assertIn('sku', errors[4])
+        self.assertIn('price', errors[5])
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_update_replaces_fields_and_moves_categories(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(self.url, [self.row(id=self.dune.id, sku='BK-1', category=self.music.id)],
+                                       format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.dune.refresh_from_db()
+        self.assertEqual((self.dune.name, self.dune.category, self.dune.price), ('Emma', self.music, Decimal('9.99')))
+        self.assertIn(f'category:{self.books.id}', response.data['invalidated'])
+        self.assertIn(f'category:{self.music.id}', response.data['invalidated'])
+
+    def test_partial_update_only_touches_sent_fields(self):
+        response = self.client.patch(self.url, [{'id': self.dune.id, 'quantity': 0}], format='json')
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.dune.refresh_from_db()
+        self.assertEqual((self.dune.name, self.dune.quantity, self.dune.sku), ('Dune', 0, 'BK-1'))
+
+    def test_update_rejects_unknown_and_repeated_ids(self):
+        response = self.client.patch(
+            self.url, [{'id': 999999, 'quantity': 1}, {'id': self.dune.id}, {'id': self.dune.id}], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(all('id' in result['errors'] for result in response.data['results']))
+
+    @override_settings(BULK_PRODUCT_MAX_ROWS=2)
+    def test_payload_must_be_a_bounded_list(self):
+        self.assertEqual(self.client.post(self.url, self.row(), format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, [self.row()] * 3, format='json').status_code, 400)
+
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('shopper@example.com', 'pw'))
+        self.assertEqual(client.post(self.url, [self.row()], format='json').status_code, 403)
+
+
+class ExportTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_superuser('staff@example.com', 'pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.books = Category.objects.create(name='Books')
+        self.music = Category.objects.create(name='Music')
+        self.dune = Product.objects.create(category=self.books, name='Dune', price=Decimal('20.00'), quantity=10)
+        self.album = Product.objects.create(category=self.music, name='Abbey Road', price=Decimal('15.00'), quantity=5)
+        self.shopper = User.objects.create_user('shopper@example.com', 'pw')
+        self.pending = self.place_order(self.dune, self.album)
+        self.shipped = self.place_order(self.album, status='Shipped')
+
+    def place_order(self, *products, status='Pending'):
+        with sharding.use_shard(sharding.shard_for_user(self.shopper.pk)):
+            cart, _ = Cart.objects.get_or_create(user=self.shopper)
+            address = ShippingAddress.objects.create(user=self.shopper, address='1 Main St', city='Tbilisi',
+                                                     postal_code='0100', country='GE', phone_number='555')
+            order = Order.objects.create(user=self.shopper, cart=cart, shipping_address=address, status=status,
+                                         total_price=sum(product.price for product in products))
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+
+    def export(self, kind, **params):
+        response = self.client.get(f'/api/store/export/{kind}/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_orders_ndjson_has_one_document_per_order_with_its_items(self):
+        documents = [json.loads(line) for line in self.export('orders').splitlines()]
+
+        self.assertEqual([document['id'] for document in documents], [self.pending.id, self.shipped.id])
+        self.assertEqual([item['name'] for item in documents[0]['items']], ['Dune', 'Abbey Road'])
+        self.assertEqual(documents[0]['user'], self.shopper.id)
+        self.assertIsNone(documents[0]['payment'])
+
+    def test_orders_csv_has_one_row_per_item(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('orders', export_format='csv'))))
+
+        self.assertEqual([(int(row['order_id']), row['product_name']) for row in rows],
+                         [(self.pending.id, 'Dune'), (self.pending.id, 'Abbey Road'), (self.shipped.id, 'Abbey Road')])
+
+    def test_orders_filter_by_status_and_date(self):
+        shipped = self.export('orders', status='Shipped,Delivered')
+        self.assertEqual([json.loads(line)['id'] for line in shipped.splitlines()], [self.shipped.id])
+
+        tomorrow = timezone.now().date() + timedelta(days=1)
+        self.assertEqual(self.export('orders', date_from=tomorrow), '')
+        self.assertEqual(len(self.export('orders', date_to=timezone.now().date()).splitlines()), 2)
+
+    def test_products_in_both_formats_filtered_by_category(self):
+        documents = [json.loads(line) for line in self.export('products', category=self.music.id).splitlines()]
+        self.assertEqual([(document['name'], document['category_name']) for document in documents],
+                         [('Abbey Road', 'Music')])
+
+        rows = list(csv.DictReader(io.StringIO(self.export('products', export_format='csv'))))
+        self.assertEqual([row['name'] for row in rows], ['Dune', 'Abbey Road'])
+
+    def test_invalid_params_are_rejected(self):
+        invalid = [{'export_format': 'xml'}, {'status': 'Lost'}, {'date_from': '2024-02-02', 'date_to': '2024-02-01'}]
+        for params in invalid:
+            self.assertEqual(self.client.get('/api/store/export/orders/', params).status_code, 400, params)
+
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(self.shopper)
+        self.assertEqual(client.get('/api/store/export/orders/').status_code, 403)
+        self.assertEqual(APIClient().get('/api/store/export/products/').status_code, 401)
+
+    async def test_asgi_requests_stream_an_async_iterator(self):
+        response = await self.async_client.get('/api/store/export/products/',
+                                                headers={'Authorization': f'Bearer {AccessToken.for_user(self.staff)}'})
+
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual([json.loads(line)['name'] for line in content.splitlines()], ['Dune', 'Abbey Road'])
+
+
+class ChunkedUploadTests(TestCase):
+    url = '/api/store/uploads/'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.temp_dir = os.path.join(directory.name, 'uploads')
+        self.enterContext(override_settings(
+            CHUNKED_UPLOAD_TEMP_DIR=self.temp_dir, MEDIA_ROOT=os.path.join(directory.name, 'media'),
+            CHUNKED_UPLOAD_MIN_CHUNK_SIZE=16))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('staff@example.com', 'pw'))
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        self.content = buffer.getvalue()
+        self.chunk_size = -(-len(self.content) // 3)
+
+    def start(self, checksum=None):
+        response = self.client.post(self.url, {
+            'filename': 'red.png', 'size': len(self.content), 'chunk_size': self.chunk_size,
+            'checksum': checksum or hashlib.sha256(self.content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def chunk(self, upload_id, index, content=None, **headers):
+        if content is None:
+            content = self.content[index * self.chunk_size:(index + 1) * self.chunk_size]
+        return self.client.put(f'{self.url}{upload_id}/chunks/{index}/', content,
+                               content_type='application/octet-stream', headers=headers)
+
+    def complete(self, upload_id):
+        return self.client.post(f'{self.url}{upload_id}/complete/')
+
+    def test_chunks_in_any_order_are_assembled_once_all_arrived(self):
+        upload_id = self.start()
+        self.assertEqual(self.chunk(upload_id, 2).status_code, 200)
+        self.assertEqual(self.chunk(upload_id, 0).data['received_chunks'], [0, 2])
+
+        response = self.complete(upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['missing_chunks'], ['1'])
+
+        # A client resuming asks which chunks arrived and sends the rest.
+        self.assertEqual(self.client.get(f'{self.url}{upload_id}/').data['received_chunks'], [0, 2])
+        self.chunk(upload_id, 1)
+        response = self.complete(upload_id)
+
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['status'], 'Complete')
+        upload = ChunkedUpload.objects.get()
+        with upload.file.open('rb') as handle:
+            self.assertEqual(handle.read(), self.content)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, upload_id)))
+
+    def test_chunk_checksum_and_length_are_verified(self):
+        upload_id = self.start()
+
+        self.assertEqual(self.chunk(upload_id, 0, X_Chunk_Checksum='0' * 64).status_code, 400)
+        self.assertEqual(self.chunk(upload_id, 0, content=b'short').status_code, 400)
+        self.assertEqual(self.chunk(upload_id, 3).status_code, 400)
+        checksum = hashlib.sha256(self.content[:self.chunk_size]).hexdigest()
+        self.assertEqual(self.chunk(upload_id, 0, X_Chunk_Checksum=checksum).status_code, 200)
+        self.assertEqual(os.listdir(os.path.join(self.temp_dir, upload_id)), ['0.part'])
+
+    def test_whole_file_checksum_mismatch_rejects_the_upload(self):
+        upload_id = self.start(checksum='f' * 64)
+        for index in range(3):
+            self.chunk(upload_id, index)
+
+        response = self.complete(upload_id)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(ChunkedUpload.objects.get().status, 'Uploading')
+
+    def test_expired_uploads_are_closed_and_cleaned_up(self):
+        expired, fresh = self.start(), self.start()
+        self.chunk(expired, 0)
+        self.chunk(fresh, 0)
+        ChunkedUpload.objects.filter(id=expired).update(created_at=timezone.now() - timedelta(days=2))
+        orphan = os.path.join(self.temp_dir, str(uuid.uuid4()))
+        os.makedirs(orphan)
+        recent_orphan = os.path.join(self.temp_dir, str(uuid.uuid4()))
+        os.makedirs(recent_orphan)
+        two_days_ago = time.time() - 2 * 86400
+        os.utime(orphan, (two_days_ago, two_days_ago))
+
+        self.assertEqual(self.chunk(expired, 1).status_code, 400)
+        self.assertEqual(self.complete(expired).status_code, 400)
+        stdout = io.StringIO()
+        call_command('gc_media', stdout=stdout)
+
+        self.assertIn('Deleted 1 expired upload(s) and 2 chunk directory(ies).', stdout.getvalue())
+        self.assertEqual([str(pk) for pk in ChunkedUpload.objects.values_list('id', flat=True)], [fresh])
+        self.assertEqual(sorted(os.listdir(self.temp_dir)), sorted([fresh, os.path.basename(recent_orphan)]))
@@ -0,0 +1,172 @@
+"""
+Disk handling for chunked, resumable uploads.
+
+Chunks are streamed from the request body straight into
+`CHUNKED_UPLOAD_TEMP_DIR/<upload id>/<index>.part`, so memory use per
+request is bounded by `STREAM_BLOCK_SIZE` whatever the file size. The set
+of `.part` files on disk is the source of truth for which chunks have been
+received, which is what lets a client resume after a dropped connection.
+Uploads left unfinished for CHUNKED_UPLOAD_EXPIRY stop accepting chunks
+and are deleted, chunks and all, by `delete_stale_uploads` (run by
+`gc_media`).
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+
+from core.models import ChunkedUpload
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class AssembledFile(File):
+    """File already on disk that storage can move instead of copying."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def upload_dir(upload):
+    return os.path.join(settings.CHUNKED_UPLOAD_TEMP_DIR, str(upload.id))
+
+
+def chunk_path(upload, index):
+    return os.path.join(upload_dir(upload), f'{index}.part')
+
+
+def is_expired(upload):
+    return upload.status != 'Complete' and upload.created_at < timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY
+
+
+def expected_chunk_length(upload, index):
+    if index == upload.total_chunks - 1:
+        return upload.size - upload.chunk_size * index
+    return upload.chunk_size
+
+
+def received_chunks(upload):
+    try:
+        names = os.listdir(upload_dir(upload))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith('.part') and name[:-5].isdigit())
+
+
+def write_chunk(upload, index, stream, checksum=None):
+    """
+    Stream one chunk from `stream` to disk and return its sha256.
+
+    The chunk is written to a temporary file and only renamed into place
+    once its length (and checksum, when given) has been verified, so a
+    broken transfer never leaves a partial `.part` behind.
+    """
+    if index >= upload.total_chunks:
+        raise serializers.ValidationError(
+            f"Chunk index {index} is out of range; upload has {upload.total_chunks} chunks.")
+
+    expected = expected_chunk_length(upload, index)
+    directory = upload_dir(upload)
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    written = 0
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while written <= expected:
+                block = stream.read(min(STREAM_BLOCK_SIZE, expected + 1 - written))
+                if not block:
+                    break
+                out.write(block)
+                digest.update(block)
+                written += len(block)
+        if written != expected:
+            raise serializers.ValidationError(
+                f"Chunk {index} must be {expected} bytes, received {written}.")
+        if checksum and digest.hexdigest() != checksum.lower():
+            raise serializers.ValidationError(f"Checksum mismatch for chunk {index}.")
+        os.replace(tmp_path, chunk_path(upload, index))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest.hexdigest()
+
+
+def assemble(upload):
+    """
+    Concatenate all chunks, verify the whole-file checksum and hand the
+    result to the upload's storage. Chunks are removed afterwards.
+    """
+    missing = sorted(set(range(upload.total_chunks)) - set(received_chunks(upload)))
+    if missing:
+        raise serializers.ValidationError({'missing_chunks': missing})
+
+    digest = hashlib.sha256()
+    fd, assembled_path = tempfile.mkstemp(dir=upload_dir(upload), suffix='.assembled')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for index in range(upload.total_chunks):
+                with open(chunk_path(upload, index), 'rb') as part:
+                    while block := part.read(STREAM_BLOCK_SIZE):
+                        digest.update(block)
+                        out.write(block)
+        if digest.hexdigest() != upload.checksum.lower():
+            raise serializers.ValidationError("Checksum mismatch for the assembled file.")
+        try:
+            with Image.open(assembled_path) as image:
+                image.verify()
+        except Exception:
+            raise serializers.ValidationError("Uploaded file is not a valid image.")
+
+        with open(assembled_path, 'rb') as handle:
+            upload.file.save(upload.filename, AssembledFile(handle, upload.filename), save=False)
+    finally:
+        if os.path.exists(assembled_path):
+            os.remove(assembled_path)
+
+    shutil.rmtree(upload_dir(upload), ignore_errors=True)
+    upload.status = 'Complete'
+    upload.save(update_fields=['file', 'status'])
+    return upload
+
+
+def delete_stale_uploads(dry_run=False):
+    """
+    Delete expired unfinished uploads with their chunks, and chunk
+    directories older than the expiry that no upload owns any more.
+    Returns the number of uploads and directories removed.
+    """
+    stale = ChunkedUpload.objects.filter(
+        status='Uploading', created_at__lt=timezone.now() - settings.CHUNKED_UPLOAD_EXPIRY)
+    stale_ids = set(stale.values_list('id', flat=True))
+    try:
+        names = os.listdir(settings.CHUNKED_UPLOAD_TEMP_DIR)
+    except FileNotFoundError:
+        names = []
+    directories = {}
+    for name in names:
+        try:
+            directories[uuid.UUID(name)] = os.path.join(settings.CHUNKED_UPLOAD_TEMP_DIR, name)
+        except ValueError:
+            continue
+    owned = set(ChunkedUpload.objects.filter(id__in=directories).values_list('id', flat=True))
+    # Directories without a row are left alone until they are as old as an
+    # expired upload, so a row being created right now is not raced.
+    cutoff = time.time() - settings.CHUNKED_UPLOAD_EXPIRY.total_seconds()
+    doomed = [
+        path for upload_id, path in directories.items()
+        if upload_id in stale_ids or (upload_id not in owned and os.path.getmtime(path) < cutoff)
+    ]
+    if not dry_run:
+        ChunkedUpload.objects.filter(id__in=stale_ids).delete()
+        for path in doomed:
+            shutil.rmtree(path, ignore_errors=True)
+    return len(stale_ids), len(doomed)
@@ -2,7 +2,9 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
 from .views import CategoryViewSet, UserCartView, ProductViewSet, \
-    OrderItemViewSet, OrderViewSet, CreatePaymentView, CartItemViewSet
+    OrderItemViewSet, OrderViewSet, CreatePaymentView, CartItemViewSet, ChunkedUploadViewSet, OrderExportView, \
+    ProductExportView, SalesAnalyticsView, CartRecommendationsView, ProductAutocompleteView, event_stream, \
+    RecentTracesView, ProfileView, ProfileResultView
 
 app_name = 'store'
 
@@ -12,9 +14,19 @@ router.register(r'products', ProductViewSet, basename='product')
 router.register(r'cart-items', CartItemViewSet, basename='cart-item')
 router.register(r'order_items', OrderItemViewSet, basename='order-item')
 router.register(r'order', OrderViewSet, basename='order')
+router.register(r'uploads', ChunkedUploadViewSet, basename='upload')
 
 urlpatterns = [
     path('cart/', UserCartView.as_view(), name='user-cart'),
+    path('cart/recommendations/', CartRecommendationsView.as_view(), name='cart-recommendations'),
     path('payment/', CreatePaymentView.as_view(), name='payment'),
+    path('export/orders/', OrderExportView.as_view(), name='export-orders'),
+    path('export/products/', ProductExportView.as_view(), name='export-products'),
+    path('analytics/sales/', SalesAnalyticsView.as_view(), name='sales-analytics'),
+    path('autocomplete/', ProductAutocompleteView.as_view(), name='autocomplete'),
+    path('events/', event_stream, name='events'),
+    path('debug/traces/', RecentTracesView.as_view(), name='debug-traces'),
+    path('debug/profile/', ProfileView.as_view(), name='debug-profile'),
+    path('debug/profile/<str:profile_id>/', ProfileResultView.as_view(), name='debug-profile-result'),
     path('', include(router.urls)),
 ]
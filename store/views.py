@@ -1,21 +1,41 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Sum
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg import openapi
-from drf_yasg.utils import swagger_auto_schema
-from rest_framework import serializers
+from drf_yasg.utils import swagger_auto_schema, no_body
+from rest_framework import serializers, status
 from rest_framework import viewsets
-from rest_framework.generics import RetrieveAPIView, CreateAPIView
+from rest_framework.decorators import action
+from rest_framework.generics import RetrieveAPIView, CreateAPIView, ListAPIView, get_object_or_404
 from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, ListModelMixin
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet, GenericViewSet
-
-from core.models import Category, Product, Cart, CartItem, ShippingAddress, Order, OrderItem
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from core.models import Category, Product, Cart, CartItem, ShippingAddress, Order, OrderItem, ChunkedUpload, \
+    ArchivedOrder, Payment
+from core import pricing, profiler, recommendations, rollups, sharding, tracing
+from . import analytics, counters, events, exports, uploads
+from .autocomplete import product_index
+from .facets import product_facets
+from .bulk import ProductBulkItemSerializer, bulk_write_products
 from .filters import ProductFilter
 from .permissions import IsAdminOrReadOnly
 from .serializers import CategorySerializer, ProductSerializer, CartSerializer, CartItemSerializer, \
-    ShippingAddressSerializer, OrderItemSerializer, OrderSerializer, PaymentSerializer
+    ShippingAddressSerializer, OrderItemSerializer, OrderSerializer, PaymentSerializer, ChunkedUploadSerializer, \
+    ArchivedOrderSerializer
 
 
 class CustomPagination(PageNumberPagination):
@@ -40,6 +60,13 @@ class ProductViewSet(ModelViewSet):
     filterset_class = ProductFilter
     filter_backends = [DjangoFilterBackend]
 
+    def get_serializer(self, *args, **kwargs):
+        # Price a whole page of products in one pass for display_price.
+        if args and self.request.method == 'GET':
+            products = args[0] if kwargs.get('many') else [args[0]]
+            kwargs['context'] = {**self.get_serializer_context(), 'display_prices': pricing.display_prices(products)}
+        return super().get_serializer(*args, **kwargs)
+
     @swagger_auto_schema(
         operation_summary="Upload Product with Image",
         operation_description="Upload product details and an image.",
@@ -64,10 +91,78 @@ class ProductViewSet(ModelViewSet):
                               description="Filter by minimum price (greater than or equal)"),
             openapi.Parameter('price_max', openapi.IN_QUERY, type=openapi.TYPE_NUMBER,
                               description="Filter by maximum price (less than or equal)"),
+            openapi.Parameter('facets', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                              description="Include category counts, a price histogram and the in-stock count"),
+            openapi.Parameter('price_buckets', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Comma separated price boundaries for the histogram"),
         ]
     )
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets', '').lower() in ('1', 'true'):
+            response.data['facets'] = product_facets(
+                self.filter_queryset(self.get_queryset()), request.query_params)
+        return response
+
+    @swagger_auto_schema(
+        methods=['post', 'put', 'patch'],
+        operation_summary="Bulk Write Products",
+        operation_description="POST creates, PUT updates and PATCH partially updates a list of products "
+                              "(updates identify rows by id). The whole list is validated first and "
+                              "applied in one transaction only if every row is valid.",
+        request_body=ProductBulkItemSerializer(many=True),
+    )
+    @action(detail=False, methods=['post', 'put', 'patch'], parser_classes=[JSONParser])
+    def bulk(self, request):
+        mode = {'POST': 'create', 'PUT': 'update', 'PATCH': 'partial_update'}[request.method]
+        ok, results, events = bulk_write_products(request.data, mode)
+        if not ok:
+            return Response({'results': results}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {'results': results, 'invalidated': events},
+            status=status.HTTP_201_CREATED if mode == 'create' else status.HTTP_200_OK,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        response = super().retrieve(request, *args, **kwargs)
+        counters.record_view(kwargs['pk'])
+        return response
+
+    @swagger_auto_schema(
+        operation_summary="Trending Products",
+        operation_description="Products ranked by time-decayed views and add-to-cart events, "
+                              "or by total views with ?by=views.",
+        manual_parameters=[
+            openapi.Parameter('by', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['trending', 'views']),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+        ],
+        responses={200: ProductSerializer(many=True)},
+    )
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        by = request.query_params.get('by', 'trending')
+        if by not in counters.RANKING_CACHE_KEYS:
+            raise serializers.ValidationError({'by': "Choose 'trending' or 'views'."})
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), settings.TRENDING_RANKING_SIZE)
+        except ValueError:
+            raise serializers.ValidationError({'limit': "A valid integer is required."})
+        product_ids = counters.ranking(by)[:limit]
+        products = Product.objects.in_bulk(product_ids)
+        ranked = [products[product_id] for product_id in product_ids if product_id in products]
+        return Response(ProductSerializer(ranked, many=True, context=self.get_serializer_context()).data)
+
+    @swagger_auto_schema(
+        operation_summary="Frequently Bought Together",
+        responses={200: ProductSerializer(many=True)},
+    )
+    @action(detail=True, methods=['get'])
+    def recommendations(self, request, pk=None):
+        products = (
+            Product.objects.filter(recommended_for__product_id=pk)
+            .order_by('recommended_for__rank')
+        )
+        return Response(ProductSerializer(products, many=True, context=self.get_serializer_context()).data)
 
 
 class UserCartView(RetrieveAPIView):
@@ -79,6 +174,24 @@ class UserCartView(RetrieveAPIView):
         return cart
 
 
+class CartRecommendationsView(ListAPIView):
+    """Products most often bought together with the items in the cart."""
+    serializer_class = ProductSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False) or not self.request.user.is_authenticated:
+            return Product.objects.none()
+        # Cart items are on the user's shard, recommendations on the global database.
+        in_cart = list(CartItem.objects.filter(cart__user=self.request.user).values_list('product_id', flat=True))
+        return (
+            Product.objects.filter(recommended_for__product_id__in=in_cart)
+            .exclude(id__in=in_cart)
+            .annotate(score=Sum('recommended_for__score'))
+            .order_by('-score', 'id')[:settings.RECOMMENDATIONS_TOP_K]
+        )
+
+
 class CartItemViewSet(viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
@@ -99,6 +212,15 @@ class CartItemViewSet(viewsets.ModelViewSet):
                 f"Not enough stock for {product.name}. Available: {product.quantity}, Requested: {quantity}")
 
         serializer.save(cart=cart)
+        cart.touch()
+        counters.record_add_to_cart(product.id)
+
+    def perform_update(self, serializer):
+        serializer.save().cart.touch()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        instance.cart.touch()
 
 
 class ShippingAddressViewSet(ModelViewSet):
@@ -123,23 +245,62 @@ class OrderViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin, Generic
             return Order.objects.none()
         return Order.objects.filter(user=self.request.user).order_by('-created_at')
 
+    @swagger_auto_schema(
+        operation_summary="List Orders",
+        operation_description="List the user's orders, newest first. Orders moved to the archive are only "
+                              "included with include_archived=1.",
+        manual_parameters=[
+            openapi.Parameter('include_archived', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                              description="Also list archived (old delivered or cancelled) orders"),
+        ],
+    )
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('include_archived') in ('1', 'true', 'True'):
+            archived = ArchivedOrder.objects.filter(user=request.user).order_by('-created_at')
+            response.data = sorted(
+                list(response.data) + ArchivedOrderSerializer(archived, many=True).data,
+                key=lambda order: order['created_at'], reverse=True,
+            )
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            archived = get_object_or_404(ArchivedOrder.objects.filter(user=request.user), pk=kwargs['pk'])
+            return Response(ArchivedOrderSerializer(archived).data)
+
     def perform_create(self, serializer):
+        # The order is written on the user's shard and stock on the global
+        # database, each in its own transaction.
+        with transaction.atomic(using=sharding.shard_for_user(self.request.user.pk)), transaction.atomic():
+            self.checkout(serializer)
+
+    def checkout(self, serializer):
         cart = Cart.objects.get(user=self.request.user)
+        cart_items = list(cart.cart_items.prefetch_related('product'))
 
-        if not cart.cart_items.exists():
+        if not cart_items:
             raise serializers.ValidationError("Your cart is empty.")
 
-        total_price = sum(item.product.price * item.quantity for item in cart.cart_items.all())
+        quote = pricing.price_cart([(item.product, item.quantity) for item in cart_items])
 
         order = serializer.save(
             user=self.request.user,
-            total_price=total_price,
+            total_price=quote.total,
+            discount_total=quote.discount,
             status='Pending',
-            cart=cart
+            cart=cart,
+            items_snapshot=[
+                Order.snapshot_item(item.product, item.quantity, line.effective_unit_price)
+                for item, line in zip(cart_items, quote.lines)
+            ],
+            item_count=sum(item.quantity for item in cart_items),
         )
 
         order_items = []
-        for item in cart.cart_items.all():
+        for item, line in zip(cart_items, quote.lines):
             if item.product.quantity < item.quantity:
                 raise serializers.ValidationError(
                     f"Not enough stock for {item.product.name}. Available: {item.product.quantity}")
@@ -148,15 +309,17 @@ class OrderViewSet(CreateModelMixin, ListModelMixin, RetrieveModelMixin, Generic
                 order=order,
                 product=item.product,
                 quantity=item.quantity,
-                price=item.product.price * item.quantity
+                price=line.total
             )
             order_items.append(order_item)
 
             item.product.quantity -= item.quantity
-            item.product.save()
+            item.product.save(update_fields=['quantity'])
 
         OrderItem.objects.bulk_create(order_items)
         cart.cart_items.all().delete()
+        rollups.apply_order(order)
+        transaction.on_commit(lambda: recommendations.record_order(order), using=order._state.db)
 
 
 class OrderItemViewSet(ReadOnlyModelViewSet):
@@ -186,24 +349,336 @@ class CreatePaymentView(CreateAPIView):
     permission_classes = [IsAuthenticated]
 
     @swagger_auto_schema(
+        operation_description="Submit a payment for the latest pending order. The charge is made "
+                              "asynchronously by the payment worker; the order is marked Shipped once it "
+                              "completes. A failed payment can be submitted again.",
         responses={
-            201: openapi.Response("Payment processed successfully", PaymentSerializer),
+            201: openapi.Response("Payment submitted", PaymentSerializer),
             400: "No pending orders found for the user."
         }
     )
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
+
     def perform_create(self, serializer):
+        # The order stays locked until the payment is committed, so
+        # expire_pending_orders can't cancel and restock it in between.
+        with transaction.atomic(using=sharding.shard_for_user(self.request.user.pk)):
+            return self.submit(serializer)
+
+    def submit(self, serializer):
         user = self.request.user
-        latest_order = Order.objects.filter(user=user, status='Pending').order_by('-created_at').first()
+        latest_order = (
+            Order.objects.filter(user=user, status='Pending')
+            .exclude(payment__payment_status__in=['Pending', 'Processing', 'Completed'])
+            .select_for_update(of=('self',)).order_by('-created_at').first()
+        )
 
         if not latest_order:
             raise serializers.ValidationError("No pending orders found for the user.")
 
-        payment = serializer.save(order=latest_order)
+        failed = Payment.objects.filter(order=latest_order).first()
+        if failed is not None:
+            # Resubmitting a failed payment starts its attempts over.
+            serializer.instance = failed
+            return serializer.save(
+                payment_status='Pending', provider=settings.PAYMENT_DEFAULT_GATEWAY, attempts=0,
+                next_attempt_at=None, last_error='',
+            )
+        return serializer.save(order=latest_order)
+
+
+class ChunkedUploadViewSet(CreateModelMixin, RetrieveModelMixin, GenericViewSet):
+    """
+    Resumable uploads for large product media.
 
-        payment.payment_status = 'Completed'
-        payment.save()
+    POST creates an upload, PUT `chunks/<index>/` streams one chunk to disk,
+    GET reports which chunks have arrived and POST `complete/` verifies and
+    stores the file. The returned id can then be sent as `upload_id` when
+    creating or updating a product.
+    """
+    serializer_class = ChunkedUploadSerializer
+    permission_classes = [IsAdminUser]
 
-        latest_order.status = 'Shipped'
-        latest_order.save()
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False) or not self.request.user.is_authenticated:
+            return ChunkedUpload.objects.none()
+        return ChunkedUpload.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
 
-        return payment
+    @swagger_auto_schema(
+        operation_summary="Upload a Chunk",
+        operation_description="Send the raw bytes of one chunk as the request body.",
+        request_body=no_body,
+        manual_parameters=[
+            openapi.Parameter('X-Chunk-Checksum', openapi.IN_HEADER, type=openapi.TYPE_STRING,
+                              description="Optional hex sha256 of the chunk"),
+        ],
+    )
+    @action(detail=True, methods=['put'], url_path=r'chunks/(?P<index>\d+)')
+    def chunk(self, request, index=None, pk=None):
+        upload = self.get_object()
+        if upload.status == 'Complete':
+            raise serializers.ValidationError("Upload is already complete.")
+        if uploads.is_expired(upload):
+            raise serializers.ValidationError("Upload has expired; start a new one.")
+        if request.stream is None:
+            raise serializers.ValidationError("Chunk body is empty or has no Content-Length.")
+        # Read from the raw stream so the body is never buffered by a parser.
+        uploads.write_chunk(upload, int(index), request.stream, request.headers.get('X-Chunk-Checksum'))
+        return Response(self.get_serializer(upload).data)
+
+    @swagger_auto_schema(operation_summary="Complete an Upload", request_body=no_body)
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        upload = self.get_object()
+        if uploads.is_expired(upload):
+            raise serializers.ValidationError("Upload has expired; start a new one.")
+        if upload.status != 'Complete':
+            uploads.assemble(upload)
+        return Response(self.get_serializer(upload).data)
+
+
+EXPORT_PARAMETERS = [
+    openapi.Parameter('export_format', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['ndjson', 'csv'],
+                      description="Output format (default ndjson)"),
+    openapi.Parameter('date_from', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE,
+                      description="Only rows created on or after this date"),
+    openapi.Parameter('date_to', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE,
+                      description="Only rows created on or before this date"),
+]
+
+
+class ExportView(APIView):
+    """Base class for staff-only exports streamed as NDJSON or CSV; subclasses implement `rows()`."""
+    permission_classes = [IsAdminUser]
+    name = None
+    params_serializer_class = exports.ExportParamsSerializer
+    encoders = {}
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self, request, *args, **kwargs):
+        params = self.params_serializer_class(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        export_format = params.validated_data['export_format']
+
+        lines = self.encoders[export_format](self.rows(params.validated_data))
+        if isinstance(request._request, ASGIRequest):
+            lines = exports.async_lines(lines)
+        response = StreamingHttpResponse(lines, content_type=self.content_types[export_format])
+        filename = f"{self.name}-{timezone.now():%Y%m%d%H%M%S}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class OrderExportView(ExportView):
+    name = 'orders'
+    params_serializer_class = exports.OrderExportParamsSerializer
+    encoders = {'ndjson': exports.orders_ndjson, 'csv': exports.orders_csv}
+
+    def rows(self, params):
+        return exports.order_rows(params)
+
+    @swagger_auto_schema(
+        operation_summary="Export Orders",
+        operation_description="Stream orders with their items and payment. "
+                              "NDJSON has one order per line, CSV one order item per row.",
+        manual_parameters=EXPORT_PARAMETERS + [
+            openapi.Parameter('status', openapi.IN_QUERY, type=openapi.TYPE_STRING,
+                              description="Comma separated order statuses"),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ProductExportView(ExportView):
+    name = 'products'
+    params_serializer_class = exports.ProductExportParamsSerializer
+    encoders = {'ndjson': exports.products_ndjson, 'csv': exports.products_csv}
+
+    def rows(self, params):
+        return exports.product_rows(params)
+
+    @swagger_auto_schema(
+        operation_summary="Export Products",
+        manual_parameters=EXPORT_PARAMETERS + [
+            openapi.Parameter('category', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Filter by category id"),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class SalesAnalyticsView(APIView):
+    """Sales totals for staff dashboards, served from the daily rollups."""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Sales Analytics",
+        operation_description="Orders, units and revenue between two dates (default: the last 7 days), "
+                              "grouped by day, category, day and category, or the top products.",
+        manual_parameters=[
+            openapi.Parameter('date_from', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+            openapi.Parameter('date_to', openapi.IN_QUERY, type=openapi.TYPE_STRING, format=openapi.FORMAT_DATE),
+            openapi.Parameter('group_by', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=list(analytics.GROUPINGS)),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER,
+                              description="Number of top products (group_by=product)"),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        return Response(analytics.sales_report(request.query_params))
+
+
+class ProductAutocompleteView(APIView):
+    """Type-ahead suggestions served from the in-memory prefix index."""
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    @swagger_auto_schema(
+        operation_summary="Autocomplete Products",
+        operation_description="Products whose name or category has a word starting with `q`, "
+                              "most popular first.",
+        manual_parameters=[
+            openapi.Parameter('q', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="At most 50"),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 50)
+        except ValueError:
+            raise serializers.ValidationError({'limit': "A valid integer is required."})
+        return Response(product_index.search(request.query_params.get('q', ''), limit))
+
+
+class RecentTracesView(APIView):
+    """Recently sampled request traces (core.tracing) of the worker serving this request."""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Recent Request Traces",
+        operation_description="Traces kept in memory by this worker process, slowest first. Send X-Trace: 1 "
+                              "with a request to have it traced.",
+        manual_parameters=[
+            openapi.Parameter('min_ms', openapi.IN_QUERY, type=openapi.TYPE_NUMBER,
+                              description="Only traces that took at least this long"),
+            openapi.Parameter('limit', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, description="At most 200"),
+        ],
+    )
+    def get(self, request, *args, **kwargs):
+        try:
+            min_ms = float(request.query_params.get('min_ms', 0))
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), tracing.RECENT_TRACES)
+        except ValueError:
+            raise serializers.ValidationError("min_ms and limit must be numbers.")
+        traces = [trace for trace in list(tracing.recent) if trace.duration * 1000 >= min_ms]
+        traces.sort(key=lambda trace: trace.duration, reverse=True)
+        return Response([trace.as_dict() for trace in traces[:limit]])
+
+
+class ProfileView(APIView):
+    """Start a statistical profile of the worker serving this request (core.profiler)."""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Profile a Worker",
+        operation_description="Sample the stacks of every thread of this worker for `seconds` in the "
+                              "background, while it keeps serving requests. Fetch the collapsed-stack file "
+                              "from the returned id once the time is up.",
+        manual_parameters=[
+            openapi.Parameter('seconds', openapi.IN_QUERY, type=openapi.TYPE_NUMBER,
+                              description="Sampling duration (default 10, at most PROFILER_MAX_SECONDS)"),
+            openapi.Parameter('interval_ms', openapi.IN_QUERY, type=openapi.TYPE_NUMBER,
+                              description="Time between samples (default PROFILER_INTERVAL_MS, at least 1)"),
+            openapi.Parameter('idle', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN,
+                              description="Include threads blocked waiting"),
+        ],
+        responses={202: "The profile's id and worker", 409: "A profile is already running in this worker"},
+    )
+    def post(self, request, *args, **kwargs):
+        try:
+            seconds = min(max(float(request.query_params.get('seconds', 10)), 0.1), settings.PROFILER_MAX_SECONDS)
+            interval = max(float(request.query_params.get('interval_ms', settings.PROFILER_INTERVAL_MS)), 1) / 1000
+        except ValueError:
+            raise serializers.ValidationError("seconds and interval_ms must be numbers.")
+        include_idle = request.query_params.get('idle', '').lower() in ('1', 'true')
+        try:
+            profile = profiler.start(seconds, interval, include_idle)
+        except profiler.ProfilerBusy:
+            return Response({'detail': "A profile is already running in this worker."},
+                            status=status.HTTP_409_CONFLICT)
+        return Response(profile, status=status.HTTP_202_ACCEPTED)
+
+
+class ProfileResultView(APIView):
+    """Collapsed stacks of a finished profile."""
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        operation_summary="Profile Result",
+        operation_description="The collapsed-stack file of a finished profile, for flamegraph.pl or "
+                              "speedscope, or its status while it is still running.",
+        responses={200: "Collapsed stacks (text/plain)", 202: "Still running", 404: "Unknown or expired profile"},
+    )
+    def get(self, request, profile_id, *args, **kwargs):
+        profile = profiler.result(profile_id)
+        if profile is None:
+            raise Http404
+        if profile['status'] != 'done':
+            return Response(profile, status=status.HTTP_202_ACCEPTED if profile['status'] == 'running'
+                            else status.HTTP_500_INTERNAL_SERVER_ERROR)
+        response = HttpResponse(profile['collapsed'], content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = (
+            f'attachment; filename="profile-{profile["host"]}-{profile["pid"]}-{profile["id"][:8]}.collapsed"')
+        response['X-Profile-Samples'] = str(profile['samples'])
+        return response
+
+
+def _stream_user(request):
+    """JWT user from the Authorization header or, for EventSource clients, ?token=."""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else request.GET.get('token')
+    if not raw_token:
+        return None
+    return authentication.get_user(authentication.get_validated_token(raw_token))
+
+
+@require_GET
+async def event_stream(request):
+    """
+    Server-Sent Events with stock changes for ?products=<id>,<id>,... and,
+    when authenticated, status changes of the user's orders. Meant to be
+    served under ASGI (app.asgi), where an idle stream holds no thread.
+    """
+    try:
+        product_ids = sorted({int(value) for value in request.GET.get('products', '').split(',') if value.strip()})
+    except ValueError:
+        return JsonResponse({'products': ["A comma separated list of product ids is required."]}, status=400)
+    if len(product_ids) > settings.EVENTS_MAX_PRODUCTS:
+        return JsonResponse(
+            {'products': [f"At most {settings.EVENTS_MAX_PRODUCTS} products can be watched."]}, status=400)
+
+    try:
+        user = await sync_to_async(_stream_user)(request)
+    except (AuthenticationFailed, InvalidToken):
+        return JsonResponse({'detail': "Given token not valid."}, status=401)
+
+    channels = [events.product_channel(product_id) for product_id in product_ids]
+    if user is not None:
+        channels.append(events.user_channel(user.id))
+    if not channels:
+        return JsonResponse({'detail': "Watch at least one product or authenticate."}, status=400)
+
+    stock = await sync_to_async(list)(Product.objects.filter(id__in=product_ids).values_list('id', 'quantity'))
+    response = StreamingHttpResponse(
+        events.stream(channels, [events.stock_message(*row) for row in stock]),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response